@@ -0,0 +1,305 @@
+from glob import glob
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+try:
+   # shares the parsed csv cache with the scripts in file_scripts when that folder is on PYTHONPATH
+   from csv_cache import read_csv
+except ImportError:
+   from pandas import read_csv
+
+"""
+Computes AOI transitions straight from AOI tagged gaze data (tag_aois.py output) instead of
+the *AOI_Transitions.csv files made by the Per_AOI_Data_Compiler round trip. The files written
+here have the same columns, so transition_heatmap.py can draw them.
+
+Gaze samples are collapsed to one row per fixation (the last sample of each FPOGID, which holds
+the final fixation position and duration) and every pair of consecutive fixations is one
+transition from the AOI of the first to the AOI of the second. Fixations outside of the AOI
+list (no AOI, blank label) break the chain: no transition is counted into or out of them.
+
+   Transition Count                         transitions from row AOI to column AOI
+   Proportion including self-transitions    count / all transitions
+   Proportion excluding self-transitions    count / transitions between different AOIs,
+                                            0 for an AOI to itself
+"""
+
+COLUMNS = [
+   "AOI Pair",
+   "Transition Count",
+   "Proportion including self-transitions",
+   "Proportion excluding self-transitions"
+]
+
+
+def fixation_sequence(
+      data: pd.DataFrame,
+      id_col: str = "FPOGID",
+      valid_col: str = "FPOGV"
+) -> pd.DataFrame:
+   """
+   Collapses gaze samples to one row per fixation, keeping the last sample of each fixation.
+
+   Parameters:
+      data (DataFrame): gaze samples in recording order
+      id_col (str): fixation id column
+      valid_col (str): samples are only used where this column is 1, skipped if the column is missing
+
+   Returns:
+      one row per fixation in recording order
+   """
+   if valid_col in data.columns:
+      data = data[data[valid_col] == 1]
+   ids = data[id_col].to_numpy()
+   # a fixation ends where the next sample has a different id
+   last = np.ones(len(ids), dtype=bool)
+   last[:-1] = ids[1:] != ids[:-1]
+   return data[last]
+
+
+def encode_aois(labels, aois: list[str]) -> np.ndarray:
+   """
+   Turns AOI labels into their position in aois, -1 for labels that are not in aois.
+   """
+   return pd.Index(aois).get_indexer(pd.Series(labels, dtype=object).fillna('').astype(str).str.strip())
+
+
+def transition_pairs(codes: np.ndarray, size: int) -> tuple[np.ndarray, np.ndarray]:
+   """
+   Encodes each pair of consecutive fixations as from * size + to.
+
+   Returns:
+      (pairs, positions) where positions is the index in codes of the fixation each transition ends on.
+      Transitions into or out of a fixation that is not in the AOI list are left out.
+   """
+   origin, target = codes[:-1], codes[1:]
+   known = (origin >= 0) & (target >= 0)
+   return origin[known] * size + target[known], np.flatnonzero(known) + 1
+
+
+def transition_counts(codes: np.ndarray, size: int) -> np.ndarray:
+   """
+   Counts the transitions between consecutive fixations.
+
+   Parameters:
+      codes (ndarray): AOI position of each fixation, see encode_aois
+      size (int): number of AOIs
+
+   Returns:
+      size x size matrix, row i column j is the number of transitions from AOI i to AOI j
+   """
+   pairs, _ = transition_pairs(np.asarray(codes), size)
+   return np.bincount(pairs, minlength=size * size).reshape(size, size)
+
+
+def transition_proportions(counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+   """
+   Returns:
+      (including, excluding) proportions of self-transitions, see the module notes. Both are 0
+      when there are no transitions to divide by.
+   """
+   counts = np.asarray(counts, dtype=float)
+   total = counts.sum(axis=(-2, -1), keepdims=True)
+   others = counts.copy()
+   diagonal = np.arange(counts.shape[-1])
+   others[..., diagonal, diagonal] = 0
+   others_total = others.sum(axis=(-2, -1), keepdims=True)
+   including = np.divide(counts, total, out=np.zeros_like(counts), where=total > 0)
+   excluding = np.divide(others, others_total, out=np.zeros_like(others), where=others_total > 0)
+   return including, excluding
+
+
+def window_counts(
+      codes: np.ndarray,
+      times: np.ndarray,
+      size: int,
+      window: float,
+      step: float = None
+) -> tuple[np.ndarray, np.ndarray]:
+   """
+   Counts transitions in time windows. A transition belongs to the window that holds the start
+   time of the fixation it ends on. Windows are [start, start + window).
+
+   Parameters:
+      codes (ndarray): AOI position of each fixation, see encode_aois
+      times (ndarray): start time of each fixation in seconds, increasing
+      size (int): number of AOIs
+      window (float): window length in seconds
+      step (float): seconds between window starts, defaults to window (windows that do not overlap)
+
+   Returns:
+      (starts, counts) where counts[w] is the size x size matrix of window w
+   """
+   step = step or window
+   times = np.asarray(times, dtype=float)
+   if len(times) < 2:
+      return np.empty(0), np.zeros((0, size, size), dtype=np.int64)
+   starts = np.arange(times[0], times[-1] + step, step)
+   starts = starts[starts <= times[-1]]
+   pairs, positions = transition_pairs(np.asarray(codes), size)
+   pair_times = times[positions]
+
+   # sorting on pair then time puts each pair's transitions in one increasing run, so two
+   # searchsorted calls count a pair in every window at once. The times are compared as they
+   # are, so fixations that start right on a window edge land in the same window as in a loop
+   order = np.lexsort((pair_times, pairs))
+   pairs, pair_times = pairs[order], pair_times[order]
+   bounds = np.searchsorted(pairs, np.arange(size * size + 1), side='left')
+   counts = np.zeros((len(starts), size * size), dtype=np.int64)
+   ends = starts + window
+   for pair in np.flatnonzero(np.diff(bounds)):
+      run = pair_times[bounds[pair]:bounds[pair + 1]]
+      counts[:, pair] = np.searchsorted(run, ends, side='left') - np.searchsorted(run, starts, side='left')
+   return starts, counts.reshape(len(starts), size, size)
+
+
+def transition_table(counts: np.ndarray, aois: list[str]) -> pd.DataFrame:
+   """
+   Lays out a count matrix like the *AOI_Transitions.csv files, one row per AOI pair.
+   """
+   including, excluding = transition_proportions(counts)
+   return pd.DataFrame({
+      COLUMNS[0]: [f"{a} -> {b}" for a in aois for b in aois],
+      COLUMNS[1]: np.asarray(counts).ravel(),
+      COLUMNS[2]: including.ravel(),
+      COLUMNS[3]: excluding.ravel()
+   })
+
+
+def read_fixations(in_file: str) -> pd.DataFrame:
+   """
+   Reads an AOI tagged gaze file and collapses it to fixations.
+   """
+   return fixation_sequence(read_csv(in_file))
+
+
+def fixation_times(fixations: pd.DataFrame) -> np.ndarray:
+   """
+   Start time of each fixation in seconds. Uses FPOGS, or the sample time if it is missing.
+   GazePoint names the sample time column after the recording date, e.g. TIME(2023/03/01 10:15:00.000).
+   """
+   if "FPOGS" in fixations.columns:
+      return fixations["FPOGS"].to_numpy(dtype=float)
+   for col in fixations.columns:
+      if str(col).startswith("TIME"):
+         return fixations[col].to_numpy(dtype=float)
+   raise KeyError("no FPOGS or TIME column found")
+
+
+def file_aois(fixations: pd.DataFrame, aoi_col: str = "AOI") -> list[str]:
+   """
+   AOI labels found in the data, sorted. Blank labels are not AOIs.
+   """
+   labels = fixations[aoi_col].dropna().astype(str).str.strip()
+   return sorted(set(labels[labels != '']))
+
+
+def transitions_file(in_file: str, out_file: str, aois: list[str] = None, aoi_col: str = "AOI") -> np.ndarray:
+   """
+   Writes the transitions of one AOI tagged gaze file.
+
+   Parameters:
+      in_file (str): tag_aois.py output file
+      out_file (str): where to save the transitions
+      aois (list[str]): AOIs to count, in output order. Defaults to the AOIs found in the file
+      aoi_col (str): column with the AOI labels
+
+   Returns:
+      the count matrix
+   """
+   fixations = read_fixations(in_file)
+   aois = aois or file_aois(fixations, aoi_col)
+   counts = transition_counts(encode_aois(fixations[aoi_col], aois), len(aois))
+   transition_table(counts, aois).to_csv(out_file, index=False)
+   return counts
+
+
+def window_file(
+      in_file: str,
+      out_file: str,
+      window: float,
+      step: float = None,
+      aois: list[str] = None,
+      aoi_col: str = "AOI"
+) -> np.ndarray:
+   """
+   Writes the transitions of one AOI tagged gaze file per time window, see window_counts.
+   The output has a Window Start and Window End column (seconds since the first fixation)
+   in front of the *AOI_Transitions.csv columns.
+
+   Returns:
+      the count matrix of every window
+   """
+   fixations = read_fixations(in_file)
+   aois = aois or file_aois(fixations, aoi_col)
+   times = fixation_times(fixations)
+   starts, counts = window_counts(encode_aois(fixations[aoi_col], aois), times, len(aois), window, step)
+   tables = []
+   for start, matrix in zip(starts - (times[0] if len(times) else 0), counts):
+      table = transition_table(matrix, aois)
+      table.insert(0, "Window End", start + window)
+      table.insert(0, "Window Start", start)
+      tables.append(table)
+   result = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=["Window Start", "Window End"] + COLUMNS)
+   result.to_csv(out_file, index=False)
+   return counts
+
+
+def transitions_directory(
+      in_dir: str,
+      out_dir: str,
+      in_pattern: str = "*all_gaze.csv",
+      aois: list[str] = None,
+      window: float = None,
+      step: float = None
+) -> int:
+   """
+   Writes <PID>_AOI_Transitions.csv for every AOI tagged gaze file in a directory.
+
+   Parameters:
+      in_dir (str): directory to search through, including sub directories
+      out_dir (str): directory to save the transition files to
+      in_pattern (str): glob pattern of the gaze files
+      aois (list[str]): AOIs to count, in output order. Use the same list for every participant
+         so the files line up, e.g. transition_heatmap.read_aois_from_file(aoi_csv)
+      window (float): optional window length in seconds, writes <PID>_AOI_Window_Transitions.csv instead
+      step (float): seconds between window starts, defaults to window
+
+   Returns:
+      number of files written
+   """
+   os.makedirs(out_dir, exist_ok=True)
+   in_files = []
+   for dir, _, _ in os.walk(in_dir):
+      in_files.extend(glob(os.path.join(dir, in_pattern)))
+
+   for in_file in sorted(in_files):
+      pid = os.path.basename(in_file).split("_")[0]
+      if window:
+         window_file(in_file, os.path.join(out_dir, f"{pid}_AOI_Window_Transitions.csv"), window, step, aois)
+      else:
+         transitions_file(in_file, os.path.join(out_dir, f"{pid}_AOI_Transitions.csv"), aois)
+   print(f"Wrote transitions for {len(in_files)} files to {out_dir}")
+   return len(in_files)
+
+
+if __name__ == '__main__':
+   """
+   Parameters:
+      argv[1] directory of AOI tagged gaze files (tag_aois.py output)
+      argv[2] directory to save the transition files to
+      argv[3] optional single line csv with the AOI list, see transition_heatmap.read_aois_from_file
+      argv[4] optional window length in seconds
+      argv[5] optional seconds between window starts
+   """
+   import transition_heatmap as th
+   aoi_list = th.read_aois_from_file(sys.argv[3]) if len(sys.argv) > 3 else None
+   transitions_directory(
+      sys.argv[1],
+      sys.argv[2],
+      aois=aoi_list,
+      window=float(sys.argv[4]) if len(sys.argv) > 4 else None,
+      step=float(sys.argv[5]) if len(sys.argv) > 5 else None
+   )
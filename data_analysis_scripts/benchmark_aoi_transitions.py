@@ -0,0 +1,92 @@
+import sys
+from time import perf_counter
+import numpy as np
+import aoi_transitions as at
+
+"""
+Checks aoi_transitions.window_counts against counting every window with a loop, on random
+fixation sequences, on cases with fixations outside of the AOI list at the end and on fixation times
+on a grid that start right on window edges, and times both.
+
+Parameters:
+   argv[1..n] optional fixation counts to test (default 2000 8000)
+"""
+
+
+def window_counts_by_loop(codes: np.ndarray, times: np.ndarray, size: int, window: float, step: float = None) -> tuple[np.ndarray, np.ndarray]:
+   """
+   Reference implementation of window_counts, one window and one transition at a time.
+   """
+   step = step or window
+   starts = np.arange(times[0], times[-1] + step, step)
+   starts = starts[starts <= times[-1]]
+   counts = np.zeros((len(starts), size, size), dtype=np.int64)
+   for w, start in enumerate(starts):
+      for i in range(1, len(codes)):
+         if codes[i - 1] >= 0 and codes[i] >= 0 and start <= times[i] < start + window:
+            counts[w, codes[i - 1], codes[i]] += 1
+   return starts, counts
+
+
+def check(codes, times, size: int, window: float, step: float = None) -> bool:
+   codes, times = np.asarray(codes), np.asarray(times, dtype=float)
+   starts, counts = at.window_counts(codes, times, size, window, step)
+   reference_starts, reference = window_counts_by_loop(codes, times, size, window, step)
+   return np.array_equal(starts, reference_starts) and np.array_equal(counts, reference)
+
+
+def check_grid(trials: int = 300, count: int = 200, size: int = 7) -> int:
+   """
+   Fixation times rounded to a 0.5 s grid (from a random recording start) and to 0.1 s, with windows
+   of 5 s every 2.5 s and tumbling windows, so a lot of fixations start right on a window edge.
+   Returns the number of window layouts that differ.
+   """
+   wrong = 0
+   for trial in range(trials):
+      rng = np.random.default_rng(trial)
+      codes = rng.integers(-1, size, count)
+      elapsed = np.cumsum(rng.gamma(2.0, 0.4, count))
+      for times in (np.round(elapsed * 2) / 2 + rng.uniform(0, 1000), np.round(elapsed, 1)):
+         for step in (2.5, None):
+            wrong += not check(codes, times, size, 5.0, step)
+   return wrong
+
+
+def run(count: int, size: int = 7, window: float = 30.0, step: float = 5.0):
+   rng = np.random.default_rng(count)
+   codes = rng.integers(-1, size, count)
+   times = np.cumsum(rng.gamma(2.0, 0.2, count))
+
+   start = perf_counter()
+   _, reference = window_counts_by_loop(codes, times, size, window, step)
+   loop_time = perf_counter() - start
+   start = perf_counter()
+   _, counts = at.window_counts(codes, times, size, window, step)
+   numpy_time = perf_counter() - start
+
+   matches = np.array_equal(counts, reference)
+   print(f"{count:>7} fixations, {len(counts)} windows | loop {loop_time:8.3f}s | numpy {numpy_time:7.4f}s | "
+         f"speedup {loop_time / numpy_time:7.1f}x | output matches: {matches}")
+   if not matches:
+      raise AssertionError(f"window_counts differs from the reference for {count} fixations")
+
+
+if __name__ == '__main__':
+   # fixations outside of the AOI list after the last transition
+   cases = [
+      ([0, 1, 0, 1, -1, -1, -1, -1], [0, 1, 2, 3, 20, 40, 60, 80], 2, 5.0, None),
+      ([0, 1, 0, 1, -1, -1, -1, -1], [0, 1, 2, 3, 20, 40, 60, 80], 2, 5.0, 1.0),
+      ([1, 1, -1, -1], [0, 0.5, 30, 31], 3, 2.0, 0.5),
+      ([0, -1], [0, 10], 2, 1.0, None),
+   ]
+   for case in cases:
+      if not check(*case):
+         raise AssertionError(f"window_counts differs from the reference for {case}")
+   print(f"{len(cases)} trailing non-AOI cases match")
+   wrong = check_grid()
+   print(f"grid aligned times: {wrong} of 1200 window layouts differ")
+   if wrong:
+      raise AssertionError(f"window_counts differs from the reference on {wrong} grid aligned layouts")
+   sizes = [int(n) for n in sys.argv[1:]] or [2000, 8000]
+   for n in sizes:
+      run(n)
@@ -1,4 +1,7 @@
 import csv
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 from glob import glob
 import os
@@ -9,7 +12,15 @@ import matplotlib.pyplot as plt
 from PIL import Image
 from textwrap import wrap
 
+try:
+   # shares the parsed csv cache with the scripts in file_scripts when that folder is on PYTHONPATH
+   from csv_cache import read_csv
+except ImportError:
+   from pandas import read_csv
+
 metric = 'Proportion excluding self-transitions'
+# remembers what each heatmap in an output directory was drawn from, see cached_heatmap
+RENDER_CACHE_NAME = ".heatmap_cache.json"
 
 class Masks(Enum):
    NONE = 0
@@ -17,7 +28,7 @@ class Masks(Enum):
    UPPER_TRI = 2
    LOWER_TRI = 3
 
-def parse_transitions(in_csv: str, aois: list[str]) -> pd.DataFrame:
+def parse_transitions(in_csv: str, aois: list[str], metric_col: str = None) -> pd.DataFrame:
    """
    Parses transition feature results to create tabular data for heat map. 
    Each cell is a the number of transitions that occurred from row AOI to
@@ -26,17 +37,33 @@ def parse_transitions(in_csv: str, aois: list[str]) -> pd.DataFrame:
    Parameters:
       in_csv (str): path to input csv with transitions
       aois (list[str]): list of AOI names
+      metric_col (str): column to fill the cells with, defaults to metric
 
    Returns:
       transitions organized in a heatmap table
    """
-   all_data = pd.read_csv(in_csv, header=0)
-   hm_table = pd.DataFrame(index=aois, columns=aois,).infer_objects(copy=False).replace(np.nan, 0)
+   return pd.DataFrame(transition_matrix(in_csv, aois, metric_col), index=aois, columns=aois)
+
 
-   for index, row in all_data.iterrows():
-      aoi_pair = [aoi.strip() for aoi in row['AOI Pair'].split('->')]
-      hm_table.at[aoi_pair[0], aoi_pair[1]] = row[metric]
-   return hm_table
+def transition_matrix(in_csv: str, aois: list[str], metric_col: str = None) -> np.ndarray:
+   """
+   Same as parse_transitions but returns a plain array. Row i, column j holds the
+   transitions from aois[i] to aois[j]. Pairs with an AOI that is not in aois are ignored.
+   """
+   all_data = read_csv(in_csv, header=0)
+   matrix = np.zeros((len(aois), len(aois)))
+   if all_data.empty:
+      return matrix
+
+   # "from -> to" split for the whole column, then each name is turned into its position in aois
+   pairs = all_data['AOI Pair'].astype(str).str.split('->', n=1, expand=True).reindex(columns=[0, 1])
+   names = pd.Index(aois)
+   rows = names.get_indexer(pairs[0].str.strip())
+   cols = names.get_indexer(pairs[1].str.strip())
+   known = (rows >= 0) & (cols >= 0)
+   values = all_data[metric_col or metric].to_numpy(dtype=float)
+   matrix[rows[known], cols[known]] = values[known]
+   return matrix
 
 
 def read_aois_from_file(in_file: str) -> list[str]:
@@ -55,7 +82,16 @@ def read_aois_from_file(in_file: str) -> list[str]:
       return next(csv_reader)
 
 
-def draw_heatmap(tabular_hm: pd.DataFrame, out_file: str, top_title="heatmap", show: bool=False, apply_mask: Masks=Masks.NONE) -> str:
+def draw_heatmap(
+      tabular_hm: pd.DataFrame,
+      out_file: str,
+      top_title="heatmap",
+      show: bool=False,
+      apply_mask: Masks=Masks.NONE,
+      vmin: float=0,
+      vmax: float=.5,
+      dpi: int=300
+) -> str:
    mask = np.zeros_like(tabular_hm)
    if apply_mask == Masks.DIAGONAL:
       np.fill_diagonal(mask, 1)
@@ -63,7 +99,7 @@ def draw_heatmap(tabular_hm: pd.DataFrame, out_file: str, top_title="heatmap", s
       mask = np.triu(np.ones_like(mask))
    elif apply_mask == Masks.LOWER_TRI:
       mask = np.tril(np.ones_like(mask))
-   figure = sns.heatmap(tabular_hm, cmap='Blues', annot=True, mask=mask, vmin=0, vmax=.5)
+   figure = sns.heatmap(tabular_hm, cmap='Blues', annot=True, mask=mask, vmin=vmin, vmax=vmax)
    plt.rcParams.update({'axes.titlesize':16})
    # use commented line if not setting specific title breaks
    # figure.set_title('\n'.join(wrap(top_title,40)), pad=25)
@@ -71,13 +107,92 @@ def draw_heatmap(tabular_hm: pd.DataFrame, out_file: str, top_title="heatmap", s
    figure.xaxis.tick_top()
    figure.tick_params(length=0)
    plt.tight_layout()
-   plt.savefig(out_file, dpi=300)
+   plt.savefig(out_file, dpi=dpi)
    if show:
       plt.show()
    plt.clf() # clear figure for next run
    return out_file
 
 
+def render_key(
+      tabular_hm: pd.DataFrame,
+      top_title: str,
+      apply_mask: Masks,
+      vmin: float,
+      vmax: float,
+      dpi: int
+) -> str:
+   """
+   Hash of everything that changes how a heatmap looks: the values, AOI labels, title, mask,
+   colour limits and dpi.
+   """
+   settings = [list(map(str, tabular_hm.index)), list(map(str, tabular_hm.columns)), top_title, apply_mask.name, vmin, vmax, dpi]
+   sha = hashlib.sha256(json.dumps(settings).encode())
+   sha.update(np.ascontiguousarray(tabular_hm.to_numpy(dtype=float)).tobytes())
+   return sha.hexdigest()
+
+
+def cached_heatmap(
+      tabular_hm: pd.DataFrame,
+      out_file: str,
+      top_title="heatmap",
+      show: bool=False,
+      apply_mask: Masks=Masks.NONE,
+      vmin: float=0,
+      vmax: float=.5,
+      dpi: int=300,
+      previous_key: str=None
+) -> tuple[str, bool]:
+   """
+   Same as draw_heatmap but only draws when out_file is missing or previous_key (the key
+   out_file was last drawn with) differs from the key of this heatmap. With show a heatmap that
+   is not drawn again is shown from out_file instead.
+
+   Returns:
+      the render key of the heatmap, to be saved for the next run, and whether it was drawn
+   """
+   key = render_key(tabular_hm, top_title, apply_mask, vmin, vmax, dpi)
+   if key != previous_key or not os.path.exists(out_file):
+      draw_heatmap(tabular_hm, out_file, top_title, show, apply_mask, vmin, vmax, dpi)
+      return key, True
+   if show:
+      show_png(out_file)
+   return key, False
+
+
+def show_png(png_file: str):
+   """
+   Shows an already drawn heatmap in a matplotlib window.
+   """
+   with Image.open(png_file) as image:
+      plt.imshow(image)
+   plt.axis('off')
+   plt.tight_layout(pad=0)
+   plt.show()
+   plt.close()
+
+
+def read_render_cache(out_dir: str) -> dict:
+   cache_file = os.path.join(out_dir, RENDER_CACHE_NAME)
+   if not os.path.exists(cache_file):
+      return {"pages": {}}
+   try:
+      with open(cache_file, 'r') as f:
+         cache = json.load(f)
+      cache.setdefault("pages", {})
+      return cache
+   except ValueError: # corrupt cache, draw everything again
+      return {"pages": {}}
+
+
+def write_render_cache(out_dir: str, cache: dict):
+   cache_file = os.path.join(out_dir, RENDER_CACHE_NAME)
+   # write then rename so an interrupted run never leaves half a file behind
+   with open(cache_file + ".part", 'w') as f:
+      json.dump(cache, f, indent=1)
+   os.replace(cache_file + ".part", cache_file)
+
+
 def draw_directory(
       in_dir: str,
       aoi_csv: str,
@@ -85,7 +200,12 @@ def draw_directory(
       title: str="Transitions",
       include: str="",
       exclude: str="",
-      apply_mask: Masks=Masks.NONE
+      apply_mask: Masks=Masks.NONE,
+      workers: int=1,
+      vmin: float=0,
+      vmax: float=.5,
+      dpi: int=300,
+      force: bool=False
    ):
    """
    Creates a heatmap for all transition files in a directory.
@@ -97,6 +217,11 @@ def draw_directory(
    title(str): heatmap title
    include(str): filename wild cards to include
    exclude(str): filename wild cards to exclude
+   workers(int): number of processes drawing heatmaps at the same time
+   vmin(float), vmax(float): colour limits
+   dpi(int): resolution of the png files
+   force(bool): draw every heatmap even if it has not changed since the last run, the cache
+      entries of other heatmaps in out_dir are kept
    """
    in_files = []
 
@@ -104,21 +229,73 @@ def draw_directory(
       in_files.extend(glob_filter(dir, include, exclude))
 
    in_files.sort()
-   drawings = [] 
+   aois = read_aois_from_file(aoi_csv)
+   cache = read_render_cache(out_dir)
+   jobs = []
    for f in in_files:
       id = os.path.basename(f).split('_')[0]
       chart_title = f"{id} {title}"
-      aois = read_aois_from_file(aoi_csv)  
-      df = parse_transitions(f, aois)
       out_file = os.path.join(out_dir, chart_title.replace(" ", "_") + ".png")
-      drawings.append(Image.open(draw_heatmap(df, out_file, chart_title, apply_mask=apply_mask)))
-
+      previous_key = None if force else cache["pages"].get(os.path.basename(out_file))
+      jobs.append((f, aois, out_file, chart_title, apply_mask, vmin, vmax, dpi, previous_key))
+
+   if workers > 1 and len(jobs) > 1:
+      with ProcessPoolExecutor(max_workers=workers, initializer=plt.switch_backend, initargs=('Agg',)) as pool:
+         results = list(pool.map(draw_file_job, *zip(*jobs)))
+   else:
+      results = [draw_file_job(*job) for job in jobs]
+
+   if not jobs:
+      print(f"No transition files found in {in_dir}")
+      return
+   drawings = [job[2] for job in jobs]
+   keys = [key for key, _ in results]
+   redrawn = sum(drawn for _, drawn in results)
+   print(f"Drew {redrawn} heatmaps, reused {len(jobs) - redrawn} that did not change")
+   cache["pages"].update({os.path.basename(f): key for f, key in zip(drawings, keys)})
+
+   # the pdf only changes when a page is added, removed, reordered or redrawn
    pdf_path = os.path.join(out_dir, "all_heatmaps.pdf")
-   drawings[0].save(
-      pdf_path, "PDF" ,resolution=100.0, save_all=True, append_images=drawings[1:]
+   pdf_key = hashlib.sha256(json.dumps(keys).encode()).hexdigest()
+   if pdf_key != cache.get("pdf") or not os.path.exists(pdf_path):
+      write_pdf(drawings, pdf_path)
+      cache["pdf"] = pdf_key
+   write_render_cache(out_dir, cache)
+
+
+def draw_file_job(
+      in_file: str,
+      aois: list[str],
+      out_file: str,
+      chart_title: str,
+      apply_mask: Masks,
+      vmin: float,
+      vmax: float,
+      dpi: int,
+      previous_key: str
+) -> tuple[str, bool]:
+   """
+   Draws the heatmap of one transition file if it changed, see cached_heatmap.
+   Runs in the worker processes of draw_directory.
+   """
+   return cached_heatmap(
+      parse_transitions(in_file, aois), out_file, chart_title,
+      apply_mask=apply_mask, vmin=vmin, vmax=vmax, dpi=dpi, previous_key=previous_key
    )
 
 
+def write_pdf(images: list[str], pdf_path: str):
+   """
+   Combines image files into one pdf, one page per image. The pages are added one at a time
+   so only one image is open at once.
+   """
+   part_path = pdf_path + ".part"
+   for i, image_file in enumerate(images):
+      with Image.open(image_file) as page:
+         page.save(part_path, "PDF", resolution=100.0, append=i > 0)
+   os.replace(part_path, pdf_path)
+
+
 def glob_filter(dir: str, add_pattern: str, remove_pattern: str) -> list[str]:
    """
    Returns list of files in a directory that match a pattern and do not match
@@ -145,8 +322,14 @@ def avg_directory(
       title: str="Average Transitions",
       include: str="",
       exclude: str="",
-      apply_mask: Masks=Masks.NONE
-):
+      apply_mask: Masks=Masks.NONE,
+      median: str=None,
+      vmin: float=0,
+      vmax: float=.5,
+      dpi: int=300,
+      force: bool=False,
+      show: bool=True
+) -> 'TransitionStats':
    """
    Creates a heatmap of averages of transition data from a directory.
 
@@ -157,6 +340,14 @@ def avg_directory(
    title(str): heatmap title
    include(str): filename wild cards to include
    exclude(str): filename wild cards to exclude
+   median(str): None, 'exact' or 'approx', see TransitionStats
+   vmin(float), vmax(float): colour limits
+   dpi(int): resolution of the png file
+   force(bool): draw the heatmap even if it has not changed since the last run
+   show(bool): show the heatmap in a matplotlib window, from out_file if it has not changed
+
+   Returns:
+   TransitionStats with the mean, standard deviation, count, min/max (and median) of every cell
    """
    aois = read_aois_from_file(aoi_csv)
 
@@ -165,13 +356,151 @@ def avg_directory(
    for dir,_,_ in os.walk(in_dir):
       in_files.extend(glob_filter(dir, include, exclude))
 
-   hm_table = pd.DataFrame(index=aois, columns=aois).infer_objects(copy=False).replace(np.nan, 0)
+   stats = TransitionStats(aois, len(in_files), median)
    for file in in_files:
-      hm_table = hm_table.add(parse_transitions(file, aois))
+      stats.add(transition_matrix(file, aois))
+
+   hm_table = stats.table(stats.mean()).round(2)
+   out_dir = os.path.dirname(os.path.abspath(out_file))
+   cache = read_render_cache(out_dir)
+   cache["pages"][os.path.basename(out_file)], _ = cached_heatmap(
+      hm_table, out_file, title, show, apply_mask, vmin, vmax, dpi,
+      previous_key=None if force else cache["pages"].get(os.path.basename(out_file))
+   )
+   write_render_cache(out_dir, cache)
+   return stats
+
+
+class TransitionStats:
+   """
+   Statistics for every cell of a set of transition tables, collected one table at a time
+   so the files only have to be read once. Missing values (NaN) are skipped.
+
+   The median is optional. 'exact' keeps every table, 'approx' keeps a histogram per cell
+   and interpolates the median inside the bin that holds it. The histogram starts out over
+   value_range and doubles its range (merging pairs of bins) whenever a value falls outside of
+   it, so counts work as well as proportions.
+   """
+
+   def __init__(self, aois: list[str], expected: int = 0, median: str = None,
+                value_range: tuple[float, float] = (0.0, 1.0), bins: int = 200):
+      """
+      Parameters:
+         aois (list[str]): AOI names, the rows and columns of each table
+         expected (int): number of tables that will be added, used to size the exact median storage
+         median (str): None, 'exact' or 'approx'
+         value_range (tuple): lowest and highest value the approx median histogram starts with
+         bins (int): number of histogram bins for the approx median, an even number
+      """
+      if median not in (None, 'exact', 'approx'):
+         raise ValueError(f"median must be None, 'exact' or 'approx', not {median}")
+      if median == 'approx' and (bins < 2 or bins % 2):
+         raise ValueError(f"bins must be an even number, not {bins}")
+      size = len(aois)
+      self.aois = aois
+      self.median_mode = median
+      self.tables = 0
+      self.count = np.zeros((size, size), dtype=np.int64)
+      self.min = np.full((size, size), np.nan)
+      self.max = np.full((size, size), np.nan)
+      # running mean and sum of squared differences from it (Welford), stable for any number of tables
+      self._mean = np.zeros((size, size))
+      self._m2 = np.zeros((size, size))
+      if median == 'exact':
+         self._values = np.full((max(expected, 1), size, size), np.nan)
+      elif median == 'approx':
+         self._low, high = value_range
+         self._bin_width = (high - self._low) / bins
+         self._hist = np.zeros((size * size, bins), dtype=np.int64)
+
+
+   def add(self, matrix: np.ndarray):
+      """
+      Adds one transition table (as returned by transition_matrix).
+      """
+      matrix = np.asarray(matrix, dtype=float)
+      valid = ~np.isnan(matrix)
+      self.count += valid
+      delta = np.where(valid, matrix - self._mean, 0.0)
+      self._mean += delta / np.maximum(self.count, 1)
+      self._m2 += np.where(valid, delta * (matrix - self._mean), 0.0)
+      self.min = np.fmin(self.min, matrix)
+      self.max = np.fmax(self.max, matrix)
+
+      if self.median_mode == 'exact':
+         if self.tables == len(self._values): # more tables than expected, double the storage
+            self._values = np.concatenate((self._values, np.full_like(self._values, np.nan)))
+         self._values[self.tables] = matrix
+      elif self.median_mode == 'approx':
+         cells = np.flatnonzero(valid.ravel())
+         values = matrix.ravel()[cells]
+         if len(values):
+            self._grow_histogram(values.min(), values.max())
+         bins = self._hist.shape[1]
+         # the highest value of the range goes in the last bin
+         position = np.floor((values - self._low) / self._bin_width)
+         self._hist[cells, np.clip(position, 0, bins - 1).astype(np.intp)] += 1
+      self.tables += 1
+
+
+   def _grow_histogram(self, low: float, high: float):
+      """
+      Doubles the range of the approx median histogram until it holds low and high. Pairs of
+      bins are merged and the other half of the bins start out empty.
+      """
+      if not (np.isfinite(low) and np.isfinite(high)):
+         raise ValueError("the approx median can not hold infinite values")
+      bins = self._hist.shape[1]
+      while low < self._low or high > self._low + bins * self._bin_width:
+         merged = self._hist[:, 0::2] + self._hist[:, 1::2]
+         if low < self._low:
+            self._hist = np.concatenate((np.zeros_like(merged), merged), axis=1)
+            self._low -= bins * self._bin_width
+         else:
+            self._hist = np.concatenate((merged, np.zeros_like(merged)), axis=1)
+         self._bin_width *= 2
+
+
+   def mean(self) -> np.ndarray:
+      return np.where(self.count > 0, self._mean, np.nan)
+
+
+   def var(self, ddof: int = 1) -> np.ndarray:
+      return np.where(self.count > ddof, self._m2 / np.maximum(self.count - ddof, 1), np.nan)
+
+
+   def std(self, ddof: int = 1) -> np.ndarray:
+      return np.sqrt(self.var(ddof))
+
+
+   def median(self) -> np.ndarray:
+      if self.median_mode == 'exact':
+         values = self._values[:self.tables]
+         result = np.full(self.count.shape, np.nan)
+         # nanmedian warns on cells without values, only ask for the ones that have some
+         has_values = self.count > 0
+         result[has_values] = np.nanmedian(values[:, has_values], axis=0)
+         return result
+      if self.median_mode == 'approx':
+         counts = self.count.ravel()
+         cumulative = np.cumsum(self._hist, axis=1)
+         half = counts / 2
+         # first bin where half of the values have been seen, then interpolate inside that bin
+         bin_index = np.argmax(cumulative >= half[:, None], axis=1)
+         rows = np.arange(len(counts))
+         before = np.where(bin_index > 0, cumulative[rows, bin_index - 1], 0)
+         in_bin = np.maximum(self._hist[rows, bin_index], 1)
+         result = self._low + (bin_index + (half - before) / in_bin) * self._bin_width
+         return np.where(counts > 0, result, np.nan).reshape(self.count.shape)
+      raise ValueError("TransitionStats was created without a median")
+
+
+   def table(self, values: np.ndarray) -> pd.DataFrame:
+      """
+      Labels one of the statistics with the AOI names so it can be passed to draw_heatmap.
+      """
+      return pd.DataFrame(values, index=self.aois, columns=self.aois)
 
-   hm_table= hm_table.div(len(in_files)).round(2)
-   draw_heatmap(hm_table, out_file, title, True, apply_mask)
-   
 
 if __name__ == '__main__':
    """
@@ -192,5 +521,6 @@ if __name__ == '__main__':
    #    aoi_csv='/Users/ashleyjones/Documents/CSULB/EyeTracking/D2-util-scripts/local/aoi_list.csv',
    #    out_dir='/Users/ashleyjones/Documents/CSULB/EyeTracking/D2-util-scripts/local/',
    #    title='Transition Proportions',
-   #    include='*AOI_Transitions.csv'
+   #    include='*AOI_Transitions.csv',
+   #    workers=4 # processes drawing at the same time, up to the number of cores
    # )
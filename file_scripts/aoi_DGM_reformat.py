@@ -1,75 +1,88 @@
 import os
 import pandas as pd
+import csv_cache as cc
 import csv_utils as cu
 
+# DGM columns read from each *AOI_DGMs.csv file
+DGM_COLUMNS = [
+   "Total Number of Fixations",
+   "Sum of all fixation duration (s)",
+   "Mean fixation duration (s)",
+   "Median fixation duration (s)",
+   "St.Dev. of fixation durations (s)",
+   "Min. fixation duration (s)",
+   "Max. fixation duration (s)",
+   "total number of saccades",
+   "sum of all saccade length",
+   "mean saccade length",
+   "median saccade length",
+   "StDev of saccade lengths",
+   "min saccade length",
+   "max saccade length",
+   "sum of all saccade durations",
+   "mean saccade duration",
+   "median saccade duration",
+   "StDev of saccade durations",
+   "Min. saccade duration",
+   "Max. saccade duration",
+   "scanpath duration",
+   "fixation to saccade ratio",
+   "Average Peak Saccade Velocity",
+   "sum of all absolute degrees",
+   "mean absolute degree",
+   "median absolute degree",
+   "StDev of absolute degrees",
+   "min absolute degree",
+   "max absolute degree",
+   "sum of all relative degrees",
+   "mean relative degree",
+   "median relative degree",
+   "StDev of relative degrees",
+   "min relative degree",
+   "max relative degree",
+   "convex hull area",
+   "stationary entropy",
+   "transition entropy",
+   "Average Blink Rate per Minute",
+   "total number of valid recordings",
+   "average pupil size of left eye",
+   "average pupil size of right eye",
+   "average pupil size of both eyes",
+   "total number of L mouse clicks"
+]
+# dgm_engine.py writes the average saccade velocity in place of the peak one. It is renamed to the
+# DGM column it stands in for, so files from both sources end up in the same output column
+ENGINE_COLUMNS = {"Average Saccade Velocity": "Average Peak Saccade Velocity"}
+
 def single_file(csv: str) -> pd.DataFrame:
    participant = os.path.basename(csv).split("_")[0]
-   original = pd.read_csv(csv, index_col="AOI", usecols=[
-      "Total Number of Fixations",
-      "Sum of all fixation duration (s)",
-      "Mean fixation duration (s)",
-      "Median fixation duration (s)",
-      "St.Dev. of fixation durations (s)",
-      "Min. fixation duration (s)",
-      "Max. fixation duration (s)",
-      "total number of saccades",
-      "sum of all saccade length",
-      "mean saccade length",
-      "median saccade length",
-      "StDev of saccade lengths",
-      "min saccade length",
-      "max saccade length",
-      "sum of all saccade durations",
-      "mean saccade duration",
-      "median saccade duration",
-      "StDev of saccade durations",
-      "Min. saccade duration",
-      "Max. saccade duration",
-      "scanpath duration",
-      "fixation to saccade ratio",
-      "Average Peak Saccade Velocity",
-      "sum of all absolute degrees",
-      "mean absolute degree",
-      "median absolute degree",
-      "StDev of absolute degrees",
-      "min absolute degree",
-      "max absolute degree",
-      "sum of all relative degrees",
-      "mean relative degree",
-      "median relative degree",
-      "StDev of relative degrees",
-      "min relative degree",
-      "max relative degree",
-      "convex hull area",
-      "stationary entropy",
-      "transition entropy",
-      "Average Blink Rate per Minute",
-      "total number of valid recordings",
-      "average pupil size of left eye",
-      "average pupil size of right eye",
-      "average pupil size of both eyes",
-      "total number of L mouse clicks",
-      "AOI"
-   ])
-   
-   reformat = pd.DataFrame({'PID': participant}, index=[0])
+   # a list (not a function) for usecols so csv_cache can cache the read
+   header = pd.read_csv(csv, nrows=0).columns
+   usecols = [col for col in header if col in DGM_COLUMNS or col in ENGINE_COLUMNS or col == "AOI"]
+   original = cc.read_csv(csv, index_col="AOI", usecols=usecols)
+   original.columns = [ENGINE_COLUMNS.get(col, col) for col in original.columns]
+   if sorted(original.columns) != sorted(DGM_COLUMNS):
+      raise ValueError(f"{csv} is missing the DGM columns {sorted(set(DGM_COLUMNS) - set(original.columns))}")
 
-   for ind in original.index:
-      for header in original.columns:
-         reformat = reformat.join(pd.DataFrame({f'{ind}_{header.replace(" ", "_")}': original[header].loc[ind]}, index=[0]))
-   return reformat.reset_index(drop=True)
+   # flattens the AOI x metric table row by row into a single row named {AOI}_{metric}.
+   # object keeps each value's own type so infer_objects gives every column the type it had in the file
+   headers = [header.replace(" ", "_") for header in original.columns]
+   columns = [f'{ind}_{header}' for ind in original.index for header in headers]
+   values = original.to_numpy(dtype=object).reshape(1, -1)
+   reformat = pd.DataFrame(values, columns=columns).infer_objects()
+   # concat instead of insert, inserting into a frame this wide warns that it is fragmented
+   return pd.concat([pd.DataFrame({'PID': [participant]}), reformat], axis=1)
 
 def run_directory(in_dir: str, out_file: str):
-   all_data = None
    in_files = []
    for dir, _, _ in os.walk(in_dir):
       in_files.extend(cu.glob_filter(dir, "*AOI_DGMs.csv"))
-   for file in in_files:
-      single = single_file(file)
-      if (all_data is None): 
-         all_data = single
-      else:
-         all_data = pd.concat([all_data, single])
+   if not in_files:
+      print(f"No AOI_DGMs files found in {in_dir}")
+      return
+   # each file is a single row, so keep them all and concat once. participants
+   # with different AOIs get the union of the columns
+   all_data = pd.concat([single_file(file) for file in in_files])
    all_data.to_csv(out_file, index=False)
    
          
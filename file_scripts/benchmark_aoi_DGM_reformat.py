@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import aoi_DGM_reformat as adr
+
+"""
+Compares aoi_DGM_reformat.single_file against the original join per cell version on
+synthetic AOI_DGMs files and checks that both produce the same row. The join version takes
+over a minute at 50 AOIs and grows with the square of the column count, so above
+MAX_REFERENCE_AOIS only single_file is timed. Also checks that a file written by dgm_engine.py,
+which names the velocity column differently, gives the same columns as one from the external tool.
+
+Parameters:
+   argv[1..n] optional AOI counts to test (default 10 30 200)
+"""
+
+MAX_REFERENCE_AOIS = 50
+
+def single_file_by_join(csv: str) -> pd.DataFrame:
+   """
+   Original implementation of aoi_DGM_reformat.single_file. Kept here as the reference.
+   """
+   participant = os.path.basename(csv).split("_")[0]
+   original = pd.read_csv(csv, index_col="AOI", usecols=adr.DGM_COLUMNS + ["AOI"])
+   reformat = pd.DataFrame({'PID': participant}, index=[0])
+   for ind in original.index:
+      for header in original.columns:
+         reformat = reformat.join(pd.DataFrame({f'{ind}_{header.replace(" ", "_")}': original[header].loc[ind]}, index=[0]))
+   return reformat.reset_index(drop=True)
+
+
+def synthetic_aoi_dgms(aois: int, out_file: str, seed: int = 0):
+   """
+   Writes an AOI_DGMs file with int count columns, float columns, a few missing values
+   and an extra column that single_file does not read.
+   """
+   rng = np.random.default_rng(seed)
+   data = {"AOI": [f"AOI{i}" for i in range(aois)], "Unused": rng.random(aois)}
+   for col in adr.DGM_COLUMNS:
+      if col.lower().startswith("total"):
+         data[col] = rng.integers(0, 500, aois)
+      else:
+         data[col] = rng.random(aois) * 100
+         data[col][rng.random(aois) < 0.05] = np.nan
+   pd.DataFrame(data).to_csv(out_file, index=False)
+
+
+def check_engine_file(aois: int = 5) -> bool:
+   """
+   The same values once under the external tool's column names and once under dgm_engine.py's.
+   """
+   with tempfile.TemporaryDirectory() as tmp:
+      external, engine = os.path.join(tmp, "p1_AOI_DGMs.csv"), os.path.join(tmp, "p2_AOI_DGMs.csv")
+      synthetic_aoi_dgms(aois, external)
+      # only the header line changes, so the values are the same text in both files
+      with open(external) as f:
+         header, body = f.read().split("\n", 1)
+      for engine_name, name in adr.ENGINE_COLUMNS.items():
+         header = header.replace(name, engine_name)
+      with open(engine, "w") as f:
+         f.write(header + "\n" + body)
+      rows = [adr.single_file(csv) for csv in (external, engine)]
+   both = pd.concat(rows, ignore_index=True)
+   return list(both.columns) == list(rows[0].columns) and both.drop(columns="PID").iloc[0].equals(both.drop(columns="PID").iloc[1])
+
+
+def run(aois: int, repeat: int = 3):
+   with tempfile.TemporaryDirectory() as tmp:
+      csv = os.path.join(tmp, "p1_AOI_DGMs.csv")
+      synthetic_aoi_dgms(aois, csv)
+
+      start = perf_counter()
+      for _ in range(repeat):
+         pivoted = adr.single_file(csv)
+      pivot_time = (perf_counter() - start) / repeat
+
+      if aois > MAX_REFERENCE_AOIS:
+         print(f"{aois:>4} AOIs ({pivoted.shape[1]:>5} columns) | join skipped (over {MAX_REFERENCE_AOIS} AOIs) | "
+               f"pivot {pivot_time:7.4f}s")
+         return
+
+      # the join version only runs once
+      start = perf_counter()
+      by_join = single_file_by_join(csv)
+      join_time = perf_counter() - start
+
+   matches = by_join.equals(pivoted) and by_join.to_csv(index=False) == pivoted.to_csv(index=False)
+   print(f"{aois:>4} AOIs ({pivoted.shape[1]:>5} columns) | join {join_time:8.3f}s | "
+         f"pivot {pivot_time:7.4f}s | speedup {join_time / pivot_time:7.1f}x | output matches: {matches}")
+   if not matches:
+      raise AssertionError(f"single_file differs from the original for {aois} AOIs")
+
+
+if __name__ == '__main__':
+   matches = check_engine_file()
+   print(f"dgm_engine.py and external files give the same columns: {matches}")
+   if not matches:
+      raise AssertionError("dgm_engine.py files are reformatted into different columns")
+   sizes = [int(n) for n in sys.argv[1:]] or [10, 30, 200]
+   for n in sizes:
+      run(n)
@@ -0,0 +1,219 @@
+import math
+import statistics
+import sys
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import dgm_engine as de
+import window_dgms as wd
+
+"""
+Compares dgm_engine against a plain Python version of the same measures on synthetic
+sessions and checks that both produce the same values, whole screen and per AOI. Also compares
+window_dgms and its running convex hull against computing every sliding window from scratch.
+
+Parameters:
+   argv[1..n] optional fixation counts to test (default 2000 8000 30000)
+"""
+
+AOIS = ["AI", "ASI", "Alt_VSI", "RPM", "SSI", "TI_HSI", "Window"]
+
+
+def dgms_by_loop(rows: list[dict], aois: list[str], screen_size=de.SCREEN_SIZE, pixels_per_degree=de.PIXELS_PER_DEGREE) -> dict:
+   """
+   Reference implementation of dgm_engine.compute_dgms, one fixation at a time.
+   """
+   def stats(values):
+      values = [v for v in values if not math.isnan(v)]
+      if not values:
+         return [0.0] + [math.nan] * 5
+      std = statistics.stdev(values) if len(values) > 1 else math.nan
+      return [math.fsum(values), statistics.fmean(values), statistics.median(values), std, min(values), max(values)]
+
+   def mean(values):
+      values = [v for v in values if not math.isnan(v)]
+      return statistics.fmean(values) if values else math.nan
+
+   def ent(counts):
+      total = sum(counts)
+      if total == 0:
+         return math.nan
+      return -sum(c / total * math.log10(c / total) for c in counts if c)
+
+   def hull_area(points):
+      points = sorted(set(p for p in points if not (math.isnan(p[0]) or math.isnan(p[1]))))
+      if len(points) < 3:
+         return 0.0
+      cross = lambda o, a, b: (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+      lower, upper = [], []
+      for p in points:
+         while len(lower) > 1 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+         lower.append(p)
+      for p in reversed(points):
+         while len(upper) > 1 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+         upper.append(p)
+      hull = lower[:-1] + upper[:-1]
+      if len(hull) < 3:
+         return 0.0
+      return abs(sum(hull[i][0] * hull[i - 1][1] - hull[i - 1][0] * hull[i][1] for i in range(len(hull)))) / 2
+
+   points = [(r["FPOGX"] * screen_size[0], r["FPOGY"] * screen_size[1]) for r in rows]
+   durations = [r["FPOGD"] for r in rows]
+   lengths, saccade_durations, absolute, vectors, velocities = [], [], [], [], []
+   for i in range(1, len(rows)):
+      dx, dy = points[i][0] - points[i - 1][0], points[i][1] - points[i - 1][1]
+      length = math.hypot(dx, dy)
+      duration = rows[i]["FPOGS"] - (rows[i - 1]["FPOGS"] + rows[i - 1]["FPOGD"])
+      lengths.append(length)
+      saccade_durations.append(duration)
+      velocities.append(length / pixels_per_degree / duration if duration > 0 else math.nan)
+      if length > 0:
+         absolute.append(math.degrees(math.atan2(abs(dy), abs(dx))))
+         vectors.append((dx / length, dy / length))
+   relative = [math.degrees(math.acos(max(-1.0, min(1.0, a[0] * b[0] + a[1] * b[1])))) for a, b in zip(vectors, vectors[1:])]
+
+   labels = [str(r["AOI"]).strip() if isinstance(r["AOI"], str) else "" for r in rows]
+   stationary = ent([labels.count(a) for a in aois])
+   pairs = {}
+   for a, b in zip(labels, labels[1:]):
+      if a in aois and b in aois:
+         pairs[(a, b)] = pairs.get((a, b), 0) + 1
+   transition = ent(list(pairs.values()))
+
+   left = [r["LPMM"] if r["LPMMV"] == 1 else math.nan for r in rows]
+   right = [r["RPMM"] if r["RPMMV"] == 1 else math.nan for r in rows]
+   fixation_stats, length_stats, duration_stats = stats(durations), stats(lengths), stats(saccade_durations)
+   values = (
+      [len(rows)] + fixation_stats + [len(lengths)] + length_stats + duration_stats
+      + [fixation_stats[0] + duration_stats[0],
+         fixation_stats[0] / duration_stats[0] if duration_stats[0] else math.nan,
+         mean(velocities)]
+      + stats(absolute) + stats(relative)
+      + [hull_area(points), stationary, transition, mean([r["BKPMIN"] for r in rows]), sum(r[de.SAMPLES_COL] for r in rows),
+         mean(left), mean(right), mean([(a + b) / 2 for a, b in zip(left, right)]),
+         sum(1 for r in rows if r["CS"] == 1)]
+   )
+   return dict(zip(de.DGM_COLUMNS, values))
+
+
+def synthetic_fixations(count: int, seed: int = 0) -> pd.DataFrame:
+   """
+   Builds a session of fixations with durations, gaps, AOI labels (some blank), invalid pupils,
+   repeated positions and clicks similar to the ILS recordings.
+   """
+   rng = np.random.default_rng(seed)
+   duration = rng.gamma(2.0, 0.18, count)
+   gap = rng.choice([0.0068, 0.0072, 0.02, 0.1, 0.4], count, p=[0.5, 0.2, 0.2, 0.08, 0.02])
+   start = np.cumsum(np.concatenate(([0.0], (duration + gap)[:-1])))
+   x, y = rng.uniform(0, 1, count), rng.uniform(0, 1, count)
+   repeat = rng.random(count) < 0.02 # fixations at the same spot as the one before make 0 length saccades
+   repeat[0] = False
+   x[repeat], y[repeat] = x[np.flatnonzero(repeat) - 1], y[np.flatnonzero(repeat) - 1]
+   return pd.DataFrame({
+      "FPOGX": x, "FPOGY": y, "FPOGS": start, "FPOGD": duration,
+      "FPOGID": np.arange(count), "FPOGV": 1,
+      "AOI": np.array(AOIS + [np.nan], dtype=object)[rng.integers(0, len(AOIS) + 1, count)],
+      "LPMM": rng.normal(4.5, 0.8, count), "LPMMV": (rng.random(count) > 0.05).astype(int),
+      "RPMM": rng.normal(4.6, 0.9, count), "RPMMV": (rng.random(count) > 0.05).astype(int),
+      "BKPMIN": rng.integers(0, 30, count), "CS": rng.choice([0, 1], count, p=[0.99, 0.01]),
+      de.SAMPLES_COL: rng.integers(1, 60, count),
+   })
+
+
+def check_fixation_rows(count: int = 2000, seed: int = 0):
+   """
+   Checks that dgm_engine.fixation_rows turns gaze samples (each fixation repeated once per sample,
+   with invalid samples in between) back into the fixations and counts their valid samples.
+   """
+   rng = np.random.default_rng(seed)
+   fixations = synthetic_fixations(count, seed)
+   samples = fixations.loc[fixations.index.repeat(fixations[de.SAMPLES_COL])].drop(columns=de.SAMPLES_COL)
+   invalid = samples.sample(frac=0.1, random_state=seed).assign(FPOGV=0)
+   samples = pd.concat([samples, invalid]).sort_index(kind="stable").reset_index(drop=True)
+   rows = de.fixation_rows(samples)
+   matches = rows.reset_index(drop=True).equals(fixations) and de.fixation_rows(rows)[de.SAMPLES_COL].equals(rows[de.SAMPLES_COL])
+   print(f"fixation_rows on {len(samples)} gaze samples of {count} fixations | output matches: {matches}")
+   if not matches:
+      raise AssertionError("fixation_rows does not give back the fixations and their valid sample counts")
+
+
+def same(a: dict, b: dict) -> bool:
+   return all(np.isclose(a[col], b[col], rtol=1e-9, atol=1e-9, equal_nan=True) for col in de.DGM_COLUMNS)
+
+
+def run(count: int):
+   fixations = synthetic_fixations(count)
+   rows = fixations.to_dict("records")
+
+   start = perf_counter()
+   reference = [dgms_by_loop(rows, AOIS)]
+   reference += [dgms_by_loop([r for r in rows if r["AOI"] == aoi], AOIS) for aoi in AOIS]
+   loop_time = perf_counter() - start
+
+   start = perf_counter()
+   engine = [de.compute_dgms(fixations, AOIS)]
+   engine += de.aoi_dgms(fixations, AOIS).drop(columns="AOI").to_dict("records")
+   engine_time = perf_counter() - start
+
+   matches = all(same(a, b) for a, b in zip(reference, engine))
+   print(f"{count:>7} fixations | loop {loop_time:8.3f}s | numpy {engine_time:7.4f}s | "
+         f"speedup {loop_time / engine_time:6.1f}x | output matches: {matches}")
+   if not matches:
+      raise AssertionError(f"dgm_engine differs from the reference for {count} fixations")
+
+
+def run_windows(count: int, window: float = 120.0, step: float = 1.0):
+   fixations = synthetic_fixations(count)
+
+   start = perf_counter()
+   running = wd.window_dgms(fixations, window, step, AOIS)
+   running_time = perf_counter() - start
+
+   start = perf_counter()
+   times = fixations["FPOGS"].to_numpy() - fixations["FPOGS"].iloc[0]
+   scratch = [de.compute_dgms(fixations[(times >= s) & (times < s + window)], AOIS) for s in running["Window Start"]]
+   scratch_time = perf_counter() - start
+
+   matches = len(scratch) == len(running) and all(
+      np.isclose(row[col], value[col], rtol=1e-7, atol=1e-9, equal_nan=True)
+      for row, value in zip(scratch, running.to_dict("records")) for col in de.DGM_COLUMNS
+   )
+   print(f"{count:>7} fixations, {len(running)} windows of {window:g}s every {step:g}s | from scratch {scratch_time:7.3f}s | "
+         f"running {running_time:7.3f}s | speedup {scratch_time / running_time:5.1f}x | output matches: {matches}")
+   if not matches:
+      raise AssertionError(f"window_dgms differs from computing each window for {count} fixations")
+
+
+def check_hull(count: int = 3000, seed: int = 0):
+   """
+   Checks window_dgms.RunningHull against dgm_engine.convex_hull_area on windows that overlap, jump
+   ahead and shrink to nothing, with repeated, collinear and missing points.
+   """
+   rng = np.random.default_rng(seed)
+   x = rng.normal(0, 1, count)
+   y = rng.normal(0, 1, count)
+   grid = rng.random(count) < 0.3 # points on a few lines and corners
+   x[grid], y[grid] = rng.integers(0, 3, grid.sum()), rng.integers(0, 3, grid.sum())
+   x[rng.random(count) < 0.02] = np.nan
+   hull = wd.RunningHull(x, y)
+   first, end, wrong = 0, 0, 0
+   while end < count:
+      first = min(first + int(rng.choice([0, 1, 3, 40])), count)
+      end = min(max(end + int(rng.choice([0, 1, 2, 5, 60])), first), count)
+      hull.move_to(first, end)
+      wrong += not np.isclose(hull.area, de.convex_hull_area(x[first:end], y[first:end]), rtol=1e-9, atol=1e-9)
+   print(f"running convex hull on {count} points | output matches: {wrong == 0}")
+   if wrong:
+      raise AssertionError(f"RunningHull differs from convex_hull_area on {wrong} windows")
+
+
+if __name__ == '__main__':
+   check_fixation_rows()
+   check_hull()
+   sizes = [int(n) for n in sys.argv[1:]] or [2000, 8000, 30000]
+   for n in sizes:
+      run(n)
+   for n in sizes:
+      run_windows(n)
@@ -0,0 +1,192 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import tag_aois as ta
+
+"""
+Compares the vectorized tag_aois.tag_data against the original row by row version
+on synthetic gaze data and checks that both produce the same AOI column. Also compares
+AOIIndex against checking every AOI on large synthetic AOI layouts and on the borders of tile layouts,
+and checks that add_aoi_to_file writes the same file streamed in chunks as tagged all at once.
+
+Parameters:
+   argv[1..n] optional row counts to test (default 10000 100000)
+"""
+
+def tag_data_by_row(data: pd.DataFrame):
+   """
+   Original implementation of tag_aois.tag_data. Kept here as the reference.
+   """
+   for i in data.index:
+      if data.at[i, "SACCADE_MAG"] == 0:
+         data.at[i, "AOI"] = ta.pick_aoi(data.at[i, "BPOGX"], data.at[i, "BPOGY"])
+      else:
+         data.at[i, "AOI"] = ta.pick_aoi(data.at[i, "FPOGX"], data.at[i, "FPOGY"])
+
+
+def synthetic_gaze(rows: int, seed: int = 0) -> pd.DataFrame:
+   """
+   Builds gaze data with random points, points that sit exactly on AOI borders, and missing values.
+   """
+   rng = np.random.default_rng(seed)
+   borders = np.array([v for a in ta.all_aois for v in (a.x1, a.y1, a.x2, a.y2)])
+   data = pd.DataFrame({
+      "FPOGX": rng.uniform(-0.1, 1.1, rows),
+      "FPOGY": rng.uniform(-0.1, 1.1, rows),
+      "BPOGX": rng.uniform(-0.1, 1.1, rows),
+      "BPOGY": rng.uniform(-0.1, 1.1, rows),
+      "SACCADE_MAG": rng.choice([0.0, 0.0, 12.5, 40.1], rows),
+   })
+   # about 10% of the points land on an AOI edge so the half-open borders get exercised
+   for col in ["FPOGX", "FPOGY", "BPOGX", "BPOGY"]:
+      on_border = rng.random(rows) < 0.1
+      data.loc[on_border, col] = rng.choice(borders, on_border.sum())
+   data.loc[rng.random(rows) < 0.01, "SACCADE_MAG"] = np.nan
+   data.loc[rng.random(rows) < 0.01, "FPOGX"] = np.nan
+   return data
+
+
+def run(rows: int):
+   data = synthetic_gaze(rows)
+   by_row = data.copy()
+   vectorized = data.copy()
+
+   start = perf_counter()
+   tag_data_by_row(by_row)
+   row_time = perf_counter() - start
+
+   start = perf_counter()
+   ta.tag_data(vectorized)
+   vec_time = perf_counter() - start
+
+   matches = by_row["AOI"].tolist() == vectorized["AOI"].tolist()
+   print(f"{rows:>9} rows | by row {row_time:8.3f}s | vectorized {vec_time:8.4f}s | "
+         f"speedup {row_time / vec_time:7.1f}x | output matches: {matches}")
+   if not matches:
+      raise AssertionError(f"vectorized tagging differs from the original for {rows} rows")
+
+
+def write_gaze_file(rows: int, path: str, seed: int = 0):
+   """
+   Writes a gaze file like the GazePoint exports (the header twice) with columns whose type
+   changes between chunks: an int column with a few missing values and a USER column with
+   mostly missing values, a few numbers and a few words.
+   """
+   rng = np.random.default_rng(seed)
+   data = synthetic_gaze(rows, seed)
+   data.insert(0, "CNT", np.arange(rows))
+   counter = pd.array(rng.integers(0, 1000, rows), dtype="Int64")
+   counter[rng.choice(rows, 3, replace=False)] = pd.NA
+   data["TIMETICK"] = counter
+   user = np.full(rows, np.nan, dtype=object)
+   marked = rng.choice(rows, max(rows // 100, 4), replace=False)
+   user[marked] = rng.integers(0, 9, len(marked))
+   user[marked[:2]] = ["click", "START"]
+   data["USER"] = user
+   with open(path, 'w', newline='') as f:
+      f.write(",".join(data.columns) + "\n")
+      data.to_csv(f, index=False)
+
+
+def run_stream(rows: int, chunksizes: list[int] = (7, 100, 999, 4000)):
+   with tempfile.TemporaryDirectory() as tmp:
+      in_file = os.path.join(tmp, "p1_all_gaze.csv")
+      write_gaze_file(rows, in_file)
+      start = perf_counter()
+      ta.add_aoi_to_file(in_file, os.path.join(tmp, "memory.csv"))
+      memory_time = perf_counter() - start
+      with open(os.path.join(tmp, "memory.csv")) as f:
+         expected = f.read()
+      for chunksize in chunksizes:
+         start = perf_counter()
+         ta.add_aoi_to_file(in_file, os.path.join(tmp, "streamed.csv"), chunksize)
+         stream_time = perf_counter() - start
+         with open(os.path.join(tmp, "streamed.csv")) as f:
+            matches = f.read() == expected
+         print(f"{rows:>9} rows, chunks of {chunksize:>5} | in memory {memory_time:7.3f}s | streamed {stream_time:7.3f}s | "
+               f"output matches: {matches}")
+         if not matches:
+            raise AssertionError(f"streamed tagging differs from tagging the whole file for {rows} rows in chunks of {chunksize}")
+
+
+def synthetic_layout(count: int, seed: int = 0) -> list[ta.AOI]:
+   """
+   Builds a layout of tiles that touch each other plus randomly placed AOIs that overlap the tiles.
+   """
+   rng = np.random.default_rng(seed)
+   side = int(np.ceil(np.sqrt(count / 2)))
+   aois = []
+   for i in range(count - side * side):
+      w, h = rng.uniform(0.01, 0.2, 2)
+      aois.append(ta.AOI(f"Region{i}", rng.uniform(0, 1 - w), rng.uniform(0, 1 - h), w, h))
+   for i in range(side * side):
+      aois.append(ta.AOI(f"Tile{i}", (i % side) / side, (i // side) / side, 1 / side, 1 / side))
+   return aois
+
+
+def linear_pick(aois: list[ta.AOI], x: float, y: float) -> str:
+   for area in aois:
+      if area.contains(x, y):
+         return area.name
+   return ''
+
+
+def check_layout_borders(side: int = 10, cells: int = None):
+   """
+   Checks AOIIndex on every corner of a side x side tile layout, with grid cells on the tile borders
+   when cells is side. Points on a border have to go to the tile right / below of it.
+   """
+   aois = [ta.AOI(f"T{i % side}_{i // side}", (i % side) / side, (i // side) / side, 1 / side, 1 / side)
+           for i in range(side * side)]
+   index = ta.AOIIndex(aois, cells)
+   borders = np.array([a.x1 for a in aois] + [a.x2 for a in aois] + [0.5, 1.0])
+   x, y = [v.ravel() for v in np.meshgrid(np.unique(borders), np.unique(borders))]
+   linear = [linear_pick(aois, a, b) for a, b in zip(x, y)]
+   single = [index.pick(a, b) for a, b in zip(x, y)]
+   batched = index.pick_many(x, y).tolist()
+   wrong = sum(a != b for a, b in zip(linear, single)) + sum(a != b for a, b in zip(linear, batched))
+   print(f"{side}x{side} tiles, {index.cells} cells | {len(x)} border points | output matches: {wrong == 0}")
+   if wrong:
+      raise AssertionError(f"AOIIndex differs from checking every AOI on {wrong} border points")
+
+
+def run_index(count: int, points: int = 20000):
+   aois = synthetic_layout(count)
+   gaze = synthetic_gaze(points)
+   x, y = gaze["FPOGX"].to_numpy(), gaze["FPOGY"].to_numpy()
+
+   start = perf_counter()
+   index = ta.AOIIndex(aois)
+   build_time = perf_counter() - start
+
+   start = perf_counter()
+   linear = [linear_pick(aois, a, b) for a, b in zip(x, y)]
+   linear_time = perf_counter() - start
+
+   start = perf_counter()
+   single = [index.pick(a, b) for a, b in zip(x, y)]
+   single_time = perf_counter() - start
+
+   start = perf_counter()
+   batched = index.pick_many(x, y).tolist()
+   batch_time = perf_counter() - start
+
+   matches = linear == single == batched
+   print(f"{count:>5} AOIs | build {build_time:.4f}s | linear {linear_time:7.3f}s | "
+         f"index.pick {single_time:7.3f}s | index.pick_many {batch_time:.4f}s | output matches: {matches}")
+   if not matches:
+      raise AssertionError(f"AOIIndex differs from checking every AOI for {count} AOIs")
+
+
+if __name__ == '__main__':
+   sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+   for n in sizes:
+      run(n)
+   for n in [7, 50, 200, 800]:
+      run_index(n)
+   for side, cells in [(10, 10), (10, None), (7, 7), (3, 6)]:
+      check_layout_borders(side, cells)
+   run_stream(5000)
@@ -1,6 +1,12 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import csv
+import json
+from operator import itemgetter
 import os
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
+import csv_cache as cc
 
 # Define paths and dictionary
 # Base path where the data is stored
@@ -53,6 +59,17 @@ workload_columns = [
     "average_blink_rate_per_minute", "success"
 ]
 
+# Feature sets saved next to all_features, each one also gets the 'Pid' column
+feature_sets = {
+    'processing': processing_columns,
+    'searching': searching_columns,
+    'workload': workload_columns
+}
+
+# Set to 'parquet' or 'feather' to also save each combined file as a single columnar file
+# holding every feature set as a named column group (needs pyarrow). None only saves csv files
+columnar_format = None
+
 # Initialize total file counters
 total_files_read = 0
 total_files_created = 0
@@ -68,72 +85,156 @@ arff_files_per_subfolder = {
 # Function to save different versions of combined data
 def save_processed_files(combined_df, output_folder, file_prefix, folder_name):
     global total_files_created, arff_files_per_subfolder
+    files_created = 0
 
-    # Create output directories for different feature sets
-    all_features_folder = os.path.join(output_folder, 'all_features')
-    processing_folder = os.path.join(output_folder, 'processing')
-    searching_folder = os.path.join(output_folder, 'searching')
-    workload_folder = os.path.join(output_folder, 'workload')
-    os.makedirs(all_features_folder, exist_ok=True)
-    os.makedirs(processing_folder, exist_ok=True)
-    os.makedirs(searching_folder, exist_ok=True)
-    os.makedirs(workload_folder, exist_ok=True)
-
-    # Save combined data with all features
-    all_features_file_path = os.path.join(all_features_folder, f'{file_prefix}_all_features.csv')
-    combined_df.to_csv(all_features_file_path, index=False)  # Keep 'Pid' and all columns
-    total_files_created += 1
-    print(f'Combined file saved at: {all_features_file_path}')
-
-    # Save data with processing features
-    processing_file_path = os.path.join(processing_folder, f'{file_prefix}_processing.csv')
-    combined_df[processing_columns + ['Pid']].to_csv(processing_file_path, index=False)
-    total_files_created += 1
-
-    # Save data with searching features
-    searching_file_path = os.path.join(searching_folder, f'{file_prefix}_searching.csv')
-    combined_df[searching_columns + ['Pid']].to_csv(searching_file_path, index=False)
-    total_files_created += 1
-
-    # Save data with workload features
-    workload_file_path = os.path.join(workload_folder, f'{file_prefix}_workload.csv')
-    combined_df[workload_columns + ['Pid']].to_csv(workload_file_path, index=False)
-    total_files_created += 1
+    # Output file for all features ('Pid' and all columns) and for each feature set ('Pid' and the set's columns)
+    outputs = {'all_features': list(combined_df.columns)}
+    for set_name, set_columns in feature_sets.items():
+        outputs[set_name] = set_columns + ['Pid']
+    paths = {}
+    for set_name in outputs:
+        # Create output directories for different feature sets
+        set_folder = os.path.join(output_folder, set_name)
+        os.makedirs(set_folder, exist_ok=True)
+        paths[set_name] = os.path.join(set_folder, f'{file_prefix}_{set_name}.csv')
 
+    # Format each column once and write every feature set from the same formatted rows
+    write_projections(combined_df, {paths[name]: cols for name, cols in outputs.items()})
+    files_created += len(outputs)
+    print(f'Combined file saved at: {paths["all_features"]}')
     print(f'Processed files saved in "processing", "searching", and "workload" folders for {file_prefix}.')
 
+    # Save every feature set in one columnar file if turned on
+    if columnar_format:
+        columnar_path = os.path.join(output_folder, f'{file_prefix}.{columnar_format}')
+        groups = {name: cols for name, cols in outputs.items() if name != 'all_features'}
+        write_columnar(combined_df, columnar_path, groups, columnar_format)
+        files_created += 1
+        print(f'Columnar file saved at: {columnar_path}')
+
+    total_files_created += files_created
+    # Return the number of files created so callers in other processes can keep count
+    return files_created
+
+# Function to turn a column into the same text DataFrame.to_csv writes for it
+def format_column(values):
+    array = values.to_numpy()
+    missing = values.isna().to_numpy()
+    if array.dtype.kind in 'biuf':
+        # numpy prints the shortest text that reads back as the same number, like to_csv
+        text = array.astype(str).astype(object)
+    else:
+        text = np.array([str(v) for v in array], dtype=object)
+    text[missing] = ''
+    return text
+
+# Function to write several column subsets of a DataFrame to csv files in one pass over the rows
+# projections maps each output path to the columns it gets. Output matches DataFrame.to_csv(index=False)
+def write_projections(df, projections):
+    # Format every needed column once, no matter how many outputs use it
+    needed = list(dict.fromkeys(col for cols in projections.values() for col in cols))
+    position = {col: i for i, col in enumerate(needed)}
+    formatted = [format_column(df[col]) for col in needed]
+
+    files = []
+    outputs = []
+    try:
+        for path, cols in projections.items():
+            f = open(path, 'w', newline='')
+            files.append(f)
+            writer = csv.writer(f, lineterminator=os.linesep)
+            writer.writerow(cols)
+            # Picks this output's columns out of a full formatted row
+            pick = itemgetter(*[position[col] for col in cols])
+            if len(cols) == 1:
+                pick = lambda row, single=pick: (single(row),)
+            outputs.append((writer, pick))
+        for row in zip(*formatted):
+            for writer, pick in outputs:
+                writer.writerow(pick(row))
+    finally:
+        for f in files:
+            f.close()
+
+# Function to save a DataFrame as one parquet or feather file with named column groups
+# The groups are stored in the file's metadata under 'column_groups'
+def write_columnar(df, path, groups, file_format='parquet'):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'column_groups'] = json.dumps(groups).encode()
+    table = table.replace_schema_metadata(metadata)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    elif file_format == 'feather':
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+    else:
+        raise ValueError(f"Unknown columnar format: {file_format}")
+
+# Function to read one named column group (for example 'processing') back from write_columnar's file
+def read_column_group(path, group):
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    if path.endswith('.feather'):
+        schema = feather.read_table(path, memory_map=True).schema
+        groups = json.loads(schema.metadata[b'column_groups'])
+        return feather.read_table(path, columns=groups[group], memory_map=True).to_pandas()
+    groups = json.loads(pq.read_schema(path).metadata[b'column_groups'])
+    return pq.read_table(path, columns=groups[group]).to_pandas()
+
+# Function to read one participant's data file for a given folder and data type
+# Returns None if the participant does not have the file
+def read_participant_file(folder_name, data_type, pid, success):
+    # Determine the subfolder based on data type
+    if data_type == 'baseline':
+        data_subfolder = 'baseline'
+    else:
+        data_subfolder = os.path.join('event', data_type)
+    # Construct the file path to the participant's data file
+    file_path = os.path.join(
+        base_path, folder_name, pid, data_subfolder, f'{data_type}_DGMs.csv'
+    )
+
+    # Check if the file exists
+    if not os.path.exists(file_path):
+        return None
+
+    # Read the CSV file into a DataFrame
+    df = cc.read_csv(file_path)
+
+    # Add 'Pid' and 'success' columns to the DataFrame
+    df['Pid'] = pid
+    df['success'] = success
+    return df
+
 # Function to combine CSV files for a given folder and data type (baseline or windowed data)
-def combine_csv_files(folder_name, data_type):
+# read_workers > 1 reads that many participant files at the same time with threads
+# Returns the number of files read and created so the counts can be added up across processes
+def combine_csv_files(folder_name, data_type, read_workers=1, show_progress=True):
     global total_files_read
     combined_data = []
     file_count = 0
+    files_created = 0
 
     # Description for the progress bar
     pbar_desc = f'Combining CSV files for {folder_name} - {data_type}'
-    # Iterate over each participant ID and their landing success status
-    pbar = tqdm(landing_success_dict.items(), desc=pbar_desc)
-    for pid, success in pbar:
-        # Determine the subfolder based on data type
-        if data_type == 'baseline':
-            data_subfolder = 'baseline'
-        else:
-            data_subfolder = os.path.join('event', data_type)
-        # Construct the file path to the participant's data file
-        file_path = os.path.join(
-            base_path, folder_name, pid, data_subfolder, f'{data_type}_DGMs.csv'
-        )
+    participants = list(landing_success_dict.items())
+    # Read each participant's file, results come back in participant order either way
+    if read_workers > 1:
+        with ThreadPoolExecutor(max_workers=read_workers) as pool:
+            frames = list(pool.map(lambda item: read_participant_file(folder_name, data_type, *item), participants))
+    else:
+        frames = (read_participant_file(folder_name, data_type, pid, success) for pid, success in participants)
+
+    # Iterate over each participant ID and their data
+    pbar = tqdm(zip(participants, frames), desc=pbar_desc, total=len(participants), disable=not show_progress)
+    for (pid, success), df in pbar:
         # Update progress bar postfix with current participant ID
         pbar.set_postfix({'PID': pid})
 
-        # Check if the file exists
-        if os.path.exists(file_path):
-            # Read the CSV file into a DataFrame
-            df = pd.read_csv(file_path)
-
-            # Add 'Pid' and 'success' columns to the DataFrame
-            df['Pid'] = pid
-            df['success'] = success
-
+        if df is not None:
             # Append the DataFrame to the list of combined data
             combined_data.append(df)
             file_count += 1
@@ -147,25 +248,42 @@ def combine_csv_files(folder_name, data_type):
         # Create output directory for the current folder
         output_folder = os.path.join(combined_results_base_path, folder_name)
         # Save the combined data using the function defined above
-        save_processed_files(combined_df, output_folder, f'combined_{data_type}_{folder_name}', folder_name)
+        files_created = save_processed_files(combined_df, output_folder, f'combined_{data_type}_{folder_name}', folder_name)
     else:
         # If no data was found for the given folder and data type
         print(f"No data available to combine for folder: {folder_name}, data type: {data_type}")
 
     print(f"Total files read for {data_type} in folder '{folder_name}': {file_count}")
+    return file_count, files_created
+
+# Function to combine every folder for baseline and every window
+# workers > 1 runs that many (folder, data type) jobs at the same time in separate processes
+def process_all(workers=1, read_workers=1):
+    global total_files_read, total_files_created
+
+    # Baseline data for each folder, then windowed data (window1 to window14) for each folder
+    jobs = [(folder, 'baseline') for folder in folders]
+    jobs += [(folder, f'window{i}') for folder in folders for i in range(1, 15)]
+
+    if workers <= 1:
+        for folder, data_type in tqdm(jobs, desc='Processing Folders'):
+            combine_csv_files(folder, data_type, read_workers)
+        return
+
+    # The counters in the worker processes are separate copies, so add up what each job returns
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(combine_csv_files, folder, data_type, read_workers, False) for folder, data_type in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Processing Folders'):
+            files_read, files_created = future.result()
+            total_files_read += files_read
+            total_files_created += files_created
 
 # Main execution flow with progress bars
 if __name__ == '__main__':
-    # Process baseline data for each folder
-    for folder in tqdm(folders, desc='Processing Baseline Folders'):
-        combine_csv_files(folder, 'baseline')
-
-    # Process windowed data (window1 to window14) for each folder
-    for folder in tqdm(folders, desc='Processing Window Folders'):
-        # Iterate over each window
-        for window in tqdm([f'window{i}' for i in range(1, 15)], desc=f'Processing Windows in {folder}', leave=False):
-            combine_csv_files(folder, window)
+    # Raise workers to combine several folders/windows at the same time and read_workers
+    # to read several participant files at the same time within each one
+    process_all(workers=1, read_workers=1)
 
     # Print the total counts of files read and created
     print(f"\nTotal files read across all folders and windows: {total_files_read}")
-    print(f"Total files created across all folders and versions: {total_files_created}")
\ No newline at end of file
+    print(f"Total files created across all folders and versions: {total_files_created}")
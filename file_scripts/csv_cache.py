@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+"""
+Keeps a parsed copy of csv files on disk so scripts that read the same GazePoint exports
+over and over only parse the text once. Use csv_cache.read_csv in place of pd.read_csv.
+
+The parsed copy is saved as parquet (pickle if pyarrow is missing or the data does not fit
+in parquet) and is found again with the file's path, modification time, size and the read_csv
+arguments, so editing or replacing a csv file always parses it again. Once a new copy makes the
+cache larger than MAX_CACHE_BYTES the least recently used copies are deleted. Copies added by other
+processes are only counted when this process scans the cache again (its first save and every eviction).
+
+Settings can be changed with environment variables:
+   D2_CSV_CACHE=0                 turns the cache off
+   D2_CSV_CACHE_DIR=path          where the cache is saved
+   D2_CSV_CACHE_MAX_BYTES=bytes   size limit of the cache
+
+Command line:
+   python csv_cache.py info    prints where the cache is and how big it is
+   python csv_cache.py list    lists the cached files, most recently used first
+   python csv_cache.py clear   deletes everything in the cache
+"""
+
+ENABLED = os.environ.get("D2_CSV_CACHE", "1") != "0"
+CACHE_DIR = os.environ.get(
+   "D2_CSV_CACHE_DIR",
+   os.path.join(os.path.expanduser("~"), ".cache", "d2-util-scripts", "csv")
+)
+MAX_CACHE_BYTES = int(os.environ.get("D2_CSV_CACHE_MAX_BYTES", 4 * 1024**3))
+# small files parse faster than a cached copy loads
+MIN_FILE_BYTES = 64 * 1024
+
+# read_csv arguments that return something other than a whole DataFrame
+UNCACHEABLE_ARGS = {"chunksize", "iterator", "nrows"}
+DATA_EXTENSIONS = (".parquet", ".pkl")
+# files are written as <name>.part and renamed when done, older ones were left by a crashed write
+PART_EXTENSION = ".part"
+STALE_PART_SECONDS = 3600
+
+# size of the cache as last seen by this process, see add_cache_bytes
+_cache_bytes = None
+
+
+def read_csv(path: str, **kwargs) -> pd.DataFrame:
+   """
+   Same as pd.read_csv(path, **kwargs) but loads the parsed copy from the cache when the
+   file has not changed since it was cached.
+
+   Parameters:
+      path (str): csv file to read
+      kwargs: any pd.read_csv arguments. Reads that use chunksize, iterator, nrows or
+         arguments that can not be saved as text (functions, file objects, ...) are not cached.
+   """
+   key = cache_key(path, kwargs)
+   if key is None:
+      return pd.read_csv(path, **kwargs)
+
+   cached = load_entry(key)
+   if cached is not None:
+      return cached
+   data = pd.read_csv(path, **kwargs)
+   written = save_entry(key, data, {"source": os.path.abspath(path), "kwargs": kwargs})
+   if add_cache_bytes(written) > MAX_CACHE_BYTES:
+      evict(MAX_CACHE_BYTES)
+   return data
+
+
+def cache_key(path: str, kwargs: dict) -> str:
+   """
+   Returns the cache key for reading path with kwargs, or None if the read should not be cached.
+   """
+   if not ENABLED or not isinstance(path, (str, os.PathLike)) or UNCACHEABLE_ARGS & kwargs.keys():
+      return None
+   try:
+      stat = os.stat(path)
+      args = json.dumps(kwargs, sort_keys=True)
+   except (OSError, TypeError): # missing file or arguments that are not plain values
+      return None
+   if stat.st_size < MIN_FILE_BYTES:
+      return None
+   source = [os.path.abspath(path), stat.st_mtime_ns, stat.st_size, args, pd.__version__]
+   return hashlib.sha256(json.dumps(source).encode()).hexdigest()
+
+
+def entry_files(key: str) -> list[str]:
+   return [os.path.join(CACHE_DIR, key + ext) for ext in DATA_EXTENSIONS + (".json",)]
+
+
+def load_entry(key: str) -> pd.DataFrame:
+   """
+   Returns the cached DataFrame for key, or None if there is none.
+   """
+   for file in entry_files(key)[:len(DATA_EXTENSIONS)]:
+      if not os.path.exists(file):
+         continue
+      try:
+         if file.endswith(".parquet"):
+            data = pd.read_parquet(file)
+            # parquet turns missing values in text columns into None, read_csv gives NaN
+            for col in data.columns[data.dtypes == object]:
+               data[col] = data[col].where(data[col].notna(), np.nan)
+         else:
+            data = pd.read_pickle(file)
+         os.utime(file) # modification time marks when the entry was last used
+         return data
+      except Exception: # deleted by another process or a broken file, parse the csv again
+         remove_entry(key)
+   return None
+
+
+def save_entry(key: str, data: pd.DataFrame, info: dict) -> int:
+   """
+   Saves the entry for key. Returns the number of bytes written.
+   """
+   os.makedirs(CACHE_DIR, exist_ok=True)
+   parquet_file, pickle_file, info_file = entry_files(key)
+   # write then rename so other processes never load half of a file
+   try:
+      data.to_parquet(parquet_file + PART_EXTENSION)
+      data_file = parquet_file
+   except Exception: # pyarrow missing or columns parquet can not hold (mixed types, non text names)
+      if os.path.exists(parquet_file + PART_EXTENSION):
+         os.remove(parquet_file + PART_EXTENSION)
+      data.to_pickle(pickle_file + PART_EXTENSION)
+      data_file = pickle_file
+   written = os.path.getsize(data_file + PART_EXTENSION)
+   os.replace(data_file + PART_EXTENSION, data_file)
+   with open(info_file + PART_EXTENSION, 'w') as f:
+      json.dump(info, f, default=str)
+   written += os.path.getsize(info_file + PART_EXTENSION)
+   os.replace(info_file + PART_EXTENSION, info_file)
+   return written
+
+
+def add_cache_bytes(added: int) -> int:
+   """
+   Adds a new entry's bytes to the cache size seen by this process and returns it. The first
+   call scans the cache, which already holds the new entry.
+   """
+   global _cache_bytes
+   if _cache_bytes is None:
+      _cache_bytes = sum(e["bytes"] for e in entries()) + sum(size for _, size, _ in part_files())
+   else:
+      _cache_bytes += added
+   return _cache_bytes
+
+
+def remove_entry(key: str):
+   for file in entry_files(key):
+      remove_file(file)
+
+
+def entries() -> list[dict]:
+   """
+   Returns the cached entries, most recently used first.
+   """
+   if not os.path.isdir(CACHE_DIR):
+      return []
+   found = []
+   for name in os.listdir(CACHE_DIR):
+      key, ext = os.path.splitext(name)
+      if ext not in DATA_EXTENSIONS:
+         continue
+      try:
+         stat = os.stat(os.path.join(CACHE_DIR, name))
+      except OSError: # removed by another process
+         continue
+      entry = {"key": key, "source": "", "bytes": stat.st_size, "last_used": stat.st_mtime}
+      info_file = os.path.join(CACHE_DIR, key + ".json")
+      try:
+         with open(info_file, 'r') as f:
+            entry["source"] = json.load(f).get("source", "")
+         entry["bytes"] += os.path.getsize(info_file)
+      except (OSError, ValueError):
+         pass
+      found.append(entry)
+   return sorted(found, key=lambda e: e["last_used"], reverse=True)
+
+
+def part_files() -> list[tuple[str, int, float]]:
+   """
+   Returns the path, size and modification time of the files still being written (or left by a crashed write).
+   """
+   if not os.path.isdir(CACHE_DIR):
+      return []
+   found = []
+   for name in os.listdir(CACHE_DIR):
+      if name.endswith(PART_EXTENSION):
+         try:
+            stat = os.stat(os.path.join(CACHE_DIR, name))
+         except OSError: # renamed or removed by another process
+            continue
+         found.append((os.path.join(CACHE_DIR, name), stat.st_size, stat.st_mtime))
+   return found
+
+
+def remove_file(file: str):
+   try:
+      os.remove(file)
+   except FileNotFoundError: # removed or renamed by another process
+      pass
+
+
+def evict(max_bytes: int):
+   """
+   Deletes part files older than STALE_PART_SECONDS, then the least recently used entries until
+   the cache is at most max_bytes. Part files that are still being written count towards the size.
+   """
+   global _cache_bytes
+   total = 0
+   for file, size, modified in part_files():
+      if time.time() - modified > STALE_PART_SECONDS:
+         remove_file(file)
+      else:
+         total += size
+   kept = total
+   for entry in entries():
+      total += entry["bytes"]
+      if total > max_bytes:
+         remove_entry(entry["key"])
+      else:
+         kept = total
+   _cache_bytes = kept
+
+
+def clear():
+   global _cache_bytes
+   for entry in entries():
+      remove_entry(entry["key"])
+   for file, _, _ in part_files():
+      remove_file(file)
+   _cache_bytes = 0
+
+
+if __name__ == '__main__':
+   """
+   Inspect or clear the cache.
+
+   Parameters:
+      argv[1] info, list or clear
+   """
+   command = sys.argv[1] if len(sys.argv) > 1 else "info"
+   if command == "info":
+      found = entries()
+      print(f"cache directory: {CACHE_DIR}{'' if ENABLED else ' (turned off)'}")
+      print(f"{len(found)} files, {sum(e['bytes'] for e in found) / 1024**2:.1f} MB "
+            f"of {MAX_CACHE_BYTES / 1024**2:.0f} MB")
+   elif command == "list":
+      for e in entries():
+         print(f"{e['bytes'] / 1024**2:9.1f} MB  {time.strftime('%Y-%m-%d %H:%M', time.localtime(e['last_used']))}  {e['source']}")
+   elif command == "clear":
+      count = len(entries())
+      clear()
+      print(f"Removed {count} files from {CACHE_DIR}")
+   else:
+      print(f"unknown command {command}, use info, list or clear")
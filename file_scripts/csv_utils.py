@@ -2,42 +2,70 @@ from glob import glob
 import os
 import sys
 import pandas as pd
+import csv_cache as cc
 
 """
    Generic version of Daniel's csv combining code
 """
 
-def multi_concat(in_files: list[str], out_file: str, add_pid=False):
+def multi_concat(in_files: list[str], out_file: str, add_pid=False, append=False):
    """
-   Concat a list of csv files
+   Concat a list of csv files. Files with different columns are combined into the
+   union of their columns, values a file does not have are left blank.
 
    Parameter:
       in_files (list[str]): csv files to combine
       out_file (str): file to save result
       add_pid (bool): whether to add participant id
+      append (bool): write each file to out_file as soon as it is read instead of keeping
+         all of them in memory. Only the column names are read ahead of time. Rows are
+         ordered by the PID in the file name when add_pid is set, otherwise by file.
    """
+   # skip the output file and files that do not exist
+   in_files = [file for file in in_files if file != out_file and os.path.exists(file)]
+   if append and in_files:
+      append_concat(in_files, out_file, add_pid)
+      return
 
-   all_data = pd.DataFrame()
-   for file in in_files:
-      #check if file exists
-      if file == out_file:
-         continue
-      if not os.path.exists(file): 
-         continue
-      df = pd.read_csv(file)
-
-      # we are assuming file name "pid_*" and has headers 
-      if add_pid:
-         pid = os.path.basename(file).split('_')[0]
-         df.insert(0, "PID", pid, allow_duplicates=False)
-      # # 
-      # if all_data.empty:
-      #    all_data = df
-      #else:
-      all_data = pd.concat([all_data, df], ignore_index=True)
+   frames = [read_with_pid(file, add_pid) for file in in_files]
+   all_data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
    if "PID" in all_data.columns:
       all_data= all_data.sort_values(by=['PID'])
    all_data.to_csv(out_file, index=False)
+
+
+def append_concat(in_files: list[str], out_file: str, add_pid=False):
+   """
+   multi_concat that only keeps one file in memory at a time.
+   """
+   headers = [pd.read_csv(file, nrows=0).columns.tolist() for file in in_files]
+   columns = union_columns([(["PID"] if add_pid else []) + cols for cols in headers])
+   if add_pid:
+      # every row in a file has the same pid, so ordering the files orders the rows
+      in_files = sorted(in_files, key=file_pid)
+   with open(out_file, 'w', newline='') as out:
+      for i, file in enumerate(in_files):
+         df = read_with_pid(file, add_pid)
+         df.reindex(columns=columns).to_csv(out, header=i == 0, index=False)
+
+
+def read_with_pid(file: str, add_pid=False) -> pd.DataFrame:
+   df = cc.read_csv(file)
+   # we are assuming file name "pid_*" and has headers 
+   if add_pid:
+      df.insert(0, "PID", file_pid(file), allow_duplicates=False)
+   return df
+
+
+def file_pid(file: str) -> str:
+   return os.path.basename(file).split('_')[0]
+
+
+def union_columns(column_lists: list[list[str]]) -> list[str]:
+   """
+   Combines lists of column names in the order they are first seen, like pd.concat does.
+   """
+   return list(dict.fromkeys(col for cols in column_lists for col in cols))
    
 
 def directory_concat(in_dir: str, out_file: str, include: str ='*.csv', exclude: str='', walk: bool=False, add_pid=False):
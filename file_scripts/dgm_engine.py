@@ -0,0 +1,287 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import aoi_DGM_reformat as adr
+import csv_cache as cc
+import csv_utils as cu
+
+"""
+Computes the descriptive gaze measures (DGMs) of the external DGM tool straight from GazePoint
+fixation data, for the whole screen and for every AOI. The output files have the columns in
+aoi_DGM_reformat.DGM_COLUMNS so the scripts that read *_DGMs.csv and *AOI_DGMs.csv files work on them,
+except that "Average Peak Saccade Velocity" is "Average Saccade Velocity" (see DGM_COLUMNS).
+
+Input is a csv with the GazePoint fixation columns (FPOGX, FPOGY, FPOGS, FPOGD, FPOGID and optionally
+FPOGV, AOI, LPMM(V), RPMM(V), BKPMIN, CS), e.g. a fixations export or tag_aois.py output. Gaze files
+with several samples per fixation are collapsed to the last sample of each fixation.
+
+How the measures are defined:
+   - positions are converted to pixels with the screen size, lengths and the convex hull are in pixels
+   - a saccade goes from one fixation to the next, its duration is the time between the end of
+     the first fixation and the start of the next
+   - absolute degree is the angle of a saccade to the horizontal (0 to 90), relative degree is the
+     angle between two saccades in a row (0 to 180). Saccades with length 0 have no angle
+   - saccade velocity is the saccade length in degrees of visual angle over its duration. The peak
+     velocity inside a saccade needs the gaze samples of the saccade, which fixation data does not have
+   - the number of valid recordings is the number of valid gaze samples of the fixations (one per
+     fixation in a fixations export), see fixation_rows
+   - stationary entropy uses the share of fixations in each AOI, transition entropy uses the share
+     of each AOI to AOI pair of fixations in a row (log base 10)
+   - standard deviations are sample standard deviations
+   - the AOI measures are the same measures computed on only the fixations in that AOI
+"""
+
+# the saccade velocity is the average over the whole saccade, not the peak the external tool measures
+DGM_COLUMNS = ["Average Saccade Velocity" if col == "Average Peak Saccade Velocity" else col for col in adr.DGM_COLUMNS]
+# number of valid samples of each fixation, added by fixation_rows
+SAMPLES_COL = "VALID_SAMPLES"
+
+SCREEN_SIZE = (1920, 1080)
+# 24 inch 1920x1080 monitor (53.1 cm wide) seen from 65 cm
+PIXELS_PER_DEGREE = 41.0
+
+
+def fixation_rows(data: pd.DataFrame, id_col: str = "FPOGID", valid_col: str = "FPOGV") -> pd.DataFrame:
+   """
+   Keeps the valid samples and the last sample of each fixation, in recording order. The number
+   of valid samples of each fixation is put in SAMPLES_COL (added up if data already has it).
+   """
+   if valid_col in data.columns:
+      data = data[data[valid_col] == 1]
+   ids = data[id_col].to_numpy()
+   last = np.ones(len(ids), dtype=bool)
+   last[:-1] = ids[1:] != ids[:-1]
+   first = np.flatnonzero(np.concatenate(([True], last[:-1]))) if len(ids) else np.empty(0, dtype=np.intp)
+   samples = data[SAMPLES_COL].to_numpy(dtype=np.int64) if SAMPLES_COL in data.columns else np.ones(len(ids), dtype=np.int64)
+   counts = np.add.reduceat(samples, first) if len(ids) else samples
+   return data[last].assign(**{SAMPLES_COL: counts})
+
+
+def describe(values: np.ndarray) -> list[float]:
+   """
+   Returns:
+      [sum, mean, median, standard deviation, min, max] of the values, NaN when there are none
+      (0 for the sum). The standard deviation needs at least two values.
+   """
+   values = np.asarray(values, dtype=float)
+   values = values[~np.isnan(values)]
+   if len(values) == 0:
+      return [0.0] + [np.nan] * 5
+   std = values.std(ddof=1) if len(values) > 1 else np.nan
+   return [values.sum(), values.mean(), np.median(values), std, values.min(), values.max()]
+
+
+def convex_hull_area(x: np.ndarray, y: np.ndarray) -> float:
+   """
+   Area of the convex hull of the points. Quickhull: every point found farthest outside an edge
+   of the hull so far adds the triangle between it and that edge, and those triangles add up to
+   the hull area. Each step only checks the points still outside of the edge being split.
+   """
+   points = np.column_stack((x, y))[~(np.isnan(x) | np.isnan(y))]
+   if len(points) < 3:
+      return 0.0
+   order = np.lexsort((points[:, 1], points[:, 0]))
+   first, last = points[order[0]], points[order[-1]]
+   area = 0.0
+   edges = [(first, last, points), (last, first, points)]
+   while edges:
+      a, b, candidates = edges.pop()
+      # twice the area of the triangle a, b, point, positive for points left of a -> b
+      cross = (b[0] - a[0]) * (candidates[:, 1] - a[1]) - (b[1] - a[1]) * (candidates[:, 0] - a[0])
+      outside = cross > 0
+      if not outside.any():
+         continue
+      candidates, cross = candidates[outside], cross[outside]
+      farthest = cross.argmax()
+      area += cross[farthest] / 2
+      edges.append((a, candidates[farthest], candidates))
+      edges.append((candidates[farthest], b, candidates))
+   return float(area)
+
+
+def entropy(counts: np.ndarray) -> float:
+   counts = np.asarray(counts, dtype=float).ravel()
+   total = counts.sum()
+   if total == 0:
+      return np.nan
+   shares = counts[counts > 0] / total
+   return float(-(shares * np.log10(shares)).sum() + 0.0)
+
+
+def valid_values(data: pd.DataFrame, col: str) -> np.ndarray:
+   """
+   Values of col where its validity column (col + 'V') is 1, NaN elsewhere.
+   """
+   if col not in data.columns:
+      return np.full(len(data), np.nan)
+   values = data[col].to_numpy(dtype=float)
+   if col + "V" in data.columns:
+      values = np.where(data[col + "V"].to_numpy() == 1, values, np.nan)
+   return values
+
+
+def compute_dgms(
+      fixations: pd.DataFrame,
+      aois: list[str] = None,
+      aoi_col: str = "AOI",
+      screen_size: tuple[int, int] = SCREEN_SIZE,
+      pixels_per_degree: float = PIXELS_PER_DEGREE
+) -> dict:
+   """
+   Computes every DGM of a sequence of fixations.
+
+   Parameters:
+      fixations (DataFrame): one row per fixation in recording order, see fixation_rows
+      aois (list[str]): AOIs used for the entropies, defaults to the labels in the data
+      aoi_col (str): column with the AOI labels
+      screen_size (tuple): screen width and height in pixels
+      pixels_per_degree (float): pixels in one degree of visual angle
+
+   Returns:
+      dict of DGM column name to value, in DGM_COLUMNS order
+   """
+   x = fixations["FPOGX"].to_numpy(dtype=float) * screen_size[0]
+   y = fixations["FPOGY"].to_numpy(dtype=float) * screen_size[1]
+   start = fixations["FPOGS"].to_numpy(dtype=float)
+   duration = fixations["FPOGD"].to_numpy(dtype=float)
+
+   dx, dy = np.diff(x), np.diff(y)
+   length = np.hypot(dx, dy)
+   saccade_duration = start[1:] - (start[:-1] + duration[:-1])
+   moved = length > 0
+   absolute = np.degrees(np.arctan2(np.abs(dy[moved]), np.abs(dx[moved])))
+   # angle between each saccade and the next one, both with length > 0
+   ux, uy = dx[moved] / length[moved], dy[moved] / length[moved]
+   relative = np.degrees(np.arccos(np.clip(ux[:-1] * ux[1:] + uy[:-1] * uy[1:], -1, 1)))
+   with np.errstate(divide='ignore', invalid='ignore'):
+      velocity = np.where(saccade_duration > 0, length / pixels_per_degree / saccade_duration, np.nan)
+
+   fixation_stats = describe(duration)
+   saccade_length_stats = describe(length)
+   saccade_duration_stats = describe(saccade_duration)
+
+   if aoi_col in fixations.columns:
+      labels = fixations[aoi_col].fillna('').astype(str).str.strip()
+      aois = aois or sorted(set(labels[labels != '']))
+      codes = pd.Index(aois).get_indexer(labels)
+      stationary = entropy(np.bincount(codes[codes >= 0], minlength=len(aois)))
+      known = (codes[:-1] >= 0) & (codes[1:] >= 0)
+      transition = entropy(np.bincount(codes[:-1][known] * len(aois) + codes[1:][known], minlength=len(aois) ** 2))
+   else:
+      stationary = transition = np.nan
+
+   left, right = valid_values(fixations, "LPMM"), valid_values(fixations, "RPMM")
+   both = (left + right) / 2
+   blinks = fixations["BKPMIN"].to_numpy(dtype=float) if "BKPMIN" in fixations.columns else np.array([np.nan])
+   clicks = int((fixations["CS"] == 1).sum()) if "CS" in fixations.columns else 0
+   recordings = int(fixations[SAMPLES_COL].sum()) if SAMPLES_COL in fixations.columns else len(duration)
+
+   def mean(values):
+      values = values[~np.isnan(values)]
+      return values.mean() if len(values) else np.nan
+
+   return dgm_row(
+      len(duration), fixation_stats, len(length), saccade_length_stats, saccade_duration_stats,
+      mean(velocity), describe(absolute), describe(relative), convex_hull_area(x, y),
+      stationary, transition, mean(blinks), recordings, mean(left), mean(right), mean(both), clicks
+   )
+
+
+def dgm_row(
+      fixation_count: int,
+      fixation_stats: list[float],
+      saccade_count: int,
+      saccade_length_stats: list[float],
+      saccade_duration_stats: list[float],
+      saccade_velocity: float,
+      absolute_stats: list[float],
+      relative_stats: list[float],
+      hull_area: float,
+      stationary: float,
+      transition: float,
+      blink_rate: float,
+      valid_recordings: int,
+      left_pupil: float,
+      right_pupil: float,
+      both_pupils: float,
+      clicks: int
+) -> dict:
+   """
+   Puts the measures in DGM_COLUMNS order. The *_stats lists are describe output.
+   """
+   fixation_sum, saccade_sum = fixation_stats[0], saccade_duration_stats[0]
+   values = (
+      [fixation_count] + fixation_stats
+      + [saccade_count] + saccade_length_stats + saccade_duration_stats
+      + [fixation_sum + saccade_sum, fixation_sum / saccade_sum if saccade_sum else np.nan, saccade_velocity]
+      + absolute_stats + relative_stats
+      + [hull_area, stationary, transition, blink_rate, valid_recordings,
+         left_pupil, right_pupil, both_pupils, clicks]
+   )
+   return dict(zip(DGM_COLUMNS, values))
+
+
+def aoi_dgms(fixations: pd.DataFrame, aois: list[str] = None, aoi_col: str = "AOI", **kwargs) -> pd.DataFrame:
+   """
+   Computes the DGMs of each AOI, see compute_dgms.
+
+   Returns:
+      one row per AOI with an AOI column followed by the DGM columns
+   """
+   labels = fixations[aoi_col].fillna('').astype(str).str.strip()
+   aois = aois or sorted(set(labels[labels != '']))
+   rows = [compute_dgms(fixations[(labels == aoi).to_numpy()], aois, aoi_col, **kwargs) for aoi in aois]
+   table = pd.DataFrame(rows, columns=DGM_COLUMNS)
+   table.insert(0, "AOI", aois)
+   return table
+
+
+def file_dgms(in_file: str, out_dir: str, aois: list[str] = None, **kwargs) -> str:
+   """
+   Writes <PID>_DGMs.csv (whole screen, one row) and <PID>_AOI_DGMs.csv (one row per AOI)
+   for one fixation or gaze file.
+
+   Parameters:
+      in_file (str): csv with GazePoint fixation columns
+      out_dir (str): directory to save the DGM files to
+      aois (list[str]): AOIs in output order, defaults to the AOIs found in the file
+      kwargs: screen_size and pixels_per_degree, see compute_dgms
+
+   Returns:
+      participant id
+   """
+   pid = os.path.basename(in_file).split("_")[0]
+   fixations = fixation_rows(cc.read_csv(in_file))
+   pd.DataFrame([compute_dgms(fixations, aois, **kwargs)]).to_csv(os.path.join(out_dir, f"{pid}_DGMs.csv"), index=False)
+   if "AOI" in fixations.columns:
+      aoi_dgms(fixations, aois, **kwargs).to_csv(os.path.join(out_dir, f"{pid}_AOI_DGMs.csv"), index=False)
+   return pid
+
+
+def run_directory(in_dir: str, out_dir: str, in_pattern: str = "*fixations.csv", aois: list[str] = None, **kwargs) -> int:
+   """
+   Writes the DGM files of every file matching in_pattern in a directory and its sub directories.
+   Pass aois so every participant has the same AOI rows.
+
+   Returns:
+      number of files read
+   """
+   os.makedirs(out_dir, exist_ok=True)
+   in_files = []
+   for dir, _, _ in os.walk(in_dir):
+      in_files.extend(cu.glob_filter(dir, in_pattern))
+   for in_file in sorted(in_files):
+      file_dgms(in_file, out_dir, aois, **kwargs)
+   print(f"Wrote DGMs for {len(in_files)} files to {out_dir}")
+   return len(in_files)
+
+
+if __name__ == '__main__':
+   """
+   Parameters:
+      argv[1] directory of fixation files
+      argv[2] directory to save the DGM files to
+      argv[3] optional glob pattern of the fixation files (default *fixations.csv)
+   """
+   run_directory(sys.argv[1], sys.argv[2], *sys.argv[3:4])
@@ -0,0 +1,283 @@
+import os
+import sys
+from typing import Iterable, Iterator
+import numpy as np
+import pandas as pd
+
+"""
+Puts GazePoint, X-Plane recorder and EmbracePlus csv files on one clock, a chunk at a time, so a
+whole session never has to be in memory.
+
+Every stream is a Source: a csv file (or DataFrame chunks) with a time column. Times are converted
+to unix milliseconds and moved by the stream's clock offset:
+   - GazePoint: TIME(<recording start>) seconds since the recording started
+   - X-Plane recorder: sys_unix_time, unix milliseconds
+   - EmbracePlus: timestamp_unix, unix milliseconds
+
+The common clock is either a fixed rate grid or the samples of a reference stream (e.g. the gaze
+samples). At each clock time a Source gives
+   - numeric columns: the value interpolated between the samples before and after, if those are at
+     most tolerance ms apart (an exact match is always used)
+   - other columns (AOI labels, phases, ...): the last value at or before the clock time, if it is at
+     most tolerance ms old (an as-of merge)
+and NaN otherwise. A Source only keeps the samples it still needs, so chunks are read as the clock
+moves forward. Each Source's times must be sorted.
+
+Parameters:
+   argv[1] csv file to write the synchronized data to
+   argv[2] clock rate in Hz
+   argv[3..n] input csv files, their type is found from the time column
+"""
+
+CLOCK_COL = "timestamp_unix"
+# time columns of the recorders in unix milliseconds
+UNIX_MS_COLUMNS = ["timestamp_unix", "sys_unix_time"]
+GAZEPOINT_TIME_PREFIX = "TIME("
+GAZEPOINT_TIMEZONE = "US/Pacific"
+
+
+def gazepoint_start(time_col: str, tz: str = GAZEPOINT_TIMEZONE) -> float:
+   """
+   Unix milliseconds of the recording start in a GazePoint time column name,
+   e.g. TIME(2023/03/01 10:15:00.000). GazePoint writes the local time of the recording computer.
+   """
+   start = pd.Timestamp(time_col[len(GAZEPOINT_TIME_PREFIX):-1].replace("/", "-")).tz_localize(tz)
+   return start.value / 1e6
+
+
+def offset_from_events(times: np.ndarray, reference_times: np.ndarray) -> float:
+   """
+   Clock offset (ms) to add to a stream so events it recorded line up with the same events on the
+   reference clock, e.g. sync clicks or key presses seen by both. The median ignores a few bad matches.
+   """
+   return float(np.median(np.asarray(reference_times, dtype=float) - np.asarray(times, dtype=float)))
+
+
+class Source:
+   """
+   One stream to synchronize.
+
+   Parameters:
+      data (str or iterable of DataFrames): csv file, read chunksize rows at a time, or DataFrame chunks in time order
+      columns (list[str]): columns to take, defaults to every column but the time column
+      time_col (str): time column, found from UNIX_MS_COLUMNS or the GazePoint TIME( column if None
+      scale (float): milliseconds per time unit, found from the time column if None
+      offset (float): milliseconds added to the times to move them onto the common clock
+      tolerance (float): largest gap (ms) to interpolate over / age of an as-of value
+      interpolate (bool): False takes the last value for numeric columns too (flags, counters, ...)
+      prefix (str): put in front of the output column names
+      tz (str): timezone of the GazePoint recording start
+   """
+
+   def __init__(
+         self,
+         data,
+         columns: list[str] = None,
+         time_col: str = None,
+         scale: float = None,
+         offset: float = 0.0,
+         tolerance: float = np.inf,
+         interpolate: bool = True,
+         prefix: str = "",
+         chunksize: int = 100_000,
+         tz: str = GAZEPOINT_TIMEZONE
+   ):
+      self.data = data
+      self.columns = columns
+      self.time_col = time_col
+      self.scale = scale
+      self.offset = offset
+      self.tolerance = tolerance
+      self.interpolate = interpolate
+      self.prefix = prefix
+      self.chunksize = chunksize
+      self.tz = tz
+      self.start = 0.0 # unix ms of time 0, for GazePoint
+      self.chunks = None
+      self.done = False
+      self.times = np.empty(0)
+      self.values = {}
+
+
+   def find_time_col(self, data: pd.DataFrame):
+      if self.time_col is None:
+         gazepoint = [col for col in data.columns if str(col).startswith(GAZEPOINT_TIME_PREFIX)]
+         unix = [col for col in UNIX_MS_COLUMNS if col in data.columns]
+         if not gazepoint and not unix:
+            raise KeyError(f"no time column found, pass time_col (columns: {list(data.columns)[:10]}...)")
+         self.time_col = gazepoint[0] if gazepoint else unix[0]
+      if str(self.time_col).startswith(GAZEPOINT_TIME_PREFIX):
+         self.start = gazepoint_start(self.time_col, self.tz)
+         self.scale = 1000.0 if self.scale is None else self.scale
+      self.scale = 1.0 if self.scale is None else self.scale
+      if self.columns is None:
+         self.columns = [col for col in data.columns if col != self.time_col]
+
+
+   def aligned_chunks(self) -> Iterator[tuple[np.ndarray, dict]]:
+      """
+      Yields the times on the common clock and the column values of each chunk.
+      """
+      chunks = pd.read_csv(self.data, chunksize=self.chunksize) if isinstance(self.data, str) else self.data
+      previous = -np.inf
+      for chunk in chunks:
+         if self.columns is None or self.time_col not in chunk.columns:
+            self.find_time_col(chunk)
+         times = self.start + chunk[self.time_col].to_numpy(dtype=float) * self.scale + self.offset
+         if len(times) == 0:
+            continue
+         if times[0] < previous or np.any(np.diff(times) < 0):
+            raise ValueError(f"times in {self.data if isinstance(self.data, str) else 'the data'} are not sorted")
+         previous = times[-1]
+         yield times, {col: chunk[col].to_numpy() for col in self.columns}
+
+
+   def read(self) -> bool:
+      """
+      Adds the next chunk to the kept samples. Returns False once there are no more chunks.
+      """
+      if self.chunks is None:
+         self.chunks = self.aligned_chunks()
+      chunk = next(self.chunks, None)
+      if chunk is None:
+         self.done = True
+         return False
+      times, values = chunk
+      self.times = np.concatenate((self.times, times))
+      for col, column in values.items():
+         self.values[col] = np.concatenate((self.values[col], column)) if col in self.values else column
+      return True
+
+
+   def first_time(self) -> float:
+      while len(self.times) == 0 and self.read():
+         pass
+      return self.times[0] if len(self.times) else np.nan
+
+
+   def last_time(self) -> float:
+      """
+      Time of the last sample, once every chunk was read (NaN before that).
+      """
+      return self.times[-1] if self.done and len(self.times) else np.nan
+
+
+   def sample(self, clock: np.ndarray) -> dict:
+      """
+      Values of every column at the clock times, see the module docstring. Clock times have to be
+      sorted and later than the ones of the previous call.
+      """
+      while not self.done and (len(self.times) == 0 or self.times[-1] <= clock[-1]):
+         self.read()
+      times = self.times
+      count = len(times)
+      if count == 0:
+         return {self.prefix + str(col): np.full(len(clock), np.nan) for col in self.columns or []}
+      last = np.searchsorted(times, clock, side='right') - 1 # last sample at or before each clock time
+      has_last = last >= 0
+      age = clock - times[np.maximum(last, 0)]
+      asof = has_last & (age <= self.tolerance)
+      after = np.minimum(last + 1, count - 1)
+      between = has_last & (last + 1 < count) & (times[after] - times[np.maximum(last, 0)] <= self.tolerance)
+      interpolated = (has_last & (age == 0)) | between
+
+      out = {}
+      for col in self.columns:
+         values = self.values[col]
+         if self.interpolate and values.dtype.kind in "fiub":
+            column = np.interp(clock, times, values.astype(float))
+            column[~interpolated] = np.nan
+         else:
+            column = values[np.maximum(last, 0)]
+            column = np.where(asof, column, np.nan if values.dtype.kind in "fiub" else None)
+         out[self.prefix + str(col)] = column
+
+      # keep the last sample at or before the clock for the next clock times
+      keep = max(np.searchsorted(times, clock[-1], side='right') - 1, 0)
+      self.times = times[keep:]
+      self.values = {col: values[keep:] for col, values in self.values.items()}
+      return out
+
+
+def synchronize(
+      sources: list[Source],
+      rate: float = None,
+      reference: Source = None,
+      start: float = None,
+      end: float = None,
+      chunk_rows: int = 100_000
+) -> Iterator[pd.DataFrame]:
+   """
+   Yields the synchronized data a chunk at a time: a timestamp_unix column (ms) followed by the
+   columns of the reference and of every source.
+
+   Parameters:
+      sources (list[Source]): streams to put on the clock
+      rate (float): clock rate in Hz, for a fixed rate clock from start to end. start defaults to
+         the first sample of any source and end to the last one
+      reference (Source): stream whose sample times are the clock instead, its columns are kept as they are
+      chunk_rows (int): clock times per chunk (fixed rate clock)
+   """
+   if (rate is None) == (reference is None):
+      raise ValueError("pass either a rate or a reference stream")
+   if reference is not None:
+      for clock, values in reference.aligned_chunks():
+         keep = (clock >= (-np.inf if start is None else start)) & (clock <= (np.inf if end is None else end))
+         if not keep.any():
+            continue
+         chunk = clock_chunk(clock[keep], sources)
+         for i, (col, column) in enumerate(values.items()):
+            chunk.insert(i + 1, reference.prefix + str(col), column[keep])
+         yield chunk
+      return
+
+   period = 1000.0 / rate
+   if start is None:
+      start = np.nanmin([source.first_time() for source in sources])
+   step = 0
+   while True:
+      clock = start + np.arange(step, step + chunk_rows) * period
+      if end is not None:
+         clock = clock[clock <= end]
+      else:
+         # stop after the last sample of every source
+         for source in sources:
+            while not source.done and (len(source.times) == 0 or source.times[-1] <= clock[-1]):
+               source.read()
+         if all(source.done for source in sources):
+            clock = clock[clock <= np.nanmax([source.last_time() for source in sources])]
+      if len(clock) == 0:
+         return
+      yield clock_chunk(clock, sources)
+      if len(clock) < chunk_rows:
+         return
+      step += chunk_rows
+
+
+def clock_chunk(clock: np.ndarray, sources: list[Source]) -> pd.DataFrame:
+   columns = {CLOCK_COL: clock}
+   for source in sources:
+      for col, values in source.sample(clock).items():
+         if col in columns:
+            raise ValueError(f"column {col} is in more than one source, give the sources a prefix")
+         columns[col] = values
+   return pd.DataFrame(columns)
+
+
+def write_csv(chunks: Iterable[pd.DataFrame], out_path: str) -> int:
+   """
+   Writes the chunks of synchronize to one csv file. Returns the number of rows.
+   """
+   rows = 0
+   for i, chunk in enumerate(chunks):
+      chunk.to_csv(out_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+      rows += len(chunk)
+   return rows
+
+
+if __name__ == '__main__':
+   out_path, rate = sys.argv[1], float(sys.argv[2])
+   # the file name keeps columns with the same name (e.g. two EmbracePlus files) apart
+   sources = [Source(path, prefix=os.path.splitext(os.path.basename(path))[0] + ":") for path in sys.argv[3:]]
+   rows = write_csv(synchronize(sources, rate=rate), out_path)
+   print(f"Wrote {rows} rows to {out_path}")
@@ -1,6 +1,12 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import json
 import os
 from pathlib import Path
+from time import perf_counter
+import numpy as np
 import pandas as pd
+import csv_cache as cc
 import csv_utils as cu
 
 """
@@ -63,10 +69,25 @@ all_aois = [
    AOI('RPM', 0.875, 0.560, 0.075, 0.125)
 ]
 
+# add_aoi_to_directory keeps track of what it already tagged in this file inside the output directory
+MANIFEST_NAME = ".tag_aois_manifest.json"
 
-def add_aoi_to_directory(in_dir: str, out_dir: str, in_pattern: str = "*all_gaze.csv"):
+
+def add_aoi_to_directory(
+      in_dir: str,
+      out_dir: str,
+      in_pattern: str = "*all_gaze.csv",
+      chunksize: int = None,
+      workers: int = 1,
+      force: bool = False
+   ) -> list[dict]:
    """
-   Tags all files in a directory with new AOIs.
+   Tags all files in a directory with new AOIs. A file that fails to tag is reported
+   and skipped, the rest of the files are still tagged.
+
+   Files are skipped when they were already tagged into out_dir, their contents have not
+   changed and all_aois has not changed. This is tracked in a manifest (MANIFEST_NAME) saved
+   in out_dir. Changing any AOI re-tags every file.
    
    Parameters:
       in_dir (str):
@@ -75,18 +96,158 @@ def add_aoi_to_directory(in_dir: str, out_dir: str, in_pattern: str = "*all_gaze
          file path to save the new files at
       in_patterns (str):
          optional glob pattern to match file names to
+      chunksize (int):
+         optional number of rows to tag at a time, see add_aoi_to_file
+      workers (int):
+         number of processes tagging files at the same time
+      force (bool):
+         re-tag every file even if it did not change
+
+   Returns:
+      list of results from tag_file_job, one per file that was tagged
    """
    Path(out_dir).mkdir(parents=True, exist_ok=True)
    in_files = []
    for dir, _, _ in os.walk(in_dir):
       in_files.extend(cu.glob_filter(dir, in_pattern))
+
+   manifest_file = os.path.join(out_dir, MANIFEST_NAME)
+   manifest = {} if force else read_manifest(manifest_file)
+   aois = aoi_hash(all_aois)
+   tagged = manifest.get("files", {}) if manifest.get("aois") == aois else {}
+   manifest = {"aois": aois, "files": tagged}
+
+   jobs = []
+   sources = {}
    for file in in_files:
       file_name = os.path.basename(file)
       out_file = os.path.join(out_dir, file_name)
-      add_aoi_to_file(file, out_file)
+      previous = tagged.get(file_name)
+      sources[file] = file_state(file, previous)
+      if previous and previous["sha256"] == sources[file]["sha256"] and os.path.exists(out_file):
+         tagged[file_name] = sources[file] # keeps a touched but unchanged file from being hashed again
+         continue
+      jobs.append((file, out_file, chunksize))
+   if len(jobs) < len(in_files):
+      write_manifest(manifest_file, manifest)
+      print(f"Skipping {len(in_files) - len(jobs)} files that are already tagged")
+
+   start = perf_counter()
+   results = []
+
+   def finish(result: dict):
+      results.append(result)
+      print_progress(result, len(results), len(jobs))
+      if not result["error"]:
+         tagged[os.path.basename(result["file"])] = sources[result["file"]]
+         write_manifest(manifest_file, manifest)
 
+   if workers > 1:
+      with ProcessPoolExecutor(max_workers=workers) as pool:
+         futures = {pool.submit(tag_file_job, *job): job[0] for job in jobs}
+         for future in as_completed(futures):
+            try:
+               result = future.result()
+            except Exception as e: # the worker process itself died
+               result = {"file": futures[future], "rows": 0, "seconds": 0.0, "worker": None, "error": repr(e)}
+            finish(result)
+   else:
+      for job in jobs:
+         finish(tag_file_job(*job))
+   print_summary(results, perf_counter() - start)
+   return results
 
-def add_aoi_to_file(in_file: str, outfile: str):
+
+def aoi_hash(aois: list[AOI]) -> str:
+   """
+   Hash of the AOI names, positions and order.
+   """
+   areas = [[area.name, area.x1, area.y1, area.x2, area.y2] for area in aois]
+   return hashlib.sha256(json.dumps(areas).encode()).hexdigest()
+
+
+def file_state(file: str, previous: dict = None) -> dict:
+   """
+   Returns the size, modification time and sha256 hash of a file. The hash is reused from
+   previous when the size and modification time have not changed, so unchanged files are not read.
+   """
+   stat = os.stat(file)
+   state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+   if previous and previous.get("size") == state["size"] and previous.get("mtime_ns") == state["mtime_ns"]:
+      state["sha256"] = previous["sha256"]
+      return state
+   sha = hashlib.sha256()
+   with open(file, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+         sha.update(block)
+   state["sha256"] = sha.hexdigest()
+   return state
+
+
+def read_manifest(manifest_file: str) -> dict:
+   if not os.path.exists(manifest_file):
+      return {}
+   try:
+      with open(manifest_file, 'r') as f:
+         return json.load(f)
+   except ValueError: # corrupt manifest, tag everything again
+      return {}
+
+
+def write_manifest(manifest_file: str, manifest: dict):
+   # write then rename so an interrupted run never leaves half a manifest behind
+   with open(manifest_file + ".part", 'w') as f:
+      json.dump(manifest, f, indent=1)
+   os.replace(manifest_file + ".part", manifest_file)
+
+
+def tag_file_job(in_file: str, out_file: str, chunksize: int = None) -> dict:
+   """
+   Tags a single file for add_aoi_to_directory. Errors are returned instead of raised
+   so one bad file does not stop the other files from being tagged.
+
+   Returns:
+      dict with the input file, rows tagged, seconds taken, worker process id and error message (None if it worked)
+   """
+   start = perf_counter()
+   rows, error = 0, None
+   try:
+      rows = add_aoi_to_file(in_file, out_file, chunksize)
+   except Exception as e:
+      error = f"{type(e).__name__}: {e}"
+   return {"file": in_file, "rows": rows, "seconds": perf_counter() - start, "worker": os.getpid(), "error": error}
+
+
+def print_progress(result: dict, done: int, total: int):
+   name = os.path.basename(result["file"])
+   if result["error"]:
+      print(f"[{done}/{total}] FAILED {name}: {result['error']}")
+   else:
+      print(f"[{done}/{total}] {name}: {result['rows']} rows in {result['seconds']:.1f}s")
+
+
+def print_summary(results: list[dict], wall_time: float):
+   """
+   Prints rows/sec for each worker process and lists the files that failed.
+   """
+   workers = {}
+   for r in results:
+      if r["error"]:
+         continue
+      files, rows, seconds = workers.get(r["worker"], (0, 0, 0.0))
+      workers[r["worker"]] = (files + 1, rows + r["rows"], seconds + r["seconds"])
+   for worker, (files, rows, seconds) in workers.items():
+      print(f"worker {worker}: {files} files, {rows} rows, {rows / max(seconds, 1e-9):,.0f} rows/sec")
+
+   total_rows = sum(r["rows"] for r in results)
+   failed = [r for r in results if r["error"]]
+   print(f"Tagged {len(results) - len(failed)}/{len(results)} files, {total_rows} rows in {wall_time:.1f}s "
+         f"({total_rows / max(wall_time, 1e-9):,.0f} rows/sec)")
+   for r in failed:
+      print(f"   failed: {r['file']} ({r['error']})")
+
+
+def add_aoi_to_file(in_file: str, outfile: str, chunksize: int = None):
    """
    Tags a file with new AOIs.
 
@@ -95,12 +256,118 @@ def add_aoi_to_file(in_file: str, outfile: str):
          file path to the input/starting data
       out_file (str):
          file path to save the tagged data.
+      chunksize (int):
+         optional number of rows to read, tag and write at a time. Memory use stays
+         the same no matter how long the recording is. Output is the same as tagging
+         the whole file at once.
+
+   Returns:
+      number of rows tagged
    """
    cols: list[str] = pd.read_csv(in_file, nrows=0).columns.tolist()
-   data: pd.DataFrame = pd.read_csv(in_file, skiprows=[0])
+   if chunksize:
+      rows = stream_tag_file(in_file, outfile, cols, chunksize)
+      if rows:
+         return rows
+   # low_memory=False types every column from all of its values. The default parses the file in
+   # blocks, so the same value in a mixed type column could come out as 5 in one block and "5" in another
+   data: pd.DataFrame = cc.read_csv(in_file, skiprows=[0], low_memory=False)
    data.columns = cols
    tag_data(data)
    data.to_csv(outfile)
+   return len(data)
+
+
+def stream_tag_file(in_file: str, outfile: str, cols: list[str], chunksize: int) -> int:
+   """
+   Tags a file chunksize rows at a time and appends each chunk to the output.
+
+   pandas picks column types per chunk, while reading the whole file types a column from all of
+   its values: float if any of its values are, text (object) if any value is not a number. Int
+   columns are written as float once they have been float in an earlier chunk. If a column turns
+   float after it was already written as int, or a column has numbers in one chunk and text in
+   another, the output is restarted with that column read as float or as text so the file
+   matches the in-memory version.
+
+   Parameters:
+      in_file (str):
+         file path to the input/starting data
+      out_file (str):
+         file path to save the tagged data.
+      cols (list[str]):
+         column names from the header of in_file
+      chunksize (int):
+         number of rows to read at a time
+
+   Returns:
+      number of rows tagged. 0 if the file has no data rows, nothing is written in that case.
+   """
+   part_file = outfile + ".part"
+   float_cols, object_cols = set(), set()
+   try:
+      restart = True
+      while restart:
+         with open(part_file, 'w', newline='') as out:
+            rows, restart = write_tagged_chunks(in_file, out, cols, chunksize, float_cols, object_cols)
+   except BaseException:
+      os.remove(part_file)
+      raise
+
+   if rows == 0:
+      os.remove(part_file)
+      return 0
+   os.replace(part_file, outfile)
+   return rows
+
+
+def write_tagged_chunks(
+      in_file: str,
+      out,
+      cols: list[str],
+      chunksize: int,
+      float_cols: set,
+      object_cols: set
+) -> tuple[int, bool]:
+   """
+   One pass of stream_tag_file. Columns in object_cols are read as text. Adds columns that
+   need to be written as float to float_cols and columns that need to be read as text to object_cols.
+
+   Returns:
+      rows written and whether the pass has to be restarted
+   """
+   int_cols = set()
+   kinds = {} # 'number' or the dtype kind of each column's values so far
+   rows = 0
+   # same rows as read_csv(skiprows=[0]), which uses the 2nd line as the header
+   dtype = {col: object for col in object_cols}
+   with pd.read_csv(in_file, header=None, names=cols, skiprows=2, chunksize=chunksize, dtype=dtype) as reader:
+      for chunk in reader:
+         restart = False
+         for col in chunk.columns:
+            if col in object_cols:
+               continue
+            kind = chunk[col].dtype.kind
+            # a chunk with only missing values reads as float and fits any column type
+            if not (kind == 'f' and chunk[col].isna().all()):
+               group = 'number' if kind in 'iuf' else kind
+               if kinds.setdefault(col, group) != group:
+                  object_cols.add(col)
+                  restart = True
+                  continue
+            if kind == 'f':
+               restart = restart or col in int_cols
+               float_cols.add(col)
+            elif kind in 'iu':
+               if col in float_cols:
+                  chunk[col] = chunk[col].astype(float)
+               else:
+                  int_cols.add(col)
+         if restart:
+            return rows, True
+         tag_data(chunk)
+         chunk.to_csv(out, header=rows == 0)
+         rows += len(chunk)
+   return rows, False
 
 
 def tag_data(data: pd.DataFrame):
@@ -121,16 +388,16 @@ def tag_data(data: pd.DataFrame):
    # we may in the future only want to use fpog but gazepoint uses bpogx to determine the AOI
    # so I do the same for data records. The fixation summary lines will use fpog since that is the value we use
    # in the dgm stuff
-   for i in data.index:
-      if data.at[i, sac_mag] == 0:  # not fixation;
-         data.at[i, aoi_header] = pick_aoi(data.at[i, bpogx], data.at[i, bpogy])
-      else: # fixations because saccade mag is not 0
-         data.at[i, aoi_header] = pick_aoi(data.at[i, fpogx], data.at[i, fpogy])
+   not_fixation = (data[sac_mag] == 0).to_numpy()
+   x = np.where(not_fixation, data[bpogx].to_numpy(dtype=float), data[fpogx].to_numpy(dtype=float))
+   y = np.where(not_fixation, data[bpogy].to_numpy(dtype=float), data[fpogy].to_numpy(dtype=float))
+   data[aoi_header] = pick_aois(x, y)
 
 
 def pick_aoi(x: float, y: float) -> str:
    """
    Returns which AOI the point in inside, otherwise returns empty string.
+   Checks every AOI in all_aois, use AOIIndex.pick when there are a lot of AOIs.
    """
    for area in all_aois:
       if area.contains(x, y): 
@@ -138,9 +405,169 @@ def pick_aoi(x: float, y: float) -> str:
    return ''
 
 
+def pack_aois(aois: list[AOI]) -> tuple[np.ndarray, np.ndarray]:
+   """
+   Packs AOI rectangles into arrays so they can be compared against whole columns at once.
+
+   Parameters:
+      aois (list[AOI]): AOIs in priority order
+
+   Returns:
+      names (ndarray): AOI names followed by '' for points outside every AOI
+      bounds (ndarray): (len(aois), 4) array of x1, y1, x2, y2
+   """
+   names = np.array([area.name for area in aois] + [''], dtype=object)
+   bounds = np.array([(area.x1, area.y1, area.x2, area.y2) for area in aois], dtype=float).reshape(-1, 4)
+   return names, bounds
+
+
+def pick_aois(x: np.ndarray, y: np.ndarray, aois: list[AOI] = None) -> np.ndarray:
+   """
+   Vectorized pick_aoi. Returns the name of the AOI each point is inside, otherwise
+   an empty string. Uses the same rules as AOI.contains and the first AOI in the list wins
+   when AOIs overlap.
+
+   Parameters:
+      x (ndarray): x-coordinates
+      y (ndarray): y-coordinates
+      aois (list[AOI]): AOIs to check, defaults to all_aois
+
+   Returns:
+      object array of AOI names
+   """
+   aois = all_aois if aois is None else aois
+   # keyed by the AOI values, so changing an AOI after it was indexed builds a new index
+   key = tuple((area.name, area.x1, area.y1, area.x2, area.y2) for area in aois)
+   index = _aoi_indexes.get(key)
+   if index is None:
+      if len(_aoi_indexes) >= MAX_CACHED_INDEXES:
+         _aoi_indexes.clear()
+      index = _aoi_indexes[key] = AOIIndex(aois)
+   return index.pick_many(x, y)
+
+
+# AOIIndex of each AOI list pick_aois was called with, so tagging file after file builds it once
+MAX_CACHED_INDEXES = 16
+_aoi_indexes = {}
+
+
+class AOIIndex:
+   """
+   Uniform grid over a set of AOIs so a point only gets checked against the AOIs that
+   overlap its grid cell instead of every AOI. Build it once and reuse it when there are
+   a lot of AOIs (per gauge regions, windshield tiles, ...).
+
+   Overlapping AOIs keep the priority of the list they came from, the first AOI in the list wins.
+   """
+
+   def __init__(self, aois: list[AOI], cells: int = None):
+      """
+      Parameters:
+         aois (list[AOI]): AOIs in priority order
+         cells (int): number of grid cells along each axis, defaults to 2 * sqrt(number of AOIs)
+      """
+      self.names, self.bounds = pack_aois(aois)
+      self._rects = [tuple(b) for b in self.bounds.tolist()]
+      self.cells = cells if cells else max(1, int(np.ceil(2 * np.sqrt(len(aois)))))
+
+      if len(aois):
+         self.x_min, self.y_min = self.bounds[:, 0].min(), self.bounds[:, 1].min()
+         self.x_max, self.y_max = self.bounds[:, 2].max(), self.bounds[:, 3].max()
+      else:
+         self.x_min = self.y_min = self.x_max = self.y_max = 0.0
+      self.cell_width = (self.x_max - self.x_min) / self.cells or 1.0
+      self.cell_height = (self.y_max - self.y_min) / self.cells or 1.0
+
+      # every AOI is added to each cell it touches. AOIs are visited in priority order so
+      # each cell's list is already sorted by priority
+      buckets = [[] for _ in range(self.cells * self.cells)]
+      col1 = self._cell_axis(self.bounds[:, 0], self.x_min, self.cell_width)
+      col2 = self._cell_axis(self.bounds[:, 2], self.x_min, self.cell_width)
+      row1 = self._cell_axis(self.bounds[:, 1], self.y_min, self.cell_height)
+      row2 = self._cell_axis(self.bounds[:, 3], self.y_min, self.cell_height)
+      for i in range(len(aois)):
+         for row in range(row1[i], row2[i] + 1):
+            for col in range(col1[i], col2[i] + 1):
+               buckets[row * self.cells + col].append(i)
+
+      # buckets are flattened so cell c holds cell_aois[cell_start[c]:cell_start[c + 1]]
+      sizes = [len(b) for b in buckets]
+      self.cell_start = np.concatenate(([0], np.cumsum(sizes))).astype(np.intp)
+      self.cell_aois = np.array([i for b in buckets for i in b], dtype=np.intp)
+      self.depth = max(sizes)
+
+
+   def _cell_axis(self, v: np.ndarray, start: float, size: float) -> np.ndarray:
+      return np.clip(np.floor((v - start) / size), 0, self.cells - 1).astype(np.intp)
+
+
+   def _cells(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+      """
+      Returns the grid cell of each point, or -1 for points outside of every AOI's bounding box.
+      """
+      in_grid = (self.x_min <= x) & (x < self.x_max) & (self.y_min <= y) & (y < self.y_max)
+      col = self._cell_axis(np.where(in_grid, x, self.x_min), self.x_min, self.cell_width)
+      row = self._cell_axis(np.where(in_grid, y, self.y_min), self.y_min, self.cell_height)
+      return np.where(in_grid, row * self.cells + col, -1)
+
+
+   def pick(self, x: float, y: float) -> str:
+      """
+      Returns which AOI the point in inside, otherwise returns empty string.
+      """
+      if not (self.x_min <= x < self.x_max and self.y_min <= y < self.y_max):
+         return ''
+      # same rounding as _cell_axis, (x - x_min) // cell_width can land one cell lower on a border
+      col = min(int(np.floor((x - self.x_min) / self.cell_width)), self.cells - 1)
+      row = min(int(np.floor((y - self.y_min) / self.cell_height)), self.cells - 1)
+      cell = row * self.cells + col
+      for i in self.cell_aois[self.cell_start[cell]:self.cell_start[cell + 1]]:
+         x1, y1, x2, y2 = self._rects[i]
+         if x1 <= x < x2 and y1 <= y < y2:
+            return self.names[i]
+      return ''
+
+
+   def pick_many(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+      """
+      Batched pick. Returns an object array with the AOI name of each point, otherwise an empty string.
+
+      Parameters:
+         x (ndarray): x-coordinates
+         y (ndarray): y-coordinates
+      """
+      x = np.asarray(x, dtype=float)
+      shape = x.shape
+      x = x.ravel()
+      y = np.asarray(y, dtype=float).ravel()
+
+      # -1 selects the trailing '' in names
+      picked = np.full(x.shape, -1, dtype=np.intp)
+      cell = self._cells(x, y)
+      first = self.cell_start[cell]
+      count = np.where(cell >= 0, self.cell_start[cell + 1] - first, 0)
+
+      # rank r checks the r-th candidate of each point's cell. Points leave once they hit an
+      # AOI, so a point never gets checked against a lower priority AOI after a match
+      pending = np.flatnonzero(count > 0)
+      for rank in range(self.depth):
+         pending = pending[count[pending] > rank]
+         if not pending.size:
+            break
+         candidate = self.cell_aois[first[pending] + rank]
+         x1, y1, x2, y2 = self.bounds[candidate].T
+         px, py = x[pending], y[pending]
+         hit = (x1 <= px) & (px < x2) & (y1 <= py) & (py < y2)
+         picked[pending[hit]] = candidate[hit]
+         pending = pending[~hit]
+      return self.names[picked].reshape(shape)
+
+
 if __name__ == '__main__':
    # change the path names to the ones on your computer
+   # workers can be raised up to the number of cores to tag several files at the same time
    add_aoi_to_directory(
       'original_data_folder/',
-      'i_want_my_data_here_folder/'
+      'i_want_my_data_here_folder/',
+      workers=1
    )
@@ -0,0 +1,423 @@
+from collections import deque
+import math
+import os
+import sys
+import numpy as np
+import pandas as pd
+import csv_cache as cc
+import csv_utils as cu
+import dgm_engine as de
+
+"""
+Computes DGMs (see dgm_engine.py) for sliding or tumbling time windows without recomputing
+each window from scratch.
+
+Every measure is a stream of items (a fixation duration, a saccade length, an angle between two
+saccades, a pair of AOIs in a row, ...) and each item needs a run of fixations. An item is in a
+window when all of its fixations are. Windows move forward in time, so items only ever join at the
+back and leave at the front: each item is added once and removed once, no matter how much the
+windows overlap. The statistics are kept as running aggregates:
+   - count, sum, mean and standard deviation with Welford's add/remove updates
+   - min and max with monotonic deques
+   - median with a Fenwick tree of how many items of each rank are in the window
+   - entropies with running AOI/pair counts and the sum of count * log10(count)
+   - the convex hull with its vertices: a new fixation only changes the hull when it is outside of
+     it, and a leaving fixation only when it is a hull vertex. Only then is the hull rebuilt, from
+     the old vertices and the new point or from the window's fixations
+The results match dgm_engine.compute_dgms on the fixations of each window (up to rounding).
+"""
+
+
+class RunningStats:
+   """
+   Statistics of the items of one stream that are in the current window. The whole stream is
+   known up front so each value's rank (for the median) is worked out once.
+   """
+
+   def __init__(self, values: np.ndarray):
+      self.values = np.asarray(values, dtype=float).tolist()
+      order = np.argsort(values, kind='stable')
+      self.sorted_values = np.asarray(values, dtype=float)[order].tolist()
+      ranks = np.empty(len(order), dtype=np.int64)
+      ranks[order] = np.arange(1, len(order) + 1)
+      self.ranks = ranks.tolist()
+      self.tree = [0] * (len(order) + 1)
+      self.first = self.end = 0 # items first up to end (not included) are in the window
+      self.count = 0
+      self.total = self.mean = self.m2 = 0.0
+      self.lows, self.highs = deque(), deque() # item indexes with increasing / decreasing values
+
+
+   def move_to(self, first: int, end: int):
+      """
+      Changes the window to items first up to end. Both can only move forward.
+      """
+      end = max(end, first)
+      while self.end < end:
+         self.push()
+      while self.first < first:
+         self.pop()
+
+
+   def push(self):
+      i, x = self.end, self.values[self.end]
+      self.end += 1
+      self.count += 1
+      self.total += x
+      delta = x - self.mean
+      self.mean += delta / self.count
+      self.m2 += delta * (x - self.mean)
+      while self.lows and self.values[self.lows[-1]] >= x:
+         self.lows.pop()
+      self.lows.append(i)
+      while self.highs and self.values[self.highs[-1]] <= x:
+         self.highs.pop()
+      self.highs.append(i)
+      self.update_tree(self.ranks[i], 1)
+
+
+   def pop(self):
+      i, x = self.first, self.values[self.first]
+      self.first += 1
+      self.count -= 1
+      if self.count == 0:
+         self.total = self.mean = self.m2 = 0.0
+      else:
+         self.total -= x
+         delta = x - self.mean
+         self.mean -= delta / self.count
+         self.m2 = max(self.m2 - delta * (x - self.mean), 0.0)
+      if self.lows[0] == i:
+         self.lows.popleft()
+      if self.highs[0] == i:
+         self.highs.popleft()
+      self.update_tree(self.ranks[i], -1)
+
+
+   def update_tree(self, rank: int, change: int):
+      while rank < len(self.tree):
+         self.tree[rank] += change
+         rank += rank & -rank
+
+
+   def kth(self, k: int) -> float:
+      """
+      k-th smallest value in the window, k starts at 1.
+      """
+      position, step = 0, 1 << (len(self.tree) - 1).bit_length()
+      while step:
+         if position + step < len(self.tree) and self.tree[position + step] < k:
+            position += step
+            k -= self.tree[position]
+         step >>= 1
+      return self.sorted_values[position]
+
+
+   def median(self) -> float:
+      return (self.kth((self.count + 1) // 2) + self.kth(self.count // 2 + 1)) / 2
+
+
+   def describe(self) -> list[float]:
+      """
+      Same as dgm_engine.describe for the items in the window.
+      """
+      if self.count == 0:
+         return [0.0] + [np.nan] * 5
+      std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+      return [self.total, self.mean, self.median(), std, self.values[self.lows[0]], self.values[self.highs[0]]]
+
+
+   def average(self) -> float:
+      return self.mean if self.count else np.nan
+
+
+class RunningEntropy:
+   """
+   Entropy (log base 10) of the category counts of the items in the current window.
+   """
+
+   def __init__(self, codes: np.ndarray, size: int):
+      self.codes = np.asarray(codes).tolist()
+      self.counts = [0] * size
+      self.first = self.end = 0
+      self.count = 0
+      self.weighted = 0.0 # sum of count * log10(count)
+      self.count_log = [0.0] + [c * math.log10(c) for c in range(1, len(self.codes) + 1)]
+
+
+   def move_to(self, first: int, end: int):
+      end = max(end, first)
+      while self.end < end:
+         self.change(self.codes[self.end], 1)
+         self.end += 1
+      while self.first < first:
+         self.change(self.codes[self.first], -1)
+         self.first += 1
+
+
+   def change(self, code: int, step: int):
+      count = self.counts[code]
+      self.weighted += self.count_log[count + step] - self.count_log[count]
+      self.counts[code] = count + step
+      self.count += step
+
+
+   def value(self) -> float:
+      if self.count == 0:
+         return np.nan
+      return max(math.log10(self.count) - self.weighted / self.count, 0.0)
+
+
+class RunningHull:
+   """
+   Convex hull of the fixations in the current window. Keeps the hull vertices (fixation indexes,
+   counter-clockwise) so most fixations joining or leaving the window do not change it.
+   """
+
+   def __init__(self, x: np.ndarray, y: np.ndarray):
+      self.x = np.asarray(x, dtype=float).tolist()
+      self.y = np.asarray(y, dtype=float).tolist()
+      self.valid = (~(np.isnan(x) | np.isnan(y))).tolist()
+      self.first = self.end = 0
+      self.hull = []
+      self.vertices = set()
+      self.area = 0.0
+
+
+   def move_to(self, first: int, end: int):
+      end = max(end, first)
+      if first >= self.end:
+         # nothing of the old window is left
+         self.first = self.end = first
+         self.set_hull([])
+      rebuild = False
+      while self.first < first:
+         rebuild |= self.first in self.vertices
+         self.first += 1
+      if rebuild:
+         self.set_hull(self.build(range(self.first, self.end)))
+      while self.end < end:
+         i = self.end
+         self.end += 1
+         if self.valid[i] and not self.inside(i):
+            self.set_hull(self.build(self.hull + [i]))
+
+
+   def cross(self, a: int, b: int, c: int) -> float:
+      """ twice the area of the triangle a, b, c, positive when c is left of a -> b """
+      return (self.x[b] - self.x[a]) * (self.y[c] - self.y[a]) - (self.y[b] - self.y[a]) * (self.x[c] - self.x[a])
+
+
+   def inside(self, i: int) -> bool:
+      """ whether fixation i is inside or on the hull """
+      hull = self.hull
+      if len(hull) < 3:
+         return False
+      return all(self.cross(hull[k - 1], hull[k], i) >= 0 for k in range(len(hull)))
+
+
+   def build(self, indexes) -> list[int]:
+      """
+      Hull vertices of the fixations with a monotone chain, without points on an edge.
+      """
+      points = sorted((i for i in indexes if self.valid[i]), key=lambda i: (self.x[i], self.y[i]))
+      if len(points) < 3:
+         return points
+      lower, upper = [], []
+      for chain, ordered in ((lower, points), (upper, reversed(points))):
+         for i in ordered:
+            while len(chain) >= 2 and self.cross(chain[-2], chain[-1], i) <= 0:
+               chain.pop()
+            chain.append(i)
+      return lower[:-1] + upper[:-1]
+
+
+   def set_hull(self, hull: list[int]):
+      self.hull = hull
+      self.vertices = set(hull)
+      self.area = 0.0
+      if len(hull) >= 3:
+         self.area = abs(sum(self.x[hull[k]] * self.y[hull[k - 1]] - self.x[hull[k - 1]] * self.y[hull[k]] for k in range(len(hull)))) / 2
+
+
+class Stream:
+   """
+   Items of one measure with the first and last fixation each item needs.
+   """
+
+   def __init__(self, values: np.ndarray, first_fixation: np.ndarray, last_fixation: np.ndarray, entropy_size: int = None):
+      self.first_fixation = np.asarray(first_fixation)
+      self.last_fixation = np.asarray(last_fixation)
+      self.stats = RunningEntropy(values, entropy_size) if entropy_size is not None else RunningStats(values)
+
+
+   def ranges(self, first: np.ndarray, end: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+      """
+      Item ranges of every window, for windows holding fixations first up to end (not included).
+      """
+      return (np.searchsorted(self.first_fixation, first, side='left'),
+              np.searchsorted(self.last_fixation, end, side='left'))
+
+
+def fixation_streams(
+      fixations: pd.DataFrame,
+      aois: list[str],
+      aoi_col: str = "AOI",
+      screen_size: tuple[int, int] = de.SCREEN_SIZE,
+      pixels_per_degree: float = de.PIXELS_PER_DEGREE
+) -> dict:
+   """
+   Splits fixations into the item streams of every measure, see dgm_engine.compute_dgms
+   for how each measure is defined.
+   """
+   x = fixations["FPOGX"].to_numpy(dtype=float) * screen_size[0]
+   y = fixations["FPOGY"].to_numpy(dtype=float) * screen_size[1]
+   start = fixations["FPOGS"].to_numpy(dtype=float)
+   duration = fixations["FPOGD"].to_numpy(dtype=float)
+   index = np.arange(len(duration))
+
+   dx, dy = np.diff(x), np.diff(y)
+   length = np.hypot(dx, dy)
+   saccade_duration = start[1:] - (start[:-1] + duration[:-1])
+   saccades = index[:-1]
+   moved = np.flatnonzero(length > 0)
+   absolute = np.degrees(np.arctan2(np.abs(dy[moved]), np.abs(dx[moved])))
+   ux, uy = dx[moved] / length[moved], dy[moved] / length[moved]
+   relative = np.degrees(np.arccos(np.clip(ux[:-1] * ux[1:] + uy[:-1] * uy[1:], -1, 1)))
+   with np.errstate(divide='ignore', invalid='ignore'):
+      velocity = np.where(saccade_duration > 0, length / pixels_per_degree / saccade_duration, np.nan)
+
+   def single(values, valid=None):
+      """ stream of one item per fixation, without missing values """
+      values = np.asarray(values, dtype=float)
+      keep = ~np.isnan(values) if valid is None else valid
+      return Stream(values[keep], index[keep], index[keep])
+
+   def saccade(values):
+      values = np.asarray(values, dtype=float)
+      keep = ~np.isnan(values)
+      return Stream(values[keep], saccades[keep], saccades[keep] + 1)
+
+   left, right = de.valid_values(fixations, "LPMM"), de.valid_values(fixations, "RPMM")
+   blinks = fixations["BKPMIN"].to_numpy(dtype=float) if "BKPMIN" in fixations.columns else np.full(len(index), np.nan)
+   clicks = fixations["CS"].to_numpy() == 1 if "CS" in fixations.columns else np.zeros(len(index), dtype=bool)
+   samples = fixations[de.SAMPLES_COL].to_numpy(dtype=float) if de.SAMPLES_COL in fixations.columns else np.ones(len(index))
+   streams = {
+      "fixation": single(duration),
+      "length": saccade(length),
+      "saccade duration": saccade(saccade_duration),
+      "velocity": saccade(velocity),
+      "absolute": Stream(absolute, moved, moved + 1),
+      "relative": Stream(relative, moved[:-1], moved[1:] + 1),
+      "blinks": single(blinks),
+      "left": single(left),
+      "right": single(right),
+      "both": single((left + right) / 2),
+      "clicks": single(np.ones(len(index)), clicks),
+      "samples": single(samples),
+   }
+   if aoi_col in fixations.columns:
+      labels = fixations[aoi_col].fillna('').astype(str).str.strip()
+      codes = pd.Index(aois).get_indexer(labels)
+      known = codes >= 0
+      pairs = known[:-1] & known[1:]
+      streams["stationary"] = Stream(codes[known], index[known], index[known], len(aois))
+      streams["transition"] = Stream(codes[:-1][pairs] * len(aois) + codes[1:][pairs], saccades[pairs], saccades[pairs] + 1, len(aois) ** 2)
+   return streams
+
+
+def window_dgms(
+      fixations: pd.DataFrame,
+      window: float,
+      step: float = None,
+      aois: list[str] = None,
+      aoi_col: str = "AOI",
+      **kwargs
+) -> pd.DataFrame:
+   """
+   Computes the DGMs of every time window. A fixation is in the window that holds its start time,
+   windows are [start, start + window) in seconds since the first fixation.
+
+   Parameters:
+      fixations (DataFrame): one row per fixation in recording order, see dgm_engine.fixation_rows
+      window (float): window length in seconds
+      step (float): seconds between window starts, defaults to window (tumbling windows)
+      aois (list[str]): AOIs used for the entropies, defaults to the labels in the data
+      aoi_col (str): column with the AOI labels
+      kwargs: screen_size and pixels_per_degree, see dgm_engine.compute_dgms
+
+   Returns:
+      one row per window with Window Start and Window End columns followed by the DGM columns
+   """
+   step = step or window
+   if aoi_col in fixations.columns and not aois:
+      labels = fixations[aoi_col].fillna('').astype(str).str.strip()
+      aois = sorted(set(labels[labels != '']))
+   start = fixations["FPOGS"].to_numpy(dtype=float)
+   if len(start) == 0:
+      return pd.DataFrame(columns=["Window Start", "Window End"] + de.DGM_COLUMNS)
+   starts = np.arange(0, start[-1] - start[0] + step, step)
+   starts = starts[starts <= start[-1] - start[0]]
+   first = np.searchsorted(start - start[0], starts, side='left')
+   end = np.searchsorted(start - start[0], starts + window, side='left')
+
+   streams = fixation_streams(fixations, aois or [], aoi_col, **kwargs)
+   ranges = {name: stream.ranges(first, end) for name, stream in streams.items()}
+   hull = RunningHull(fixations["FPOGX"].to_numpy(dtype=float) * kwargs.get("screen_size", de.SCREEN_SIZE)[0],
+                      fixations["FPOGY"].to_numpy(dtype=float) * kwargs.get("screen_size", de.SCREEN_SIZE)[1])
+
+   rows = []
+   for w in range(len(starts)):
+      for name, stream in streams.items():
+         stream.stats.move_to(ranges[name][0][w], ranges[name][1][w])
+      hull.move_to(first[w], end[w])
+      stats = {name: stream.stats for name, stream in streams.items()}
+      entropies = [stats[name].value() if name in stats else np.nan for name in ("stationary", "transition")]
+      row = de.dgm_row(
+         int(end[w] - first[w]), stats["fixation"].describe(),
+         max(int(end[w] - first[w]) - 1, 0), stats["length"].describe(), stats["saccade duration"].describe(),
+         stats["velocity"].average(), stats["absolute"].describe(), stats["relative"].describe(),
+         hull.area, *entropies,
+         stats["blinks"].average(), int(stats["samples"].total), stats["left"].average(), stats["right"].average(), stats["both"].average(),
+         stats["clicks"].count
+      )
+      rows.append({"Window Start": starts[w], "Window End": starts[w] + window, **row})
+   return pd.DataFrame(rows, columns=["Window Start", "Window End"] + de.DGM_COLUMNS)
+
+
+def run_directory(
+      in_dir: str,
+      out_dir: str,
+      window: float,
+      step: float = None,
+      in_pattern: str = "*fixations.csv",
+      aois: list[str] = None,
+      **kwargs
+) -> int:
+   """
+   Writes <PID>_Window_DGMs.csv for every file matching in_pattern in a directory and its sub directories.
+
+   Returns:
+      number of files read
+   """
+   os.makedirs(out_dir, exist_ok=True)
+   in_files = []
+   for dir, _, _ in os.walk(in_dir):
+      in_files.extend(cu.glob_filter(dir, in_pattern))
+   for in_file in sorted(in_files):
+      pid = os.path.basename(in_file).split("_")[0]
+      fixations = de.fixation_rows(cc.read_csv(in_file))
+      window_dgms(fixations, window, step, aois, **kwargs).to_csv(os.path.join(out_dir, f"{pid}_Window_DGMs.csv"), index=False)
+   print(f"Wrote window DGMs for {len(in_files)} files to {out_dir}")
+   return len(in_files)
+
+
+if __name__ == '__main__':
+   """
+   Parameters:
+      argv[1] directory of fixation files
+      argv[2] directory to save the window DGM files to
+      argv[3] window length in seconds
+      argv[4] optional seconds between window starts (default: the window length)
+   """
+   run_directory(sys.argv[1], sys.argv[2], float(sys.argv[3]), float(sys.argv[4]) if len(sys.argv) > 4 else None)
@@ -0,0 +1,80 @@
+# Times RREFDecoder against the original per dataref slicing in XPlaneUdp.GetValues
+# on synthetic RREF packets and checks that both decode the same values.
+#
+# Parameters:
+#   argv[1..n] optional dataref counts to test (default 16 100 400)
+
+import random
+import struct
+import sys
+from time import perf_counter
+from xplaneUdpData import RREFDecoder
+
+# X-Plane puts at most this many values in one RREF answer so it fits in 1472 bytes
+VALUES_PER_PACKET = 183
+
+def decodeBySlices(data, datarefs, xplaneValues):
+  '''
+  Original decoding from XPlaneUdp.GetValues. Kept here as the reference.
+  '''
+  retvalues = {}
+  header=data[0:5]
+  if(header==b"RREF,"):
+    values =data[5:]
+    lenvalue = 8
+    numvalues = int(len(values)/lenvalue)
+    for i in range(0,numvalues):
+      singledata = data[(5+lenvalue*i):(5+lenvalue*(i+1))]
+      (idx,value) = struct.unpack("<if", singledata)
+      if idx in datarefs.keys():
+        if value < 0.0 and value > -0.001 :
+          value = 0.0
+        retvalues[datarefs[idx]] = value
+  xplaneValues.update(retvalues)
+  return xplaneValues
+
+def syntheticPackets(count, samples, seed=0):
+  '''
+  Builds samples rounds of RREF answers for count datarefs, split like X-Plane splits them.
+  A few values are tiny negatives and a few indexes were never subscribed.
+  '''
+  rng = random.Random(seed)
+  packets = []
+  for _ in range(samples):
+    records = []
+    for idx in range(count):
+      value = rng.choice([rng.uniform(-500, 500), -0.0004, 0.0, 1.0])
+      records.append(struct.pack("<if", idx if rng.random() > 0.01 else count + 7, value))
+    for start in range(0, count, VALUES_PER_PACKET):
+      packets.append(b"RREF," + b"".join(records[start:start + VALUES_PER_PACKET]))
+  return packets
+
+def run(count, samples=2000):
+  packets = syntheticPackets(count, samples)
+  datarefs = {idx: "sim/test/dataref_{}".format(idx) for idx in range(count)}
+
+  reference = {}
+  start = perf_counter()
+  for packet in packets:
+    decodeBySlices(packet, datarefs, reference)
+  sliceTime = perf_counter() - start
+
+  decoder = RREFDecoder()
+  for idx, dataref in datarefs.items():
+    decoder.add(idx, dataref)
+  start = perf_counter()
+  for packet in packets:
+    decoder.decode(packet)
+  decoderTime = perf_counter() - start
+
+  matches = dict(decoder) == reference
+  perSample = 1e6 / samples
+  print("{:>4} datarefs ({} packets/sample) | slices {:8.2f} us/sample | RREFDecoder {:7.2f} us/sample | speedup {:5.1f}x | output matches: {}".format(
+    count, len(packets) // samples, sliceTime * perSample, decoderTime * perSample, sliceTime / decoderTime, matches))
+  if not matches:
+    raise AssertionError("RREFDecoder differs from the original decoding for {} datarefs".format(count))
+
+if __name__ == '__main__':
+  sizes = [int(n) for n in sys.argv[1:]] or [16, 100, 400]
+  for n in sizes:
+    run(n)
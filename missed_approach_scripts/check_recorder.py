@@ -0,0 +1,76 @@
+# Checks XPlaneRecorder without X-Plane: a missing output folder fails before recording starts,
+# an error in the writer thread ends run() with that error, and stop() does not wait for the socket timeout.
+
+import os
+import socket
+import tempfile
+import time
+import xplaneUdpData as xud
+
+def silentXPlane(timeout=60.0):
+  '''
+  XPlaneUdp subscribed to an X-Plane port nobody answers on, so Receive only ever waits.
+  '''
+  silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  silent.bind(("127.0.0.1", 0))
+  xp = xud.XPlaneUdp()
+  xp.BeaconData = {"IP": "127.0.0.1", "Port": silent.getsockname()[1]}
+  xp.AddRateGroups(xud.RATE_GROUPS)
+  xp.socket.settimeout(timeout)
+  return xp, silent
+
+def checkMissingFolder(folder):
+  xp, silent = silentXPlane()
+  recorder = xud.XPlaneRecorder(xp, xud.DATAREFS, os.path.join(folder, "missing", "out.csv"))
+  try:
+    recorder.run()
+    raise AssertionError("recorded into a missing folder")
+  except FileNotFoundError:
+    pass
+  assert recorder.receiver is None and recorder.writer is None, "threads started"
+  print("missing folder: FileNotFoundError before the threads start")
+  silent.close()
+
+class FailingRecorder(xud.XPlaneRecorder):
+  '''
+  Writes nothing: the first batch raises like a full disk would.
+  '''
+  def openOutput(self):
+    output, writeRows = super().openOutput()
+    def failingWrite(batch):
+      raise OSError(28, "No space left on device")
+    return output, failingWrite
+
+def checkWriterError(folder):
+  xp, silent = silentXPlane()
+  recorder = FailingRecorder(xp, xud.DATAREFS, os.path.join(folder, "out.csv"), timeout=60.0)
+  start = time.monotonic()
+  try:
+    recorder.run()
+    raise AssertionError("the writer error was lost")
+  except OSError as error:
+    assert error.errno == 28, error
+  waited = time.monotonic() - start
+  print("writer error: raised by run() after {:.2f} s".format(waited))
+  assert waited < 3.0, waited
+  silent.close()
+
+def checkStop(folder):
+  xp, silent = silentXPlane()
+  recorder = xud.XPlaneRecorder(xp, xud.DATAREFS, os.path.join(folder, "stop.csv"), timeout=60.0)
+  recorder.start()
+  time.sleep(0.5)
+  start = time.monotonic()
+  # what run() does after Ctrl+C
+  recorder.stop()
+  waited = time.monotonic() - start
+  print("stop: threads ended after {:.2f} s with a 60 s socket timeout".format(waited))
+  assert waited < 2.0, waited
+  assert not recorder.receiver.is_alive() and not recorder.writer.is_alive()
+  silent.close()
+
+if __name__ == '__main__':
+  with tempfile.TemporaryDirectory() as folder:
+    checkMissingFolder(folder)
+    checkWriterError(folder)
+    checkStop(folder)
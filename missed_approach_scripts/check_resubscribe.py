@@ -0,0 +1,71 @@
+# Checks XPlaneUdp.Receive without X-Plane: with nobody answering it keeps resubscribing until the
+# full socket timeout has passed, and after a FakeXPlane restart it subscribes again and gets values.
+
+import asyncio
+import socket
+import threading
+import time
+import xplaneUdpData as xud
+from xplane_async import FakeXPlane
+
+def checkNoAnswer(datarefs=40, burst=5, staleSeconds=0.15, timeout=3.0):
+  '''
+  Nothing listens on the X-Plane port: Receive has to wait out the whole timeout.
+  '''
+  silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  silent.bind(("127.0.0.1", 0))
+  xp = xud.XPlaneUdp()
+  xp.BeaconData = {"IP": "127.0.0.1", "Port": silent.getsockname()[1]}
+  xp.subscriptions.burst = burst
+  xp.staleSeconds = staleSeconds
+  xp.AddDataRef(["sim/test/dataref_{}".format(i) for i in range(datarefs)], 10)
+  xp.socket.settimeout(timeout)
+  requests = 0
+  start = time.monotonic()
+  try:
+    xp.Receive()
+    raise AssertionError("received a packet nobody sent")
+  except socket.timeout:
+    pass
+  waited = time.monotonic() - start
+  silent.settimeout(0.1)
+  try:
+    while True:
+      silent.recvfrom(1472)
+      requests += 1
+  except socket.timeout:
+    pass
+  print("no answer: timed out after {:.2f} s, {} subscription requests sent".format(waited, requests))
+  assert timeout - 0.05 <= waited <= timeout + 0.5, waited
+  assert requests > datarefs, "did not resubscribe"
+  assert xp.socket.gettimeout() == timeout
+  silent.close()
+
+def checkRestart():
+  '''
+  FakeXPlane stops and starts again on the same port, forgetting the subscriptions.
+  '''
+  loop = asyncio.new_event_loop()
+  threading.Thread(target=loop.run_forever, daemon=True).start()
+  run = lambda coroutine: asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+  values = {"sim/time/total_flight_time_sec": lambda t: t}
+  sim = run(FakeXPlane(values).start())
+  xp = xud.XPlaneUdp()
+  xp.BeaconData = sim.beacon()
+  xp.AddRateGroups(xud.RATE_GROUPS)
+  xp.socket.settimeout(10.0)
+  xp.GetValues()
+  run(sim.stop())
+  time.sleep(0.5)
+  sim = run(FakeXPlane({"sim/time/total_flight_time_sec": lambda t: 100 + t}, port=sim.port).start())
+  start = time.monotonic()
+  while xp.xplaneValues.get("sim/time/total_flight_time_sec", 0.0) < 100:
+    xp.GetValues()
+  print("restart: values again after {:.2f} s".format(time.monotonic() - start))
+  assert len(sim.subscriptions) == len(xp.datarefs)
+  run(sim.stop())
+  loop.call_soon_threadsafe(loop.stop)
+
+if __name__ == '__main__':
+  checkNoAnswer()
+  checkRestart()
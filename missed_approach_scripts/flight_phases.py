@@ -0,0 +1,168 @@
+# Labels X-Plane recordings with the phase of flight, offline over a whole recording or online
+# one sample at a time while recording (PhaseTracker), with the same rules:
+#   - the phases start at the FIXES DME thresholds, in order: a fix is reached at the first sample
+#     at or after the previous fix with the nav1 DME at or below its distance
+#   - Landed starts at the first touchdown (on_ground going from 0 to 1) once the flight started,
+#     and is the last phase
+#   - paused samples are labelled Paused and are skipped, the phase goes on after the pause
+#   - samples before the first fix (no DME yet) are Undetermined
+#
+# Parameters:
+#   argv[1] recording, csv from xplaneUdpData.py or an xplane_log file
+#   argv[2] optional csv to write the recording to with a phase column (default <recording>_phases.csv)
+# License: GPLv3
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import xplane_log
+
+FIXES = [["Start Flight", float("inf")], ["Start Approach", 22.2], ["FAF", 6.3]]
+LANDED = "Landed"
+PAUSED = "Paused"
+UNDETERMINED = "Undetermined"
+
+# csv columns and datarefs of the inputs, see xplaneUdpData.HEADERS and DATAREFS
+TIME_COL = "sys_unix_time"
+DME_COL = "pilN1,dme-d"
+GROUND_COL = "_land,groll"
+PAUSED_COL = "is_paused"
+DME_DATAREF = "sim/cockpit/radios/nav1_dme_dist_m"
+GROUND_DATAREF = "sim/flightmodel2/gear/on_ground[0]"
+PAUSED_DATAREF = "sim/time/paused"
+
+def phaseLabels(fixes=FIXES):
+  '''
+  Labels of the phase codes: the fixes, then Landed and Paused. Code -1 (the last label) is Undetermined.
+  '''
+  return [name for name, _ in fixes] + [LANDED, PAUSED, UNDETERMINED]
+
+def phaseCodes(dme, onGround, paused, fixes=FIXES):
+  '''
+  Phase code of every sample, see phaseLabels.
+
+  Parameters:
+    dme, onGround, paused: arrays of the nav1 DME, the gear on ground flag and the paused flag
+    fixes: [name, DME threshold] of the phases in flight order
+
+  Returns:
+    int array, index into phaseLabels(fixes)
+  '''
+  dme = np.asarray(dme, dtype=float)
+  onGround = np.asarray(onGround, dtype=float)
+  pausedRows = np.asarray(paused, dtype=float) > 0.5
+  count = len(dme)
+  codes = np.full(count, -1)
+
+  reached = 0
+  for code, (_, threshold) in enumerate(fixes):
+    candidates = np.flatnonzero(~pausedRows & (dme <= threshold))
+    j = np.searchsorted(candidates, reached)
+    if j == len(candidates):
+      break
+    reached = candidates[j]
+    codes[reached:] = code
+
+  if codes.max(initial=-1) >= 0:
+    # touchdowns between samples in a row, skipping paused samples
+    running = np.flatnonzero(~pausedRows)
+    ground = onGround[running]
+    touchdowns = running[1:][(ground[1:] == 1) & (ground[:-1] == 0)]
+    started = np.argmax(codes >= 0)
+    touchdowns = touchdowns[touchdowns >= started]
+    if len(touchdowns):
+      codes[touchdowns[0]:] = len(fixes)
+
+  codes[pausedRows] = len(fixes) + 1
+  return codes
+
+def labelPhases(data, fixes=FIXES, dme_col=DME_COL, ground_col=GROUND_COL, paused_col=PAUSED_COL):
+  '''
+  Phase label of every row of a recording, as a categorical Series in phaseLabels order.
+  '''
+  codes = phaseCodes(data[dme_col], data[ground_col], data[paused_col], fixes)
+  labels = phaseLabels(fixes)
+  return pd.Series(pd.Categorical.from_codes(codes % len(labels), labels), index=data.index, name="phase")
+
+def phaseSpans(times, phases):
+  '''
+  Splits a recording into runs of the same phase, e.g. to cut gaze data or window DGMs by phase.
+
+  Parameters:
+    times: sample times
+    phases: label or code of every sample
+
+  Returns:
+    DataFrame with phase, start and end (time of the first and last sample) and the rows [first, last)
+  '''
+  times = np.asarray(times)
+  phases = np.asarray(phases)
+  if len(phases) == 0:
+    return pd.DataFrame(columns=["phase", "start", "end", "first", "last"])
+  starts = np.flatnonzero(np.concatenate(([True], phases[1:] != phases[:-1])))
+  ends = np.append(starts[1:], len(phases))
+  return pd.DataFrame({"phase": phases[starts], "start": times[starts], "end": times[ends - 1], "first": starts, "last": ends})
+
+class PhaseTracker:
+
+  '''
+  Online version of phaseCodes: update() takes one sample and returns its phase label, with the
+  same result as labelling the whole recording afterwards. Each update is a few comparisons.
+  '''
+
+  def __init__(self, fixes=FIXES):
+    self.fixes = fixes
+    self.labels = phaseLabels(fixes)
+    self.next = 0 # index of the next fix to reach
+    self.landed = False
+    self.lastGround = float("nan")
+    self.phase = UNDETERMINED
+    self.changes = [] # (time, phase) every time the phase changed
+
+  def update(self, dme, onGround, paused, time=None):
+    if paused > 0.5:
+      return self.setPhase(PAUSED, time)
+    if not self.landed:
+      while self.next < len(self.fixes) and dme <= self.fixes[self.next][1]:
+        self.next += 1
+      if self.next > 0 and onGround == 1 and self.lastGround == 0:
+        self.landed = True
+      self.lastGround = onGround
+    if self.landed:
+      return self.setPhase(LANDED, time)
+    return self.setPhase(self.labels[self.next - 1], time)
+
+  def updateValues(self, values, time=None):
+    '''
+    update() from a dataref -> value mapping such as XPlaneUdp.GetValues(). Datarefs not received yet are NaN.
+    '''
+    get = lambda dataref: float("nan") if values.get(dataref) is None else values.get(dataref)
+    return self.update(get(DME_DATAREF), get(GROUND_DATAREF), get(PAUSED_DATAREF), time)
+
+  def setPhase(self, phase, time):
+    if phase != self.phase:
+      self.phase = phase
+      self.changes.append((time, phase))
+    return phase
+
+def readRecording(path):
+  '''
+  Reads a recording into a DataFrame with the xplaneUdpData csv columns, from a csv or an xplane_log file
+  (xplane_log files have no sys_time column).
+  '''
+  if not path.endswith(xplane_log.EXTENSION):
+    return pd.read_csv(path)
+  header, records = xplane_log.readLog(path)
+  columns = header["columns"]
+  data = pd.DataFrame({column: records[dataref] for column, dataref in zip(columns[2:], header["datarefs"])})
+  data.insert(0, columns[1], records["time"] * 1000)
+  return data
+
+if __name__ == '__main__':
+  data = readRecording(sys.argv[1])
+  data["phase"] = labelPhases(data)
+  out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(sys.argv[1])[0] + "_phases.csv"
+  data.to_csv(out_path, index=False)
+  print(phaseSpans(data[TIME_COL], data["phase"]).to_string(index=False))
+  print("Wrote", out_path)
@@ -1,16 +1,92 @@
 # Class to get dataref values from XPlane Flight Simulator via network. 
 # License: GPLv3
 
+from array import array
+from collections.abc import Mapping
 import datetime
 
 from fileinput import filename
 import os
+import queue
 import socket
 import struct
 import binascii
+import threading
+import time
 from time import sleep
 import platform
 import csv
+import sys
+from collections import deque
+import xplane_log
+
+# Datarefs recorded for the missed approach study, in csv column order
+DATAREFS = [
+  "sim/time/total_flight_time_sec",
+  "sim/cockpit2/gauges/indicators/airspeed_kts_pilot",
+  "sim/cockpit2/engine/indicators/engine_speed_rpm[0]",
+  "sim/flightmodel2/position/alpha",
+  "sim/cockpit2/gauges/indicators/roll_electric_deg_pilot",
+  "sim/flightmodel2/gear/on_ground[0]",
+  "sim/cockpit/gyros/the_vac_ind_deg",
+  "sim/cockpit2/gauges/indicators/vvi_fpm_pilot",
+  "sim/cockpit2/gauges/indicators/altitude_ft_pilot",
+  "sim/cockpit2/gauges/indicators/heading_electric_deg_mag_pilot",
+  "sim/cockpit/radios/nav1_dme_dist_m",
+  "sim/cockpit2/radios/indicators/nav1_hdef_dots_pilot",
+  "sim/cockpit2/radios/indicators/nav1_vdef_dots_pilot",
+  "sim/cockpit2/gauges/indicators/turn_rate_roll_deg_pilot",
+  "sim/cockpit2/radios/indicators/nav1_flag_from_to_pilot",
+  "sim/time/paused",
+]
+
+# Rates (times per second) to record DATAREFS at. Attitude, flight path and gear change quickly,
+# DME and the nav flag only need to update once a second.
+RATE_GROUPS = {
+  30: [
+    "sim/cockpit2/gauges/indicators/airspeed_kts_pilot",
+    "sim/flightmodel2/position/alpha",
+    "sim/cockpit2/gauges/indicators/roll_electric_deg_pilot",
+    "sim/flightmodel2/gear/on_ground[0]",
+    "sim/cockpit/gyros/the_vac_ind_deg",
+    "sim/cockpit2/gauges/indicators/vvi_fpm_pilot",
+    "sim/cockpit2/gauges/indicators/altitude_ft_pilot",
+    "sim/cockpit2/gauges/indicators/heading_electric_deg_mag_pilot",
+    "sim/cockpit2/radios/indicators/nav1_hdef_dots_pilot",
+    "sim/cockpit2/radios/indicators/nav1_vdef_dots_pilot",
+    "sim/cockpit2/gauges/indicators/turn_rate_roll_deg_pilot",
+  ],
+  3: [
+    "sim/time/total_flight_time_sec",
+    "sim/cockpit2/engine/indicators/engine_speed_rpm[0]",
+    "sim/time/paused",
+  ],
+  1: [
+    "sim/cockpit/radios/nav1_dme_dist_m",
+    "sim/cockpit2/radios/indicators/nav1_flag_from_to_pilot",
+  ],
+}
+
+HEADERS = [
+  'sys_time', # Time format of curent system: YYYY-MM-DD HH:MM:S (PST)
+  'sys_unix_time', # Unix milliseconds (Elapsed time since midnight of January 1st 1970 in UTC)
+  'missn,_time', # Dataref: Total time since the flight got reset by something
+  '_Vind,_kias', # Dataref: Indicated airspeed in knots, pilot
+  'engn1,__rpm', # Dataref: Engine speed, revolutions per minute
+  'alpha,__deg', # Dataref: The pitch relative to the flown path (angle of attack)
+  '_roll,__deg', # Dataref: Indicated roll, in degrees, positive right. Source: electric gyro. Side: Pilot
+  '_land,groll', # Dataref: Is this wheel on the ground
+  'pitch,__deg', # Dataref: The indicated pitch on the panel for the first vacuum instrument
+  '__VVI,__fpm', # Dataref: Indicated vertical speed in feet per minute, pilot system
+  'p-alt,ftMSL', # Dataref: Indicated height, MSL, in feet, primary system, based on pilots barometric pressure input
+  'hding,__mag', # Dataref: Indicated magnetic heading, in degrees. Source: electric gyro. Side: Pilot
+  'pilN1,dme-d', # Dataref: Our distance in nautical miles from the beacon tuned in on nav1. override_navneedles
+  'pilN1,h-def', # Dataref: CDI lateral deflection in dots, nav1, pilot
+  'pilN1,v-def', # Dataref: CDI vertical deflection in dots, nav1, pilot
+  'turnrate,__deg', # Dataref: Indicated rate-of-turn, in degrees deflection, for newer roll-augmented turn-indicators. Pilot side.
+  'pi1N1,flag', # Nav-To-From indication, nav1, pilot, 0 is flag, 1 is to, 2 is from
+  'is_paused' # Is the sim paused? (TRUE for paused, FALSE otherwise)
+]
 
 class XPlaneIpNotFound(Exception):
   args="Could not find any running XPlane instance in network."
@@ -24,6 +100,181 @@ class XPlaneVersionNotSupported(Exception):
 class SenderNotHost(Exception):
   args="Packets received for another network device that isn't host."
 
+class RREFDecoder(Mapping):
+
+  '''
+  Decodes RREF answers into a fixed array of values, one slot per dataref in subscription order.
+  The payload is read in place through a memoryview with one struct.iter_unpack call, and
+  X-Plane's index of each value is turned into a slot with an array lookup, so no bytes are
+  copied and no dicts are built per packet.
+  Works as a read only dict of dataref -> latest value. Datarefs that have not been received
+  yet are missing.
+  '''
+
+  RECORD = struct.Struct("<if") # index and value of one dataref
+  HEADER = b"RREF,"
+
+  def __init__(self):
+    self.slots = array('i') # X-Plane index -> slot, -1 if not subscribed
+    self.names = [] # slot -> dataref
+    self.nameSlots = {} # dataref -> slot
+    self.values = array('d') # slot -> latest value
+    self.received = array('b') # slot -> 1 once a value came in
+
+  def add(self, idx, dataref):
+    '''
+    Gives dataref a slot for values sent with index idx. Returns the slot.
+    '''
+    if idx >= len(self.slots):
+      self.slots.extend([-1] * (idx + 1 - len(self.slots)))
+    slot = self.nameSlots.get(dataref)
+    if slot is None:
+      slot = len(self.names)
+      self.names.append(dataref)
+      self.nameSlots[dataref] = slot
+      self.values.append(0.0)
+      self.received.append(0)
+    self.slots[idx] = slot
+    return slot
+
+  def remove(self, idx):
+    '''
+    Ignores values sent with index idx from now on. The slot is kept so the layout does not change.
+    '''
+    if idx < len(self.slots) and self.slots[idx] >= 0:
+      self.received[self.slots[idx]] = 0
+      self.slots[idx] = -1
+
+  def decode(self, data):
+    '''
+    Stores the values of one RREF packet. Returns the number of values stored, or -1 if
+    the packet is not an RREF answer.
+    '''
+    view = memoryview(data)
+    if view[:5] != self.HEADER: # (was b"RREFO" for XPlane10)
+      return -1
+    # * We get 8 bytes for every dataref sent: an integer for idx and the float value.
+    end = 5 + (len(view) - 5) // 8 * 8
+    slots, values, received = self.slots, self.values, self.received
+    size = len(slots)
+    count = 0
+    for idx, value in self.RECORD.iter_unpack(view[5:end]):
+      slot = slots[idx] if 0 <= idx < size else -1
+      if slot >= 0:
+        # convert -0.0 values to positive 0.0
+        values[slot] = 0.0 if -0.001 < value < 0.0 else value
+        received[slot] = 1
+        count += 1
+    return count
+
+  def __getitem__(self, dataref):
+    slot = self.nameSlots[dataref]
+    if not self.received[slot]:
+      raise KeyError(dataref)
+    return self.values[slot]
+
+  def __iter__(self):
+    return (name for name, slot in self.nameSlots.items() if self.received[slot])
+
+  def __len__(self):
+    return sum(self.received)
+
+class SubscriptionManager:
+
+  '''
+  Keeps track of the subscribed datarefs and their rates, and sends the RREF requests.
+  - dataref <-> X-Plane index lookups are dict lookups both ways
+  - datarefs are grouped by rate, see RATE_GROUPS
+  - requests go into a send queue instead of sleeping: X-Plane can miss requests sent too
+    quickly, so at most burst requests are sent every interval seconds, each time pump() is called
+  - resubscribe() queues every subscription again, e.g. after X-Plane restarted and forgot them
+  '''
+
+  def __init__(self, send, decoder, burst=100, interval=0.2):
+    self.send = send # function that sends one request to X-Plane
+    self.decoder = decoder
+    self.burst = burst
+    self.interval = interval
+    self.datarefs = {} # X-Plane index -> dataref, subscribed datarefs only
+    self.indexes = {} # dataref -> X-Plane index, kept after unsubscribing so the index is reused
+    self.rates = {} # dataref -> times per second
+    self.groups = {} # times per second -> set of datarefs
+    self.pending = deque() # requests waiting to be sent
+    self.sentAt = 0.0 # when the current burst started
+    self.sentCount = 0
+
+  def subscribe(self, datarefs, freq):
+    '''
+    Subscribes one dataref or a list of them at freq times a second, or changes their rate.
+    freq 0 unsubscribes. Returns right away, the requests are sent by pump().
+    '''
+    if freq == 0:
+      return self.unsubscribe(datarefs)
+    datarefs = [datarefs] if isinstance(datarefs, str) else datarefs
+    for dataref in datarefs:
+      idx = self.indexes.get(dataref)
+      if idx is None:
+        idx = self.indexes[dataref] = len(self.indexes)
+      self.datarefs[idx] = dataref
+      self.decoder.add(idx, dataref)
+      self.setRate(dataref, freq)
+      self.pending.append((freq, idx, dataref))
+    self.pump()
+
+  def subscribeGroups(self, groups):
+    '''
+    Subscribes every rate group in a dict of times per second -> datarefs, see RATE_GROUPS.
+    '''
+    for freq, datarefs in groups.items():
+      self.subscribe(datarefs, freq)
+
+  def unsubscribe(self, datarefs):
+    datarefs = [datarefs] if isinstance(datarefs, str) else datarefs
+    for dataref in datarefs:
+      idx = self.indexes.get(dataref)
+      if idx is None or idx not in self.datarefs:
+        continue
+      del self.datarefs[idx]
+      self.decoder.remove(idx)
+      self.setRate(dataref, 0)
+      self.pending.append((0, idx, dataref))
+    self.pump()
+
+  def setRate(self, dataref, freq):
+    old = self.rates.pop(dataref, None)
+    if old is not None:
+      self.groups[old].discard(dataref)
+      if not self.groups[old]:
+        del self.groups[old]
+    if freq:
+      self.rates[dataref] = freq
+      self.groups.setdefault(freq, set()).add(dataref)
+
+  def resubscribe(self):
+    '''
+    Queues every current subscription again. Requests for the same dataref that are still
+    waiting are replaced.
+    '''
+    self.pending = deque(request for request in self.pending if request[0] == 0)
+    self.pending.extend((self.rates[dataref], idx, dataref) for idx, dataref in self.datarefs.items())
+    self.pump()
+
+  def pump(self, now=None, force=False):
+    '''
+    Sends waiting requests, up to burst every interval seconds (all of them if force).
+    Returns the seconds until more can be sent, 0 if nothing is waiting.
+    '''
+    now = time.monotonic() if now is None else now
+    if now - self.sentAt >= self.interval:
+      self.sentAt, self.sentCount = now, 0
+    while self.pending and (force or self.sentCount < self.burst):
+      freq, idx, dataref = self.pending.popleft()
+      self.send(struct.pack("<5sii400s", b"RREF\x00", freq, idx, dataref.encode()))
+      self.sentCount += 1
+    if not self.pending:
+      return 0.0
+    return max(self.sentAt + self.interval - now, 0.0)
+
 class XPlaneUdp:
 
   '''
@@ -38,18 +289,26 @@ class XPlaneUdp:
   def __init__(self):
     # Open a UDP Socket to receive on Port 49000
     self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    # list of requested datarefs with index number
-    self.datarefidx = 0
-    self.datarefs = {} # key = idx, value = dataref
     # values from xplane
     self.BeaconData = {}
-    self.xplaneValues = {}
+    self.xplaneValues = RREFDecoder() # latest values, read like a dict
+    self.subscriptions = SubscriptionManager(self.SendRequest, self.xplaneValues)
+    # list of requested datarefs with index number
+    self.datarefs = self.subscriptions.datarefs # key = idx, value = dataref
     self.defaultFreq = 3
+    # resubscribe when nothing came in for this many seconds (X-Plane restarted or lost the subscriptions)
+    self.staleSeconds = 2.0
+    self.stopSeconds = 0.2
 
   def __del__(self):
-    for i in range(len(self.datarefs)):
-      self.AddDataRef(next(iter(self.datarefs.values())), freq=0)
+    if self.BeaconData:
+      self.subscriptions.unsubscribe(list(self.datarefs.values()))
+      self.subscriptions.pump(force=True)
     self.socket.close()
+
+  def SendRequest(self, message):
+    self.socket.sendto(message, (self.BeaconData["IP"], self.BeaconData["Port"]))
+
   def WriteDataRef(self,dataref,value,vtype='float'):
     '''
     Write Dataref to XPlane
@@ -75,57 +334,65 @@ class XPlaneUdp:
     '''
     Configure XPlane to send the dataref with a certain frequency.
     You can disable a dataref by setting freq to 0. 
+    A list of datarefs can be passed to set them all at once, see also SubscriptionManager.
     '''
 
-    idx = -9999
-
     if freq == None:
       freq = self.defaultFreq
+    self.subscriptions.subscribe(dataref, freq)
 
-    if dataref in self.datarefs.values():
-      idx = list(self.datarefs.keys())[list(self.datarefs.values()).index(dataref)]
-      if freq == 0:
-        if dataref in self.xplaneValues.keys():
-          del self.xplaneValues[dataref]
-        del self.datarefs[idx]
-    else:
-      idx = self.datarefidx
-      self.datarefs[self.datarefidx] = dataref
-      self.datarefidx += 1
-    
-    cmd = b"RREF\x00"
-    string = dataref.encode()
-    message = struct.pack("<5sii400s", cmd, freq, idx, string)
-    assert(len(message)==413)
-    self.socket.sendto(message, (self.BeaconData["IP"], self.BeaconData["Port"]))
-    if (self.datarefidx%100 == 0):
-      sleep(0.2)
+  def AddRateGroups(self, groups):
+    '''
+    Subscribes datarefs at different rates, e.g. RATE_GROUPS.
+    '''
+    self.subscriptions.subscribeGroups(groups)
 
-  def GetValues(self):
+  def Receive(self, stop=None):
+    '''
+    Waits for the next packet. Waiting subscription requests are sent in between, and if
+    nothing arrives for staleSeconds every dataref is subscribed again. The socket timeout
+    (None: wait forever) still decides when to give up.
+    If stop (a threading.Event) is given, it is checked every stopSeconds and None is returned once it is set.
+    '''
+    timeout = self.socket.gettimeout()
+    start = quietSince = time.monotonic()
+    try:
+      while True:
+        if stop is not None and stop.is_set():
+          return None
+        now = time.monotonic()
+        wait = self.subscriptions.pump(now) or max(quietSince + self.staleSeconds - now, 0.0)
+        if timeout is not None:
+          wait = min(wait, max(start + timeout - now, 0.0))
+        if stop is not None:
+          wait = min(wait, self.stopSeconds)
+        # a 0 timeout would make the socket non-blocking (BlockingIOError instead of socket.timeout)
+        self.socket.settimeout(max(wait, 0.001))
+        try:
+          return self.socket.recvfrom(1472) # maximum bytes of an RREF answer X-Plane will send (Ethernet MTU - IP hdr - UDP hdr)
+        except socket.timeout:
+          now = time.monotonic()
+          if timeout is not None and now - start >= timeout:
+            raise
+          if now - quietSince >= self.staleSeconds and not self.subscriptions.pending:
+            self.subscriptions.resubscribe()
+            quietSince = now
+    finally:
+      self.socket.settimeout(timeout)
+
+  def GetValues(self, stop=None):
+    '''
+    Returns the values after the next packet, or None if stop was set while waiting, see Receive.
+    '''
     try:
       # Receive packet
-      data, addr = self.socket.recvfrom(1472) # maximum bytes of an RREF answer X-Plane will send (Ethernet MTU - IP hdr - UDP hdr)
+      packet = self.Receive(stop)
+      if packet is None:
+        return None
+      data, addr = packet
       # Decode Packet
-      retvalues = {}
-      # * Read the Header "RREFO".
-      header=data[0:5]
-      if(header!=b"RREF,"): # (was b"RREFO" for XPlane10)
+      if self.xplaneValues.decode(data) < 0:
         print("Unknown packet: ", binascii.hexlify(data))
-      else:
-        # * We get 8 bytes for every dataref sent:
-        #   An integer for idx and the float value. 
-        values =data[5:]
-        lenvalue = 8
-        numvalues = int(len(values)/lenvalue)
-        for i in range(0,numvalues):
-          singledata = data[(5+lenvalue*i):(5+lenvalue*(i+1))]
-          (idx,value) = struct.unpack("<if", singledata)
-          if idx in self.datarefs.keys():
-            # convert -0.0 values to positive 0.0 
-            if value < 0.0 and value > -0.001 :
-              value = 0.0
-            retvalues[self.datarefs[idx]] = value
-      self.xplaneValues.update(retvalues)
     except:
       raise XPlaneTimeout
     return self.xplaneValues
@@ -221,6 +488,160 @@ class XPlaneUdp:
 
       return self.BeaconData
 
+class XPlaneRecorder:
+
+  '''
+  Records datarefs to a csv file (or a binary log if csv_path ends with xplane_log.EXTENSION)
+  without slowing down the receiving.
+  A receive thread only reads packets and puts (time, values) on a bounded queue. A writer
+  thread formats the rows and writes them in batches, flushing the file every flush_rows rows
+  or flush_seconds seconds, whichever comes first. If the writer falls behind and the queue is
+  full, samples are dropped and counted instead of delaying the socket.
+  Packets received, dropped and written are printed every report_seconds.
+  The output is opened before the threads start, and an error in the writer stops the recording
+  and is raised again by run().
+  If a tracker (flight_phases.PhaseTracker) is given, every sample updates it and phase changes are printed.
+  '''
+
+  def __init__(self, xp, datarefs, csv_path, headers=HEADERS, queue_size=10000,
+               flush_rows=500, flush_seconds=1.0, report_seconds=1.0, timeout=60.0, tracker=None):
+    self.xp = xp
+    self.datarefs = list(datarefs)
+    self.csv_path = csv_path
+    self.headers = headers
+    self.samples = queue.Queue(maxsize=queue_size)
+    self.flush_rows = flush_rows
+    self.flush_seconds = flush_seconds
+    self.report_seconds = report_seconds
+    self.timeout = timeout # seconds without packets before the recording ends, long enough for X-Plane to restart
+    self.tracker = tracker
+    self.stopping = threading.Event()
+    self.received = 0
+    self.dropped = 0
+    self.written = 0
+    self.receiver = None
+    self.writer = None
+    self.output = None
+    self.writeRows = None
+    self.error = None
+
+  def start(self):
+    # a missing folder fails here instead of in the writer thread
+    self.output, self.writeRows = self.openOutput()
+    self.xp.socket.settimeout(self.timeout)
+    self.receiver = threading.Thread(target=self.receive, name="xplane-receive", daemon=True)
+    self.writer = threading.Thread(target=self.write, name="xplane-write", daemon=True)
+    self.receiver.start()
+    self.writer.start()
+
+  def stop(self):
+    # the writer empties the queue before it ends
+    self.stopping.set()
+    self.receiver.join()
+    self.writer.join()
+
+  def run(self):
+    '''
+    Records until X-Plane stops sending or Ctrl+C is pressed.
+    '''
+    self.start()
+    try:
+      while not self.stopping.wait(0.5):
+        pass
+    except KeyboardInterrupt:
+      print("Stopping recording")
+    self.stop()
+    if self.error is not None:
+      raise self.error
+    print("File location: ", os.path.realpath(self.csv_path), '\n')
+
+  def receive(self):
+    while not self.stopping.is_set():
+      try:
+        values = self.xp.GetValues(self.stopping)
+      except XPlaneTimeout:
+        print("XPlane Timeout")
+        self.stopping.set()
+        break
+      if values is None:
+        break
+      now = time.time()
+      self.received += 1
+      if self.tracker is not None:
+        phase = self.tracker.phase
+        if self.tracker.updateValues(values, now) != phase:
+          print("Phase:", self.tracker.phase)
+      try:
+        # datarefs X-Plane has not sent yet are left empty
+        self.samples.put_nowait((now, [values.get(ref) for ref in self.datarefs]))
+      except queue.Full:
+        self.dropped += 1
+
+  def openOutput(self):
+    '''
+    Returns the open output file and a function that writes a batch of samples to it:
+    binary records for an xplane_log.EXTENSION path, csv rows otherwise.
+    '''
+    if self.csv_path.endswith(xplane_log.EXTENSION):
+      log = xplane_log.XPlaneLogWriter(self.csv_path, self.datarefs, self.headers)
+      return log, log.writeSamples
+    csvfile = open(self.csv_path, 'w', newline="")
+    csvwriter = csv.writer(csvfile)
+    csvwriter.writerow(self.headers)
+    second, formatted_time = None, ""
+    def writeRows(batch):
+      nonlocal second, formatted_time
+      rows = []
+      for sample_time, values in batch:
+        # sys_time only changes once a second, so it is formatted once a second
+        if int(sample_time) != second:
+          second = int(sample_time)
+          formatted_time = datetime.datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append([formatted_time, sample_time * 1000] + values)
+      csvwriter.writerows(rows)
+    return csvfile, writeRows
+
+  def write(self):
+    try:
+      with self.output:
+        self.writeBatches(self.output, self.writeRows)
+    except Exception as error:
+      # run() raises it again once the receiver has stopped
+      self.error = error
+      self.stopping.set()
+
+  def writeBatches(self, output, writeRows):
+    last_flush = last_report = time.monotonic()
+    unflushed = 0
+    reported = (0, 0, 0)
+    while True:
+      try:
+        batch = [self.samples.get(timeout=min(self.flush_seconds, self.report_seconds))]
+      except queue.Empty:
+        batch = []
+        if self.stopping.is_set() and not self.receiver.is_alive():
+          break
+      while len(batch) < self.flush_rows:
+        try:
+          batch.append(self.samples.get_nowait())
+        except queue.Empty:
+          break
+
+      writeRows(batch)
+      self.written += len(batch)
+      unflushed += len(batch)
+
+      now = time.monotonic()
+      if unflushed and (unflushed >= self.flush_rows or now - last_flush >= self.flush_seconds):
+        output.flush()
+        unflushed = 0
+        last_flush = now
+      if now - last_report >= self.report_seconds:
+        counts = (self.received, self.dropped, self.written)
+        rates = [(new - old) / (now - last_report) for new, old in zip(counts, reported)]
+        print("received {:.0f}/s  dropped {:.0f}/s  written {:.0f}/s  queued {}".format(*rates, self.samples.qsize()))
+        reported, last_report = counts, now
+
 def getHostIP():
   hostName = socket.gethostname()
   hostIp = socket.gethostbyname(hostName)
@@ -229,122 +650,33 @@ def getHostIP():
 
 # Example how to use:
 # You need a running xplane in your network. 
+# Parameters:
+#   argv[1] optional file extension: .csv (default) or .xplog for the binary format in xplane_log.py
 if __name__ == '__main__':
 
   current_time = datetime.datetime.now()
   formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S")
-  file_name = current_time.strftime("%Y_%m_%d_%H_%M_%S") + ".csv"
+  file_name = current_time.strftime("%Y_%m_%d_%H_%M_%S") + (sys.argv[1] if len(sys.argv) > 1 else ".csv")
+  try:
+    # needs numpy and pandas, without them the recording runs without phase labels
+    import flight_phases
+    tracker = flight_phases.PhaseTracker(flight_phases.FIXES)
+  except ImportError as error:
+    print("Recording without flight phases:", error)
+    tracker = None
   xp = XPlaneUdp()
-  fixes = [["Start Flight",float("inf")],["Start Approach", 22.2], ["FAF", 6.3]]
-  f_iter = iter(fixes)
-  f_cur = next(f_iter)
-
-  flight_time_ref = "sim/time/total_flight_time_sec"
-  airspeed_ref = "sim/cockpit2/gauges/indicators/airspeed_kts_pilot"
-  engine_speed_ref = "sim/cockpit2/engine/indicators/engine_speed_rpm[0]"
-  alpha_ref = "sim/flightmodel2/position/alpha"
-  roll_ref = "sim/cockpit2/gauges/indicators/roll_electric_deg_pilot"
-  front_wheel_ref = "sim/flightmodel2/gear/on_ground[0]"
-  pitch_ref = "sim/cockpit/gyros/the_vac_ind_deg"
-  vvi_ref = "sim/cockpit2/gauges/indicators/vvi_fpm_pilot"
-  alt_ref = "sim/cockpit2/gauges/indicators/altitude_ft_pilot" 
-  heading_ref = "sim/cockpit2/gauges/indicators/heading_electric_deg_mag_pilot"
-  dme_ref = "sim/cockpit/radios/nav1_dme_dist_m"
-  hdef_ref = "sim/cockpit2/radios/indicators/nav1_hdef_dots_pilot"
-  vdef_ref = "sim/cockpit2/radios/indicators/nav1_vdef_dots_pilot"
-  turnrate_ref = "sim/cockpit2/gauges/indicators/turn_rate_roll_deg_pilot"
-  flag_ref = "sim/cockpit2/radios/indicators/nav1_flag_from_to_pilot"
-  pause_ref = "sim/time/paused"
-
-  headers = [
-    'sys_time', # Time format of curent system: YYYY-MM-DD HH:MM:S (PST)
-    'sys_unix_time', # Unix milliseconds (Elapsed time since midnight of January 1st 1970 in UTC)
-    'missn,_time', # Dataref: Total time since the flight got reset by something
-    '_Vind,_kias', # Dataref: Indicated airspeed in knots, pilot
-    'engn1,__rpm', # Dataref: Engine speed, revolutions per minute
-    'alpha,__deg', # Dataref: The pitch relative to the flown path (angle of attack)
-    '_roll,__deg', # Dataref: Indicated roll, in degrees, positive right. Source: electric gyro. Side: Pilot
-    '_land,groll', # Dataref: Is this wheel on the ground
-    'pitch,__deg', # Dataref: The indicated pitch on the panel for the first vacuum instrument
-    '__VVI,__fpm', # Dataref: Indicated vertical speed in feet per minute, pilot system
-    'p-alt,ftMSL', # Dataref: Indicated height, MSL, in feet, primary system, based on pilots barometric pressure input
-    'hding,__mag', # Dataref: Indicated magnetic heading, in degrees. Source: electric gyro. Side: Pilot
-    'pilN1,dme-d', # Dataref: Our distance in nautical miles from the beacon tuned in on nav1. override_navneedles
-    'pilN1,h-def', # Dataref: CDI lateral deflection in dots, nav1, pilot
-    'pilN1,v-def', # Dataref: CDI vertical deflection in dots, nav1, pilot
-    'turnrate,__deg', # Dataref: Indicated rate-of-turn, in degrees deflection, for newer roll-augmented turn-indicators. Pilot side.
-    'pi1N1,flag', # Nav-To-From indication, nav1, pilot, 0 is flag, 1 is to, 2 is from
-    'is_paused' # Is the sim paused? (TRUE for paused, FALSE otherwise)
-  ]
-
-
 
   try:
     beacon = xp.FindIp()
     print(beacon)
 
-    xp.AddDataRef(flight_time_ref)
-    xp.AddDataRef(airspeed_ref)
-    xp.AddDataRef(engine_speed_ref)
-    xp.AddDataRef(alpha_ref)
-    xp.AddDataRef(roll_ref)
-    xp.AddDataRef(front_wheel_ref)
-    xp.AddDataRef(pitch_ref)
-    xp.AddDataRef(vvi_ref)
-    xp.AddDataRef(alt_ref)
-    xp.AddDataRef(heading_ref)
-    xp.AddDataRef(dme_ref)
-    xp.AddDataRef(hdef_ref)
-    xp.AddDataRef(vdef_ref)
-    xp.AddDataRef(turnrate_ref)
-    xp.AddDataRef(flag_ref)
-    xp.AddDataRef(pause_ref)
+    xp.AddRateGroups(RATE_GROUPS)
 
     target_dir = r"C:\Users\D2Lab1\Documents\Boeing\Missed_Approach\Scripts\UDP Data"
     full_path = os.path.join(target_dir, file_name)
 
-    with open(full_path, 'w', newline="") as csvfile:
-      # creating a csv writer object
-      csvwriter = csv.writer(csvfile)
-      # writing the fields
-      csvwriter.writerow(headers)
-      file_location = os.path.realpath(csvfile.name)
-      print("File location: ", file_location, '\n')
-      
-      while True:
-        try:
-          values = xp.GetValues()
-          current_time = datetime.datetime.now()
-          formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S")
-          unix_time = current_time.timestamp() * 1000
-          row = [
-            formatted_time,
-            unix_time,
-            values[flight_time_ref],
-            values[airspeed_ref],
-            values[engine_speed_ref],
-            values[alpha_ref],
-            values[roll_ref],
-            values[front_wheel_ref],
-            values[pitch_ref],
-            values[vvi_ref],
-            values[alt_ref],
-            values[heading_ref],
-            values[dme_ref],
-            values[hdef_ref],
-            values[vdef_ref],
-            values[turnrate_ref],
-            values[flag_ref],
-            values[pause_ref],
-          ]
-          
-          csvwriter.writerow(row)
-          csvfile.flush()
-          print(current_time, 'data collected')
-        except XPlaneTimeout:
-          print("XPlane Timeout")
-          print("File location: ", file_location, '\n')
-          exit(0)
+    # rows are written in batches by a separate thread, see XPlaneRecorder
+    XPlaneRecorder(xp, DATAREFS, full_path, tracker=tracker).run()
 
   except XPlaneVersionNotSupported:
     print("XPlane Version not supported.")
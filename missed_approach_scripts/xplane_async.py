@@ -0,0 +1,320 @@
+# asyncio version of XPlaneUdp, so X-Plane can be captured in the same process as other
+# streams (GazePoint, EmbracePlus, ...) without blocking socket calls or sleeps.
+# FakeXPlane is a local stand-in for the simulator to try the client without X-Plane.
+# License: GPLv3
+
+import asyncio
+import platform
+import socket
+import struct
+import time
+from xplaneUdpData import (DATAREFS, RREFDecoder, XPlaneIpNotFound, XPlaneTimeout, XPlaneUdp,
+                           XPlaneVersionNotSupported)
+
+BEACON = struct.Struct("<BBiiIH") # major, minor, host id, version, role, port
+SUBSCRIPTION = struct.Struct("<5sii400s") # RREF request: freq, idx, dataref
+WRITES = {"float": "<5sf500s", "int": "<5si500s", "bool": "<5sI500s"}
+# X-Plane puts at most this many values in one RREF answer so it fits in 1472 bytes
+VALUES_PER_PACKET = 183
+
+def parseBeacon(packet, sender):
+  '''
+  Decodes a BECN packet into the same dict XPlaneUdp.FindIp returns. Returns None for other packets.
+  '''
+  if packet[0:5] != b"BECN\x00":
+    return None
+  major, minor, hostId, version, role, port = BEACON.unpack(packet[5:21])
+  if not (major == 1 and minor <= 2 and hostId == 1):
+    raise XPlaneVersionNotSupported()
+  hostname = packet[21:-1]
+  hostname = hostname[0:hostname.find(0)] if 0 in hostname else hostname
+  return {"IP": sender[0], "Port": port, "hostname": hostname.decode(), "XPlaneVersion": version, "role": role}
+
+class BeaconProtocol(asyncio.DatagramProtocol):
+
+  def __init__(self, found):
+    self.found = found
+
+  def datagram_received(self, data, addr):
+    if self.found.done():
+      return
+    try:
+      beacon = parseBeacon(data, addr)
+    except XPlaneVersionNotSupported as e:
+      self.found.set_exception(e)
+      return
+    if beacon:
+      self.found.set_result(beacon)
+
+async def find_ip(timeout=3.0, port=XPlaneUdp.MCAST_PORT, group=XPlaneUdp.MCAST_GRP):
+  '''
+  Waits for the first X-Plane beacon. group=None listens for beacons sent straight to port
+  instead of the multicast group (used with FakeXPlane).
+  '''
+  loop = asyncio.get_running_loop()
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  if group is None or platform.system() == "Windows":
+    sock.bind(('', port))
+  else:
+    sock.bind((group, port))
+  if group is not None:
+    mreq = struct.pack("=4sl", socket.inet_aton(group), socket.INADDR_ANY)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+  found = loop.create_future()
+  transport, _ = await loop.create_datagram_endpoint(lambda: BeaconProtocol(found), sock=sock)
+  try:
+    return await asyncio.wait_for(found, timeout)
+  except asyncio.TimeoutError:
+    raise XPlaneIpNotFound()
+  finally:
+    transport.close()
+
+class SampleProtocol(asyncio.DatagramProtocol):
+
+  '''
+  Decodes RREF answers as they arrive and queues one (unix time, values) sample per packet.
+  If nobody reads the samples the oldest ones are dropped.
+  '''
+
+  def __init__(self, decoder, samples):
+    self.decoder = decoder
+    self.samples = samples
+    self.dropped = 0
+
+  def datagram_received(self, data, addr):
+    if self.decoder.decode(data) < 0:
+      return
+    if self.samples.full():
+      self.samples.get_nowait()
+      self.dropped += 1
+    self.samples.put_nowait((time.time(), tuple(self.decoder.values)))
+
+class AsyncXPlaneUdp:
+
+  '''
+  Async client for X-Plane's UDP dataref interface.
+
+    async with AsyncXPlaneUdp(await find_ip()) as xp:
+      await xp.subscribe(DATAREFS)
+      async for unix_time, values in xp:
+        ...
+
+  values is a tuple in xp.names order (the order datarefs were first subscribed in).
+  A dataref that has not been received yet is 0.0.
+  '''
+
+  def __init__(self, beacon, queue_size=1000, timeout=5.0):
+    self.address = (beacon["IP"], beacon["Port"])
+    self.decoder = RREFDecoder()
+    self.indexes = {} # dataref -> X-Plane index
+    self.nextIndex = 0
+    self.samples = asyncio.Queue(maxsize=queue_size)
+    self.timeout = timeout # seconds without packets before iterating raises XPlaneTimeout
+    self.transport = None
+    self.protocol = None
+
+  @property
+  def names(self):
+    return self.decoder.names
+
+  async def connect(self):
+    loop = asyncio.get_running_loop()
+    # X-Plane answers to the port the subscriptions came from, so one socket sends and receives
+    self.transport, self.protocol = await loop.create_datagram_endpoint(
+      lambda: SampleProtocol(self.decoder, self.samples), local_addr=("0.0.0.0", 0))
+    return self
+
+  async def close(self):
+    if self.transport is None:
+      return
+    await self.unsubscribe(list(self.indexes))
+    self.transport.close()
+    self.transport = None
+
+  async def __aenter__(self):
+    return await self.connect()
+
+  async def __aexit__(self, *exc):
+    await self.close()
+
+  async def subscribe(self, datarefs, freq=3):
+    '''
+    Asks X-Plane to send one dataref or a list of them freq times a second.
+    X-Plane can miss subscriptions sent too quickly, so every 100 requests wait 0.2 s
+    (without blocking the other tasks).
+    '''
+    datarefs = [datarefs] if isinstance(datarefs, str) else datarefs
+    for count, dataref in enumerate(datarefs, 1):
+      idx = self.indexes.get(dataref)
+      if idx is None:
+        idx = self.indexes[dataref] = self.nextIndex
+        self.nextIndex += 1
+        self.decoder.add(idx, dataref)
+      self.send(SUBSCRIPTION.pack(b"RREF\x00", freq, idx, dataref.encode()))
+      if count % 100 == 0:
+        await asyncio.sleep(0.2)
+
+  async def unsubscribe(self, datarefs):
+    datarefs = [datarefs] if isinstance(datarefs, str) else datarefs
+    for count, dataref in enumerate(datarefs, 1):
+      idx = self.indexes.pop(dataref, None)
+      if idx is None:
+        continue
+      self.decoder.remove(idx)
+      self.send(SUBSCRIPTION.pack(b"RREF\x00", 0, idx, dataref.encode()))
+      if count % 100 == 0:
+        await asyncio.sleep(0.2)
+
+  async def write_dataref(self, dataref, value, vtype="float"):
+    '''
+    Sets a dataref in X-Plane, see XPlaneUdp.WriteDataRef.
+    '''
+    if vtype == "bool":
+      value = int(value)
+    message = struct.pack(WRITES[vtype], b"DREF\x00", value, (dataref + '\x00').ljust(500).encode())
+    assert(len(message)==509)
+    self.send(message)
+    await asyncio.sleep(0) # let other tasks run between bulk writes
+
+  def send(self, message):
+    self.transport.sendto(message, self.address)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    try:
+      return await asyncio.wait_for(self.samples.get(), self.timeout)
+    except asyncio.TimeoutError:
+      raise XPlaneTimeout()
+
+class FakeXPlaneProtocol(asyncio.DatagramProtocol):
+
+  def __init__(self, server):
+    self.server = server
+
+  def connection_made(self, transport):
+    self.server.transport = transport
+
+  def datagram_received(self, data, addr):
+    if data[0:5] == b"RREF\x00":
+      _, freq, idx, name = SUBSCRIPTION.unpack(data[:SUBSCRIPTION.size])
+      name = name.split(b"\x00", 1)[0].decode()
+      self.server.subscribe(addr, idx, name, freq)
+    elif data[0:5] == b"DREF\x00":
+      # DREF values are always read as floats, like X-Plane does
+      value, = struct.unpack("<f", data[5:9])
+      self.server.values[data[9:].split(b"\x00", 1)[0].decode().strip()] = value
+
+class FakeXPlane:
+
+  '''
+  Local UDP server that acts like X-Plane: answers RREF subscriptions with RREF answers at the
+  requested rate, takes DREF writes and can send beacons. values maps a dataref to a number or to
+  a function of the seconds since the server started; datarefs it does not know are sent as 0.0.
+
+    async with FakeXPlane({"sim/time/paused": 0.0}) as sim:
+      async with AsyncXPlaneUdp(sim.beacon()) as xp:
+        ...
+  '''
+
+  def __init__(self, values=None, host="127.0.0.1", port=0):
+    self.values = dict(values or {})
+    self.host = host
+    self.port = port
+    self.transport = None
+    self.subscriptions = {} # (client address, idx) -> [dataref, seconds between packets, next send time]
+    self.started = 0.0
+    self.sender = None
+    self.changed = None
+
+  async def __aenter__(self):
+    return await self.start()
+
+  async def __aexit__(self, *exc):
+    await self.stop()
+
+  async def start(self):
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: FakeXPlaneProtocol(self), local_addr=(self.host, self.port))
+    self.port = self.transport.get_extra_info("sockname")[1]
+    self.started = time.monotonic()
+    self.changed = asyncio.Event()
+    self.sender = asyncio.ensure_future(self.send_values())
+    return self
+
+  async def stop(self):
+    self.sender.cancel()
+    try:
+      await self.sender
+    except asyncio.CancelledError:
+      pass
+    self.transport.close()
+
+  def beacon(self):
+    return {"IP": self.host, "Port": self.port, "hostname": "fake-xplane", "XPlaneVersion": 120000, "role": 1}
+
+  def announce(self, port, host="127.0.0.1"):
+    '''
+    Sends one beacon straight to host:port, see find_ip(group=None).
+    '''
+    packet = b"BECN\x00" + BEACON.pack(1, 2, 1, 120000, 1, self.port) + b"fake-xplane\x00"
+    self.transport.sendto(packet, (host, port))
+
+  def subscribe(self, addr, idx, name, freq):
+    if freq <= 0:
+      self.subscriptions.pop((addr, idx), None)
+    else:
+      # like X-Plane, datarefs with the same rate are sent together
+      period = 1.0 / freq
+      now = time.monotonic()
+      self.subscriptions[(addr, idx)] = [name, period, now + period - (now - self.started) % period]
+    self.changed.set()
+
+  def value(self, name, now):
+    value = self.values.get(name, 0.0)
+    return float(value(now - self.started) if callable(value) else value)
+
+  async def send_values(self):
+    while True:
+      now = time.monotonic()
+      due = {}
+      for (addr, idx), sub in self.subscriptions.items():
+        if sub[2] <= now:
+          due.setdefault(addr, []).append(struct.pack("<if", idx, self.value(sub[0], now)))
+          sub[2] = max(sub[2] + sub[1], now) # a late server skips samples instead of bursting
+      for addr, records in due.items():
+        for start in range(0, len(records), VALUES_PER_PACKET):
+          self.transport.sendto(b"RREF," + b"".join(records[start:start + VALUES_PER_PACKET]), addr)
+      wait = min((sub[2] for sub in self.subscriptions.values()), default=now + 1.0) - time.monotonic()
+      self.changed.clear()
+      try:
+        await asyncio.wait_for(self.changed.wait(), max(wait, 0.0))
+      except asyncio.TimeoutError:
+        pass
+
+async def demo(seconds=2.0):
+  '''
+  Records from a FakeXPlane for a few seconds and prints what came in.
+  '''
+  values = {"sim/time/total_flight_time_sec": lambda t: t, "sim/cockpit/radios/nav1_dme_dist_m": lambda t: 25 - t}
+  async with FakeXPlane(values) as sim:
+    listener = asyncio.ensure_future(find_ip(timeout=1.0, port=49710, group=None))
+    await asyncio.sleep(0.1)
+    sim.announce(49710)
+    beacon = await listener
+    print("Found", beacon)
+    async with AsyncXPlaneUdp(beacon) as xp:
+      await xp.subscribe(DATAREFS, freq=20)
+      await xp.write_dataref("sim/time/paused", 1.0) # X-Plane reads DREF values as floats
+      count, end = 0, time.monotonic() + seconds
+      async for unix_time, sample in xp:
+        count += 1
+        if time.monotonic() > end:
+          break
+      print("{} samples in {:.1f} s, last: {}".format(count, seconds, dict(zip(xp.names, sample))))
+      print("written to the fake simulator:", {k: v for k, v in sim.values.items() if not callable(v)})
+
+if __name__ == '__main__':
+  asyncio.run(demo())
@@ -0,0 +1,126 @@
+# Fixed size binary records for X-Plane recordings, a smaller and faster to load alternative to
+# the csv files written by xplaneUdpData.XPlaneRecorder.
+#
+# File layout (little endian):
+#   MAGIC, uint32 length of the json header, json header padded with spaces to a multiple of 8 bytes
+#   records: float64 unix time in seconds, then one float32 per dataref in header order
+# The json header lists the datarefs and the csv columns to convert back to. X-Plane sends floats,
+# so float32 keeps every value exactly. Datarefs not received yet are NaN (empty in the csv).
+# A record cut off by a crash is ignored when reading.
+#
+# Parameters (converting logs to csv):
+#   argv[1..n] .xplog files or directories of them, each is written next to it as .csv
+# License: GPLv3
+
+import csv
+import datetime
+import json
+import os
+import struct
+import sys
+
+EXTENSION = ".xplog"
+MAGIC = b"XPLOG\x01\n\x00"
+LENGTH = struct.Struct("<I")
+
+def recordStruct(count):
+  return struct.Struct("<d{}f".format(count))
+
+def headerBytes(datarefs, columns):
+  header = json.dumps({"datarefs": list(datarefs), "columns": list(columns)}).encode()
+  start = len(MAGIC) + LENGTH.size
+  header += b" " * (-(start + len(header)) % 8) # records start 8 byte aligned
+  return MAGIC + LENGTH.pack(len(header)) + header
+
+def readHeader(path):
+  '''
+  Returns the json header of a log as a dict and the offset of the first record.
+  '''
+  with open(path, "rb") as logfile:
+    if logfile.read(len(MAGIC)) != MAGIC:
+      raise ValueError("{} is not an X-Plane log".format(path))
+    length, = LENGTH.unpack(logfile.read(LENGTH.size))
+    header = json.loads(logfile.read(length))
+  return header, len(MAGIC) + LENGTH.size + length
+
+class XPlaneLogWriter:
+
+  '''
+  Appends (unix time, values) samples to a new log. Only needs the standard library, so the
+  recorder does not need numpy.
+
+    with XPlaneLogWriter("flight.xplog", DATAREFS, HEADERS) as log:
+      log.writeSamples([(time.time(), values)])
+  '''
+
+  def __init__(self, path, datarefs, columns):
+    self.record = recordStruct(len(datarefs))
+    self.logfile = open(path, "wb")
+    self.logfile.write(headerBytes(datarefs, columns))
+
+  def writeSamples(self, samples):
+    pack = self.record.pack
+    nan = float("nan")
+    self.logfile.write(b"".join(
+      pack(sample_time, *(nan if value is None else value for value in values)) for sample_time, values in samples))
+
+  def flush(self):
+    self.logfile.flush()
+
+  def close(self):
+    self.logfile.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def readLog(path, mode="r"):
+  '''
+  Memory maps a log without reading it. Returns the header dict and a structured numpy array
+  with a "time" field and one field per dataref, e.g. records["sim/time/paused"].
+  '''
+  import numpy as np # only needed to read logs
+  header, offset = readHeader(path)
+  dtype = np.dtype([("time", "<f8")] + [(dataref, "<f4") for dataref in header["datarefs"]])
+  count = (os.path.getsize(path) - offset) // dtype.itemsize
+  if count == 0:
+    return header, np.zeros(0, dtype=dtype)
+  return header, np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(count,))
+
+def toCsv(log_path, csv_path=None, chunk_rows=100000):
+  '''
+  Writes a log as the csv XPlaneRecorder writes: sys_time, sys_unix_time (ms) and the dataref values,
+  with the columns stored in the log. Returns the csv path.
+  '''
+  import numpy as np
+  csv_path = csv_path or os.path.splitext(log_path)[0] + ".csv"
+  header, records = readLog(log_path)
+  datarefs = header["datarefs"]
+  second, formatted_time = None, ""
+  with open(csv_path, 'w', newline="") as csvfile:
+    csvwriter = csv.writer(csvfile)
+    csvwriter.writerow(header["columns"])
+    for start in range(0, len(records), chunk_rows):
+      chunk = records[start:start + chunk_rows]
+      values = np.empty((len(chunk), len(datarefs)))
+      for i, dataref in enumerate(datarefs):
+        values[:, i] = chunk[dataref]
+      rows = []
+      for sample_time, sample in zip(chunk["time"].tolist(), values.tolist()):
+        if int(sample_time) != second:
+          second = int(sample_time)
+          formatted_time = datetime.datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append([formatted_time, sample_time * 1000] + [None if value != value else value for value in sample])
+      csvwriter.writerows(rows)
+  return csv_path
+
+if __name__ == '__main__':
+  for arg in sys.argv[1:]:
+    if os.path.isdir(arg):
+      paths = sorted(os.path.join(arg, name) for name in os.listdir(arg) if name.endswith(EXTENSION))
+    else:
+      paths = [arg]
+    for path in paths:
+      print("Wrote", toCsv(path))
@@ -0,0 +1,151 @@
+import contextlib
+from datetime import datetime
+import io
+import os
+import sys
+import tempfile
+from time import perf_counter
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+import data_trimming as dt
+
+"""
+Checks data_trimming.py against the trimming code of 1)_Data_Trimming.ipynb on a synthetic study
+and times both. The notebook code is copied below with zoneinfo in place of pytz.
+
+The study has participants with an end time the notebook could not localize (NaT) or that is
+missing, and a participant without a GazePoint file, which have to be skipped instead of written.
+
+Parameters:
+    argv[1] optional number of participants (default 6)
+"""
+
+GAZE_ROWS = {'all_gaze': 150 * 1500, 'fixations': 3000}
+
+
+def build_study(study_dir, participants, rng):
+    """
+    Writes a 'Participant N' folder of EmbracePlus and GazePoint files per participant and returns
+    df_start_end_times. The easy task starts 10 minutes after the recordings and the hard task 35.
+    """
+    rows = []
+    for p in participants:
+        day = pd.Timestamp(f'2024-12-0{p % 5 + 1} 10:00:00', tz=dt.PST).value // 10**6
+        easy_start = day + 600_000
+        easy_end = easy_start + 1_200_000
+        hard_start = easy_end + 300_000
+        rows.append({'participant_id': p, 'easy_milliseconds_start': easy_start, 'easy_milliseconds_end': easy_end,
+                     'hard_milliseconds_start': hard_start, 'hard_milliseconds_end': hard_start + 1_500_000})
+
+        folder = os.path.join(study_dir, f'Participant {p}', 'EmbracePlus')
+        os.makedirs(folder)
+        for biomarker in dt.EMBRACEPLUS_BIOMARKERS + ['wearing-detection']:
+            times = np.arange(day, day + 4_000_000, 250 if biomarker == 'eda' else 1000)
+            pd.DataFrame({'timestamp_unix': times, 'timestamp_iso': 'x', 'participant_full_id': f'1504-1-1-{p}',
+                          'value': rng.random(len(times))}).to_csv(os.path.join(folder, f'1-1-{p}_2024-12-05_{biomarker}.csv'), index=False)
+
+        folder = os.path.join(study_dir, f'Participant {p}', 'Gazepoint')
+        os.makedirs(folder)
+        for assessment, offset in [('1', 500), ('2', 2000)]:
+            start = pd.Timestamp(day + offset * 1000, unit='ms', tz='UTC').tz_convert(dt.PST).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]
+            for eye_data, count in GAZE_ROWS.items():
+                elapsed = np.sort(rng.uniform(0, 1500, count)).round(5)
+                pd.DataFrame({'MEDIA_ID': 0, 'MEDIA_NAME': 'x', 'CNT': range(count), f'TIME({start})': elapsed,
+                              'TIMETICK': range(count), 'FPOGX': rng.random(count)}).to_csv(
+                    os.path.join(folder, f'Participant {p} Assessment {assessment}_{eye_data}.csv'), index=False)
+    return pd.DataFrame(rows)
+
+
+def notebook_embraceplus(csv_path, window_row):
+    """
+    EmbracePlusModifier of the notebook: easy and hard rows of one biomarker file.
+    """
+    df = pd.read_csv(csv_path)
+    df['participant_full_id'] = df['participant_full_id'].apply(lambda x: x.split('-')[-1]).astype('int64')
+    df.rename(columns={'participant_full_id': 'participant_id'}, inplace=True)
+    pst = ZoneInfo(dt.PST)
+    df['timestamp_pst'] = df['timestamp_unix'].apply(lambda x: datetime.fromtimestamp(x / 1000, pst).strftime('%I:%M:%S %p'))
+    df.drop('timestamp_iso', axis=1, inplace=True)
+    return [df[(df['timestamp_unix'] >= window_row[f'{task}_milliseconds_start']) & (df['timestamp_unix'] <= window_row[f'{task}_milliseconds_end'])]
+            for task in dt.TASKS]
+
+
+def notebook_gazepoint(csv_path, window_row, task):
+    """
+    GazePointModifier of the notebook: rows of one GazePoint file during the task.
+    """
+    df = pd.read_csv(csv_path)
+    time_col = df.columns[3]
+    start = datetime.strptime(time_col.replace('TIME(', '').replace(')', ''), '%Y/%m/%d %H:%M:%S.%f').replace(tzinfo=ZoneInfo(dt.PST))
+    base_time_unix_ms = int(start.timestamp() * 1000)
+    df['timestamp_unix'] = df[time_col].apply(lambda elapsed: base_time_unix_ms + int(float(elapsed) * 1000))
+    df['timestamp_pst'] = pd.to_datetime(df['timestamp_unix'], unit='ms', utc=True).dt.tz_convert(dt.PST).dt.strftime('%I:%M:%S %p')
+    return df[(df['timestamp_unix'] >= window_row[f'{task}_milliseconds_start']) & (df['timestamp_unix'] <= window_row[f'{task}_milliseconds_end'])]
+
+
+def same(out_file, reference):
+    """
+    Compares a written file with a notebook result after the same csv round trip.
+    """
+    return os.path.exists(out_file) and pd.read_csv(out_file).equals(pd.read_csv(io.StringIO(reference.to_csv(index=False))))
+
+
+def run(count):
+    rng = np.random.default_rng(count)
+    participants = list(range(4, 4 + count))
+    with tempfile.TemporaryDirectory() as tmp:
+        study_dir, out_dir = os.path.join(tmp, 'study'), os.path.join(tmp, 'out')
+        df_start_end_times = build_study(study_dir, participants, rng)
+
+        # end times the notebook could not localize: NaT // 10**6 and a missing value
+        nat_participant, nan_participant, no_file_participant = participants[1], participants[-1], participants[0]
+        df_start_end_times['easy_milliseconds_end'] = df_start_end_times['easy_milliseconds_end'].astype(float)
+        df_start_end_times.loc[df_start_end_times['participant_id'] == nat_participant, 'hard_milliseconds_end'] = np.iinfo('int64').min // 10**6
+        df_start_end_times.loc[df_start_end_times['participant_id'] == nan_participant, 'easy_milliseconds_end'] = np.nan
+        os.remove(os.path.join(study_dir, f'Participant {no_file_participant}', 'Gazepoint', f'Participant {no_file_participant} Assessment 2_fixations.csv'))
+        csv_path = os.path.join(tmp, 'df_start_end_times.csv')
+        df_start_end_times.to_csv(csv_path, index=False)
+        skipped = {(nat_participant, 'hard'), (nan_participant, 'easy')}
+
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            dt.trim_study(study_dir, out_dir, dt.TaskWindows.from_csv(csv_path))
+        script_time = perf_counter() - start
+
+        notebook_time = 0.0
+        wrong = []
+        for p in participants:
+            window_row = df_start_end_times[df_start_end_times['participant_id'] == p].iloc[0]
+            participant_dir = os.path.join(study_dir, f'Participant {p}')
+            for biomarker in dt.EMBRACEPLUS_BIOMARKERS:
+                start = perf_counter()
+                references = notebook_embraceplus(os.path.join(participant_dir, 'EmbracePlus', f'1-1-{p}_2024-12-05_{biomarker}.csv'), window_row)
+                notebook_time += perf_counter() - start
+                for task, reference in zip(dt.TASKS, references):
+                    out_file = os.path.join(out_dir, 'EmbracePlus Trimmed', f'Participant {p}', f'{biomarker}_{task}.csv')
+                    if (p, task) in skipped:
+                        wrong += [out_file] if os.path.exists(out_file) else []
+                    elif not same(out_file, reference):
+                        wrong.append(out_file)
+            for eye_data in dt.GAZEPOINT_DATA:
+                for task, assessment in dt.GAZEPOINT_ASSESSMENTS.items():
+                    in_file = os.path.join(participant_dir, 'Gazepoint', f'Participant {p} Assessment {assessment}_{eye_data}.csv')
+                    out_file = os.path.join(out_dir, 'Gazepoint Trimmed', f'Participant {p}', f'{eye_data}_{task}.csv')
+                    if (p, task) in skipped or not os.path.exists(in_file):
+                        wrong += [out_file] if os.path.exists(out_file) else []
+                        continue
+                    start = perf_counter()
+                    reference = notebook_gazepoint(in_file, window_row, task)
+                    notebook_time += perf_counter() - start
+                    if not same(out_file, reference):
+                        wrong.append(out_file)
+
+    print(f'{count:>3} participants | notebook {notebook_time:7.2f}s | data_trimming {script_time:6.2f}s | '
+          f'speedup {notebook_time / script_time:5.1f}x | output matches: {not wrong}')
+    if wrong:
+        raise AssertionError(f'data_trimming differs from the notebook in {wrong}')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 6)
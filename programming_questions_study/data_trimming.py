@@ -0,0 +1,216 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+"""
+Trims the EmbracePlus and GazePoint recordings of the programming questions study to the easy and
+hard assessment windows, like the Data Trimming section of 1)_Data_Trimming.ipynb.
+
+The task windows of every participant are read once into a TaskWindows index. Every file is then cut
+with a single searchsorted over its (sorted) unix times, and only the rows inside a window are
+formatted and written. The output folders and files are the same as the notebook's:
+    <out>/EmbracePlus Trimmed/Participant N/<biomarker>_easy.csv, <biomarker>_hard.csv
+    <out>/Gazepoint Trimmed/Participant N/all_gaze_easy.csv, fixations_hard.csv, ...
+
+Parameters:
+    argv[1] csv of df_start_end_times from 1)_Data_Trimming.ipynb
+    argv[2] study folder with one 'Participant N' folder per participant (Programming_Questions_GP_EP_m2v24)
+    argv[3] folder to save the trimmed folders in (CECS 698 - Data Analysis)
+"""
+
+TASKS = ['easy', 'hard']
+PST = 'US/Pacific'
+EMBRACEPLUS_BIOMARKERS = ['prv', 'eda', 'temperature', 'pulse-rate', 'respiratory-rate']
+GAZEPOINT_DATA = ['all_gaze', 'fixations']
+# GazePoint assessment number of each task
+GAZEPOINT_ASSESSMENTS = {'easy': '1', 'hard': '2'}
+
+
+class TaskWindows:
+    """
+    Start and end (UNIX ms, both included) of every participant's easy and hard assessment,
+    built once from df_start_end_times.
+
+    End times the notebook could not localize (ambiguous='NaT') are missing or, after its
+    astype('int64') // 10**6, far before the start. Those tasks have no window and are skipped.
+    """
+
+    def __init__(self, df_start_end_times):
+        df = df_start_end_times.sort_values('participant_id')
+        self.participants = df['participant_id'].to_numpy(dtype='int64')
+        # one row per participant: easy start, easy end, hard start, hard end. UNIX ms fit in a float exactly
+        self.bounds = df[[f'{task}_milliseconds_{edge}' for task in TASKS for edge in ['start', 'end']]].to_numpy(dtype=float)
+        self.rows = {participant: i for i, participant in enumerate(self.participants)}
+        starts, ends = self.bounds[:, 0::2], self.bounds[:, 1::2]
+        with np.errstate(invalid='ignore'):
+            self.valid = ~np.isnan(starts) & ~np.isnan(ends) & (starts <= ends)
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path))
+
+    def window(self, participant, task):
+        row = self.bounds[self.rows[participant]]
+        i = TASKS.index(task)
+        return row[2 * i], row[2 * i + 1]
+
+    def tasks(self, participant):
+        """
+        Tasks of the participant that have a start and end time.
+        """
+        valid = self.valid[self.rows[participant]]
+        return [task for i, task in enumerate(TASKS) if valid[i]]
+
+    def cut_points(self, participant, tasks=TASKS):
+        """
+        Values to searchsorted (side='left') sorted times with, giving [start, end) row positions
+        of each task in turn. The ends are moved just past the end time so it is included.
+        """
+        points = []
+        for task in tasks:
+            start, end = self.window(participant, task)
+            points += [start, np.nextafter(end, np.inf)]
+        return np.array(points, dtype=float)
+
+
+def slices(times, cut_points):
+    """
+    Row slices of the cut_points pairs, see TaskWindows.cut_points. Unsorted files fall back to a mask.
+    """
+    times = np.asarray(times, dtype=float)
+    if np.all(times[1:] >= times[:-1]):
+        positions = np.searchsorted(times, cut_points, side='left')
+        return [slice(positions[i], positions[i + 1]) for i in range(0, len(positions), 2)]
+    return [np.flatnonzero((times >= cut_points[i]) & (times < cut_points[i + 1])) for i in range(0, len(cut_points), 2)]
+
+
+def pst_times(timestamp_unix):
+    """
+    HH:MM:SS AM/PM in Pacific time. Each second is formatted once.
+    """
+    seconds, inverse = np.unique(np.asarray(timestamp_unix) // 1000, return_inverse=True)
+    formatted = pd.to_datetime(seconds, unit='s', utc=True).tz_convert(PST).strftime('%I:%M:%S %p')
+    return np.asarray(formatted)[inverse.ravel()]
+
+
+def gazepoint_timestamps(df, time_col):
+    """
+    UNIX ms of each GazePoint sample from the TIME(<recording start in PST>) column of elapsed seconds.
+    """
+    start = pd.Timestamp(time_col.replace('TIME(', '').replace(')', '').replace('/', '-')).tz_localize(PST)
+    base_time_unix_ms = start.value // 10**6
+    return base_time_unix_ms + np.trunc(df[time_col].to_numpy(dtype=float) * 1000).astype('int64')
+
+
+def print_ranges(parts):
+    """
+    parts holds the easy and hard rows, None for a skipped task.
+    """
+    try:
+        for task, part, end in zip(TASKS, parts, [' | ', '\n']):
+            times = 'skipped' if part is None else f"{part['timestamp_pst'].iloc[0]} - {part['timestamp_pst'].iloc[-1]}"
+            print(f"{task.capitalize()}: {times}", end=end)
+    except Exception as e:
+        print(f"\x1b[31m\"[[ERROR ⚠]]: {e}\"\x1b[0m")
+
+
+def trim_embraceplus(csv_path, participant, windows):
+    """
+    Easy and hard rows of one EmbracePlus biomarker file, with participant_id and timestamp_pst
+    instead of participant_full_id and timestamp_iso. Tasks without a window are None.
+    """
+    df = pd.read_csv(csv_path, usecols=lambda col: col != 'timestamp_iso')
+    tasks = windows.tasks(participant)
+    parts = dict.fromkeys(TASKS)
+    for task, rows in zip(tasks, slices(df['timestamp_unix'], windows.cut_points(participant, tasks))):
+        part = df.iloc[rows].rename(columns={'participant_full_id': 'participant_id'})
+        if 'participant_id' in part.columns:
+            # 1504-1-1-N -> N
+            part['participant_id'] = part['participant_id'].astype(str).str.split('-').str[-1].astype('int64')
+        part['timestamp_pst'] = pst_times(part['timestamp_unix'])
+        parts[task] = part
+    return list(parts.values())
+
+
+def trim_gazepoint(csv_path, participant, task, windows):
+    """
+    Rows of one GazePoint file during the task, with timestamp_unix and timestamp_pst added.
+    """
+    df = pd.read_csv(csv_path)
+    timestamp_unix = gazepoint_timestamps(df, df.columns[3])
+    rows = slices(timestamp_unix, windows.cut_points(participant, [task]))[0]
+    part = df.iloc[rows].copy()
+    part['timestamp_unix'] = timestamp_unix[rows]
+    part['timestamp_pst'] = pst_times(part['timestamp_unix'])
+    return part
+
+
+def save_parts(out_dir, participant, name, parts):
+    participant_dir = os.path.join(out_dir, f'Participant {participant}')
+    os.makedirs(participant_dir, exist_ok=True)
+    for task, part in zip(TASKS, parts):
+        if part is None:
+            continue
+        part.to_csv(os.path.join(participant_dir, f'{name}_{task}.csv'), index=False)
+
+
+def trim_participant(study_dir, out_dir, participant, windows):
+    """
+    Trims the EmbracePlus and Gazepoint folders of one participant.
+    """
+    print(f'Participant {participant}:')
+    tasks = windows.tasks(participant)
+    for task in TASKS:
+        if task not in tasks:
+            print(f'\t No {task} start/end time, {task} skipped')
+    source = os.path.join(study_dir, f'Participant {participant}', 'EmbracePlus')
+    if os.path.isdir(source):
+        files = {csv.split('_')[-1].split('.')[0]: csv for csv in os.listdir(source)}
+        for biomarker in EMBRACEPLUS_BIOMARKERS:
+            if biomarker in files:
+                print(f'\t Modifying {biomarker}...', end=' ')
+                parts = trim_embraceplus(os.path.join(source, files[biomarker]), participant, windows)
+                print_ranges(parts)
+                save_parts(os.path.join(out_dir, 'EmbracePlus Trimmed'), participant, biomarker, parts)
+
+    source = os.path.join(study_dir, f'Participant {participant}', 'Gazepoint')
+    if os.path.isdir(source):
+        # 'Participant # Assessment #_all_gaze.csv' -> '#_all_gaze'
+        files = {csv.split()[-1].split('.')[0]: csv for csv in os.listdir(source)}
+        for eye_data in GAZEPOINT_DATA:
+            print(f'\t Modifying {eye_data}...', end=' ')
+            parts, missing = [], []
+            for task in TASKS:
+                name = f'{GAZEPOINT_ASSESSMENTS[task]}_{eye_data}'
+                if task in tasks and name in files:
+                    parts.append(trim_gazepoint(os.path.join(source, files[name]), participant, task, windows))
+                else:
+                    parts.append(None)
+                    if task in tasks:
+                        missing.append(f"\t No 'Participant {participant} Assessment {name}.csv', {task} skipped")
+            print_ranges(parts)
+            for message in missing:
+                print(message)
+            save_parts(os.path.join(out_dir, 'Gazepoint Trimmed'), participant, eye_data, parts)
+
+
+def trim_study(study_dir, out_dir, windows):
+    """
+    Trims every 'Participant N' folder of the study that has task windows. Returns the participants trimmed.
+    """
+    folders = [name for name in os.listdir(study_dir) if name.startswith('Participant') and os.path.isdir(os.path.join(study_dir, name))]
+    participants = sorted(int(name.split(' ')[-1]) for name in folders)
+    trimmed = []
+    for participant in participants:
+        if participant not in windows.rows:
+            print(f'Participant {participant}: no task times, skipped')
+            continue
+        trim_participant(study_dir, out_dir, participant, windows)
+        trimmed.append(participant)
+    return trimmed
+
+
+if __name__ == '__main__':
+    windows = TaskWindows.from_csv(sys.argv[1])
+    trim_study(sys.argv[2], sys.argv[3], windows)